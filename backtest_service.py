@@ -1,8 +1,26 @@
+import itertools
 import math
+import os
+import threading
+import time
+from collections import OrderedDict
 from dataclasses import dataclass
-from typing import Any, Callable, Optional
+from typing import Any, Callable, Optional, Sequence
 
-from kline_sync_service import build_range_window, ensure_table, get_mysql_config, mysql_connect, normalize_timeframe
+import numpy as np
+
+from kline_custom_bars import fetch_custom_bar_rows, normalize_bar_spec
+from kline_dataset import LOCAL_STORE_ENV, fetch_local_rows
+from kline_features import FEATURES as STORED_FEATURES, features_enabled, load_features
+from kline_sync_service import (
+    build_range_window,
+    ensure_schema,
+    expected_bar_count,
+    get_mysql_config,
+    mysql_connect,
+    normalize_timeframe,
+    timeframe_to_ms,
+)
 
 
 @dataclass(frozen=True)
@@ -15,15 +33,11 @@ class Candle:
     volume: float
 
 
-def fetch_klines(symbol: str, timeframe: str, start_ms: int, end_ms: int) -> list[Candle]:
-    tf = normalize_timeframe(timeframe)
-    if not tf:
-        raise ValueError("invalid timeframe")
-
+def _fetch_mysql_rows(symbol: str, tf: str, start_ms: int, end_ms: int) -> list[dict]:
     cfg = get_mysql_config()
     conn = mysql_connect(cfg)
     try:
-        ensure_table(conn)
+        ensure_schema(conn)
         sql = """
         SELECT open_time_ms, open_price, high_price, low_price, close_price, volume
         FROM okx_kline
@@ -32,10 +46,38 @@ def fetch_klines(symbol: str, timeframe: str, start_ms: int, end_ms: int) -> lis
         """
         with conn.cursor() as cur:
             cur.execute(sql, (symbol, tf, int(start_ms), int(end_ms)))
-            rows = cur.fetchall() or []
+            return list(cur.fetchall() or [])
+    finally:
+        conn.close()
+
+
+def normalize_bar_type(timeframe: Any) -> Optional[str]:
+    """Time bars ("15m", "1H", ...) or custom trade bars ("volume:5000000", see kline_custom_bars)."""
+    return normalize_timeframe(timeframe) or normalize_bar_spec(timeframe)
+
+
+def _fetch_custom_bar_rows(symbol: str, spec: str, start_ms: int, end_ms: int) -> list[dict]:
+    conn = mysql_connect(get_mysql_config())
+    try:
+        return fetch_custom_bar_rows(conn, symbol, spec, start_ms, end_ms)
     finally:
         conn.close()
 
+
+def fetch_klines(symbol: str, timeframe: str, start_ms: int, end_ms: int) -> list[Candle]:
+    tf = normalize_bar_type(timeframe)
+    if not tf:
+        raise ValueError("invalid timeframe")
+
+    local_store = os.getenv(LOCAL_STORE_ENV)
+    if normalize_bar_spec(tf):
+        rows = _fetch_custom_bar_rows(symbol, tf, start_ms, end_ms)
+    elif local_store:
+        # Offline machines: read a dataset imported with `kline_dataset.py import --sqlite`.
+        rows = fetch_local_rows(local_store, symbol, tf, start_ms, end_ms)
+    else:
+        rows = _fetch_mysql_rows(symbol, tf, start_ms, end_ms)
+
     candles: list[Candle] = []
     for row in rows:
         # Some rows may have missing prices depending on upstream ingestion.
@@ -54,6 +96,176 @@ def fetch_klines(symbol: str, timeframe: str, start_ms: int, end_ms: int) -> lis
     return candles
 
 
+class _SingleFlightCache:
+    """Coalesce concurrent loads of the same key and keep results for a short TTL.
+
+    The first caller for a key runs the loader; callers arriving while it is in
+    flight wait for and share its result (or its exception). `invalidate()`
+    bumps a generation counter: loads started before it are neither cached nor
+    joined by later callers, so they cannot resurrect data read before a write.
+    """
+
+    class _Call:
+        def __init__(self, generation: int) -> None:
+            self.generation = generation
+            self.event = threading.Event()
+            self.value: Any = None
+            self.error: Optional[BaseException] = None
+
+    def __init__(self, ttl_seconds: float, max_entries: int) -> None:
+        self.ttl_seconds = float(ttl_seconds)
+        self.max_entries = int(max_entries)
+        self._lock = threading.Lock()
+        self._generation = 0
+        self._inflight: dict[Any, "_SingleFlightCache._Call"] = {}
+        self._done: "OrderedDict[Any, tuple[float, Any]]" = OrderedDict()
+
+    def get(self, key: Any, loader: Callable[[], Any]) -> Any:
+        with self._lock:
+            hit = self._done.get(key)
+            if hit is not None:
+                if hit[0] > time.monotonic():
+                    self._done.move_to_end(key)
+                    return hit[1]
+                del self._done[key]
+            call = self._inflight.get(key)
+            leader = call is None or call.generation != self._generation
+            if leader:
+                call = self._Call(self._generation)
+                self._inflight[key] = call
+
+        if not leader:
+            call.event.wait()
+        else:
+            try:
+                call.value = loader()
+            except BaseException as exc:
+                call.error = exc
+            with self._lock:
+                if self._inflight.get(key) is call:
+                    del self._inflight[key]
+                current = call.generation == self._generation
+                if call.error is None and self.ttl_seconds > 0 and current:
+                    self._done[key] = (time.monotonic() + self.ttl_seconds, call.value)
+                    while len(self._done) > self.max_entries:
+                        self._done.popitem(last=False)
+            call.event.set()
+
+        if call.error is not None:
+            raise call.error
+        return call.value
+
+    def invalidate(self, match: Optional[Callable[[Any], bool]] = None) -> None:
+        with self._lock:
+            self._generation += 1
+            if match is None:
+                self._done.clear()
+                return
+            for key in [k for k in self._done if match(k)]:
+                del self._done[key]
+
+
+_KLINE_CACHE = _SingleFlightCache(
+    ttl_seconds=float(os.getenv("KLINE_CACHE_TTL_SECONDS", "30")),
+    max_entries=int(os.getenv("KLINE_CACHE_MAX_ENTRIES", "32")),
+)
+
+
+def load_klines(symbol: str, timeframe: str, start_ms: int, end_ms: int) -> tuple[Candle, ...]:
+    """Shared, read-only variant of fetch_klines for concurrent request handlers.
+
+    Identical (symbol, timeframe, start_ms, end_ms) loads share one query and
+    one immutable tuple of candles.
+    """
+    tf = normalize_bar_type(timeframe)
+    if not tf:
+        raise ValueError("invalid timeframe")
+    key = (symbol, tf, int(start_ms), int(end_ms))
+    return _KLINE_CACHE.get(key, lambda: tuple(fetch_klines(symbol, tf, int(start_ms), int(end_ms))))
+
+
+def invalidate_kline_cache(symbol: Optional[str] = None, timeframe: Optional[str] = None) -> None:
+    tf = normalize_bar_type(timeframe) if timeframe else None
+    if symbol is None and tf is None:
+        _KLINE_CACHE.invalidate()
+        return
+    _KLINE_CACHE.invalidate(lambda k: (symbol is None or k[0] == symbol) and (tf is None or k[1] == tf))
+
+
+@dataclass(frozen=True)
+class TimeframeView:
+    """Candles of another timeframe aligned to the base candles of a run.
+
+    `index_map[i]` is the index of the last bar of this timeframe that had
+    closed by the close of base bar i, or -1 if none had closed yet, so
+    strategies can read it per bar without lookahead or re-slicing.
+    """
+
+    timeframe: str
+    candles: Sequence[Candle]
+    closes: list[float]
+    index_map: Any  # np.ndarray[int64]
+
+    def last_closed(self, idx: int) -> int:
+        return int(self.index_map[idx])
+
+    def candle_at(self, idx: int) -> Optional[Candle]:
+        j = int(self.index_map[idx])
+        return self.candles[j] if j >= 0 else None
+
+
+def _bar_close_times(ts_ms: Sequence[int], tf_ms: int) -> Any:
+    opens = np.asarray(ts_ms, dtype=np.int64)
+    closes = opens + int(tf_ms)
+    if len(opens) > 1:
+        # The next bar open is the exact close for calendar bars such as 1M.
+        np.minimum(closes[:-1], opens[1:], out=closes[:-1])
+    return closes
+
+
+def build_index_map(
+    base_candles: Sequence[Candle], base_timeframe: str, candles: Sequence[Candle], timeframe: str
+) -> Any:
+    base_close = _bar_close_times([c.ts_ms for c in base_candles], timeframe_to_ms(base_timeframe))
+    other_close = _bar_close_times([c.ts_ms for c in candles], timeframe_to_ms(timeframe))
+    return np.searchsorted(other_close, base_close, side="right").astype(np.int64) - 1
+
+
+def build_timeframe_view(
+    base_candles: Sequence[Candle], base_timeframe: str, candles: Sequence[Candle], timeframe: str
+) -> TimeframeView:
+    tf = normalize_timeframe(timeframe)
+    if not tf:
+        raise ValueError(f"invalid timeframe: {timeframe}")
+    return TimeframeView(
+        timeframe=tf,
+        candles=candles,
+        closes=[c.close for c in candles],
+        index_map=build_index_map(base_candles, base_timeframe, candles, tf),
+    )
+
+
+def fetch_timeframe_views(
+    symbol: str,
+    base_candles: Sequence[Candle],
+    base_timeframe: str,
+    timeframes: dict[str, str],
+    start_ms: int,
+    end_ms: int,
+    warmup_bars: int = 0,
+) -> dict[str, TimeframeView]:
+    """Load every extra timeframe a strategy declares, with warmup history before start_ms."""
+    views: dict[str, TimeframeView] = {}
+    for role, timeframe in timeframes.items():
+        tf = normalize_timeframe(timeframe)
+        if not tf:
+            raise ValueError(f"invalid timeframe for {role}: {timeframe}")
+        lookback_ms = max(0, int(warmup_bars)) * timeframe_to_ms(tf)
+        candles = load_klines(symbol=symbol, timeframe=tf, start_ms=int(start_ms) - lookback_ms, end_ms=end_ms)
+        views[role] = build_timeframe_view(base_candles, base_timeframe, candles, tf)
+    return views
+
+
 def _sma(values: list[float], window: int, idx: int) -> Optional[float]:
     if window <= 0:
         return None
@@ -100,6 +312,15 @@ def _rsi(values: list[float], period: int) -> list[Optional[float]]:
     return rsis
 
 
+def _stored(features: Optional[dict[str, Any]], name: str, idx: int) -> Optional[float]:
+    """Precomputed okx_kline_feature value at idx, or None when absent (callers then compute it)."""
+    column = (features or {}).get(name)
+    if column is None:
+        return None
+    value = float(column[idx])
+    return value if math.isfinite(value) else None
+
+
 def _std(values: list[float], window: int, idx: int) -> Optional[float]:
     if window <= 1:
         return None
@@ -114,29 +335,6 @@ def _std(values: list[float], window: int, idx: int) -> Optional[float]:
     return math.sqrt(var)
 
 
-def _max_drawdown(equity: list[float]) -> float:
-    peak = -float("inf")
-    max_dd = 0.0
-    for v in equity:
-        if v > peak:
-            peak = v
-        if peak > 0:
-            dd = (peak - v) / peak
-            if dd > max_dd:
-                max_dd = dd
-    return max_dd
-
-
-def _sharpe(returns: list[float]) -> Optional[float]:
-    if len(returns) < 3:
-        return None
-    mean = sum(returns) / len(returns)
-    var = sum((r - mean) ** 2 for r in returns) / (len(returns) - 1)
-    if var <= 0:
-        return None
-    return mean / math.sqrt(var)
-
-
 def _cost_rate_from_bps(bps: float) -> float:
     try:
         bps_f = float(bps)
@@ -147,18 +345,28 @@ def _cost_rate_from_bps(bps: float) -> float:
     return bps_f / 10000.0
 
 
-StrategyFn = Callable[[int, list[Candle], dict[str, Any], int], int]
+# Strategies whose meta declares "timeframes" are also called with frames=dict[str, TimeframeView].
+StrategyFn = Callable[..., int]
 
 
-def strategy_ma_crossover(idx: int, candles: list[Candle], params: dict[str, Any], current_pos: int) -> int:
-    closes = [c.close for c in candles]
+def strategy_ma_crossover(
+    idx: int,
+    candles: list[Candle],
+    params: dict[str, Any],
+    current_pos: int,
+    features: Optional[dict[str, Any]] = None,
+) -> int:
     fast = int(params.get("fast", 10))
     slow = int(params.get("slow", 30))
     if slow <= fast:
         slow = fast + 1
 
-    fast_ma = _sma(closes, fast, idx)
-    slow_ma = _sma(closes, slow, idx)
+    fast_ma = _stored(features, f"sma_{fast}", idx)
+    slow_ma = _stored(features, f"sma_{slow}", idx)
+    if fast_ma is None or slow_ma is None:
+        closes = [c.close for c in candles]
+        fast_ma = _sma(closes, fast, idx) if fast_ma is None else fast_ma
+        slow_ma = _sma(closes, slow, idx) if slow_ma is None else slow_ma
     if fast_ma is None or slow_ma is None:
         return 0
     if fast_ma > slow_ma:
@@ -168,15 +376,18 @@ def strategy_ma_crossover(idx: int, candles: list[Candle], params: dict[str, Any
     return current_pos
 
 
-def strategy_rsi_reversion(idx: int, candles: list[Candle], params: dict[str, Any], current_pos: int) -> int:
+def strategy_rsi_reversion(
+    idx: int, candles: list[Candle], params: dict[str, Any], current_pos: int, features: Optional[dict[str, Any]] = None
+) -> int:
     closes = [c.close for c in candles]
     period = int(params.get("period", 14))
     buy = float(params.get("buy_below", 30))
     sell = float(params.get("sell_above", 70))
     exit_level = float(params.get("exit_level", 50))
 
-    rsis = _rsi(closes, period)
-    r = rsis[idx]
+    r = _stored(features, f"rsi_{period}", idx)
+    if r is None:
+        r = _rsi(closes, period)[idx]
     if r is None:
         return 0
 
@@ -237,7 +448,9 @@ def strategy_donchian_breakout(idx: int, candles: list[Candle], params: dict[str
     return current_pos
 
 
-def strategy_adaptive_reversion(idx: int, candles: list[Candle], params: dict[str, Any], current_pos: int) -> int:
+def strategy_adaptive_reversion(
+    idx: int, candles: list[Candle], params: dict[str, Any], current_pos: int, features: Optional[dict[str, Any]] = None
+) -> int:
     closes = [c.close for c in candles]
     fast = int(params.get("fast", 20))
     slow = int(params.get("slow", 80))
@@ -256,8 +469,9 @@ def strategy_adaptive_reversion(idx: int, candles: list[Candle], params: dict[st
     if fast_ma is None or slow_ma is None or std is None:
         return 0
 
-    rsis = _rsi(closes, rsi_period)
-    r = rsis[idx]
+    r = _stored(features, f"rsi_{rsi_period}", idx)
+    if r is None:
+        r = _rsi(closes, rsi_period)[idx]
     if r is None or slow_ma == 0:
         return 0
 
@@ -298,7 +512,13 @@ def strategy_adaptive_reversion(idx: int, candles: list[Candle], params: dict[st
     return current_pos
 
 
-def strategy_conservative_trend(idx: int, candles: list[Candle], params: dict[str, Any], current_pos: int) -> int:
+def strategy_conservative_trend(
+    idx: int,
+    candles: list[Candle],
+    params: dict[str, Any],
+    current_pos: int,
+    features: Optional[dict[str, Any]] = None,
+) -> int:
     """Long-only trend following with strong filtering and fast exit.
 
     Design goals:
@@ -306,19 +526,22 @@ def strategy_conservative_trend(idx: int, candles: list[Candle], params: dict[st
     - Only join strong, established uptrends.
     - Cut losers quickly; let winners run but lock profits on pullback.
     """
-    closes = [c.close for c in candles]
     fast = int(params.get("fast", 20))
     slow = int(params.get("slow", 80))
     if slow <= fast:
         slow = fast + 1
     trend_min = float(params.get("trend_min", 0.01))
 
-    fast_ma = _sma(closes, fast, idx)
-    slow_ma = _sma(closes, slow, idx)
+    fast_ma = _stored(features, f"sma_{fast}", idx)
+    slow_ma = _stored(features, f"sma_{slow}", idx)
+    if fast_ma is None or slow_ma is None:
+        closes = [c.close for c in candles]
+        fast_ma = _sma(closes, fast, idx) if fast_ma is None else fast_ma
+        slow_ma = _sma(closes, slow, idx) if slow_ma is None else slow_ma
     if fast_ma is None or slow_ma is None or slow_ma <= 0:
         return 0
 
-    close = closes[idx]
+    close = candles[idx].close
     trend = (fast_ma - slow_ma) / slow_ma
 
     # Only trade strong uptrends; never short.
@@ -343,6 +566,50 @@ def strategy_conservative_trend(idx: int, candles: list[Candle], params: dict[st
     return 0
 
 
+def strategy_mtf_trend_confirm(
+    idx: int,
+    candles: list[Candle],
+    params: dict[str, Any],
+    current_pos: int,
+    frames: Optional[dict[str, TimeframeView]] = None,
+    features: Optional[dict[str, Any]] = None,
+) -> int:
+    """MA crossover on the base timeframe, only in the direction of the higher-timeframe trend."""
+    view = (frames or {}).get("trend")
+    if view is None:
+        return 0
+    fast = int(params.get("fast", 10))
+    slow = int(params.get("slow", 30))
+    if slow <= fast:
+        slow = fast + 1
+    trend_ma = int(params.get("trend_ma", 50))
+
+    fast_ma = _stored(features, f"sma_{fast}", idx)
+    slow_ma = _stored(features, f"sma_{slow}", idx)
+    if fast_ma is None or slow_ma is None:
+        closes = [c.close for c in candles]
+        fast_ma = _sma(closes, fast, idx) if fast_ma is None else fast_ma
+        slow_ma = _sma(closes, slow, idx) if slow_ma is None else slow_ma
+    j = view.last_closed(idx)
+    if fast_ma is None or slow_ma is None or j < 0:
+        return 0
+    htf_ma = _sma(view.closes, trend_ma, j)
+    if htf_ma is None:
+        return 0
+
+    htf_close = view.closes[j]
+    if fast_ma > slow_ma and htf_close > htf_ma:
+        return 1
+    if fast_ma < slow_ma and htf_close < htf_ma:
+        return -1
+    # Base signal disagrees with the higher timeframe: stay flat.
+    return 0
+
+
+# Strategies whose meta lists "sma_params" / "rsi_params" (params holding SMA windows / RSI
+# periods) are also called with features=dict[str, np.ndarray] of the stored sma_N / rsi_N
+# (okx_kline_feature) when KLINE_FEATURES=1.
+
 STRATEGIES: dict[str, dict[str, Any]] = {
     "ma_crossover": {
         "name": "MA Crossover",
@@ -373,6 +640,42 @@ STRATEGIES: dict[str, dict[str, Any]] = {
         "defaults": {"fast": 10, "slow": 30},
         "fn": strategy_ma_crossover,
         "warmup": 60,
+        "sma_params": ("fast", "slow"),
+    },
+    "mtf_trend_confirm": {
+        "name": "MTF Trend Confirm",
+        "name_zh": "多周期趋势确认",
+        "description": "Base-timeframe MA crossover, traded only in the direction of the 1H trend.",
+        "description_zh": "基础周期均线交叉，仅顺着 1H 趋势方向交易。",
+        "param_labels": {"fast": "Fast MA", "slow": "Slow MA", "trend_ma": "1H trend MA"},
+        "param_labels_zh": {"fast": "短期均线", "slow": "长期均线", "trend_ma": "1H 趋势均线"},
+        "param_help": {
+            "fast": "Short moving average window on the base timeframe.",
+            "slow": "Long moving average window on the base timeframe (must be > fast).",
+            "trend_ma": "Moving average window on closed 1H candles; price above it = uptrend.",
+        },
+        "param_help_zh": {
+            "fast": "基础周期的短期均线窗口。",
+            "slow": "基础周期的长期均线窗口（需大于短期）。",
+            "trend_ma": "已收盘 1H K 线的均线窗口；价格在其上方视为上升趋势。",
+        },
+        "param_range": {"fast": [3, 50], "slow": [10, 200], "trend_ma": [10, 200]},
+        "param_presets": {
+            "conservative": {"fast": 20, "slow": 60, "trend_ma": 100},
+            "balanced": {"fast": 10, "slow": 30, "trend_ma": 50},
+            "aggressive": {"fast": 5, "slow": 20, "trend_ma": 24},
+        },
+        "param_presets_zh": {
+            "conservative": {"name": "稳健", "params": {"fast": 20, "slow": 60, "trend_ma": 100}},
+            "balanced": {"name": "均衡", "params": {"fast": 10, "slow": 30, "trend_ma": 50}},
+            "aggressive": {"name": "激进", "params": {"fast": 5, "slow": 20, "trend_ma": 24}},
+        },
+        "defaults": {"fast": 10, "slow": 30, "trend_ma": 50},
+        "fn": strategy_mtf_trend_confirm,
+        "warmup": 60,
+        "sma_params": ("fast", "slow"),
+        "timeframes": {"trend": "1H"},
+        "timeframe_warmup": 200,
     },
     "conservative_trend": {
         "name": "Conservative Trend",
@@ -457,31 +760,30 @@ STRATEGIES: dict[str, dict[str, Any]] = {
         },
         "fn": strategy_conservative_trend,
         "warmup": 100,
+        "sma_params": ("fast", "slow"),
     },
 }
 
 
-def backtest(
-    candles: list[Candle],
-    strategy_id: str,
-    params: Optional[dict[str, Any]] = None,
-    leverage: float = 1.0,
-    fee_bps: float = 5.0,
-    slippage_bps: float = 2.0,
-) -> dict[str, Any]:
-    if strategy_id not in STRATEGIES:
-        raise ValueError(f"unknown strategy: {strategy_id}")
+@dataclass(frozen=True)
+class PositionPath:
+    """Cost-independent outcome of the signal pass.
 
-    if len(candles) < 10:
-        raise ValueError("not enough kline data for backtest")
+    Entries, exits and forced exits only look at prices, so the same path can be
+    re-priced for any fee / slippage / leverage combination.
+    """
+
+    bar_side: Any  # np.ndarray[int8], position held while marking bar i
+    bar_entry: Any  # np.ndarray[float64], entry price while marking bar i (0 when flat)
+    trade_side: Any  # np.ndarray[int8]
+    trade_entry_price: Any  # np.ndarray[float64]
+    trade_exit_price: Any  # np.ndarray[float64]
+    trade_exit_bar: Any  # np.ndarray[int64], bar whose close triggered the exit
+    trade_entry_ts: Any  # np.ndarray[int64]
+    trade_exit_ts: Any  # np.ndarray[int64]
 
-    meta = STRATEGIES[strategy_id]
-    fn: StrategyFn = meta["fn"]
-    warmup = int(meta.get("warmup", 0))
-    merged_params = dict(meta.get("defaults") or {})
-    if params:
-        merged_params.update(params)
 
+def _clamp_leverage(leverage: Any) -> float:
     try:
         lev = float(leverage)
     except Exception:
@@ -490,56 +792,79 @@ def backtest(
         lev = 1.0
     if lev > 50:
         lev = 50.0
+    return lev
 
-    cost_rate = _cost_rate_from_bps(fee_bps) + _cost_rate_from_bps(slippage_bps)
+
+def _resolve_strategy(strategy_id: str, params: Optional[dict[str, Any]]) -> tuple[dict[str, Any], dict[str, Any]]:
+    if strategy_id not in STRATEGIES:
+        raise ValueError(f"unknown strategy: {strategy_id}")
+    meta = STRATEGIES[strategy_id]
+    merged_params = dict(meta.get("defaults") or {})
+    if params:
+        merged_params.update(params)
+    return meta, merged_params
+
+
+def _check_frames(meta: dict[str, Any], frames: Optional[dict[str, TimeframeView]]) -> Optional[dict[str, TimeframeView]]:
+    required = meta.get("timeframes") or {}
+    if not required:
+        return None
+    missing = [f"{role} ({tf})" for role, tf in required.items() if role not in (frames or {})]
+    if missing:
+        raise ValueError(f"strategy requires extra timeframes: {', '.join(missing)}")
+    return frames
+
+
+def _signal_pass(
+    candles: Sequence[Candle],
+    fn: StrategyFn,
+    params: dict[str, Any],
+    warmup: int,
+    frames: Optional[dict[str, TimeframeView]] = None,
+    features: Optional[dict[str, Any]] = None,
+) -> PositionPath:
     try:
-        stop_loss_pct = float(merged_params.get("stop_loss_pct", 0.0))
+        stop_loss_pct = float(params.get("stop_loss_pct", 0.0))
     except Exception:
         stop_loss_pct = 0.0
     try:
-        take_profit_pct = float(merged_params.get("take_profit_pct", 0.0))
+        take_profit_pct = float(params.get("take_profit_pct", 0.0))
     except Exception:
         take_profit_pct = 0.0
     try:
-        max_hold_bars = int(merged_params.get("max_hold_bars", 0))
+        max_hold_bars = int(params.get("max_hold_bars", 0))
     except Exception:
         max_hold_bars = 0
 
+    extra: dict[str, Any] = {}
+    if frames is not None:
+        extra["frames"] = frames
+    if features is not None:
+        extra["features"] = features
+
+    n = len(candles)
+    bar_side = np.zeros(n, dtype=np.int8)
+    bar_entry = np.zeros(n, dtype=np.float64)
+    trades: list[tuple[int, float, float, int, int, int]] = []
+
     pos = 0
     entry_price = None
     entry_ts = None
     entry_idx = None
-    equity = 1.0
-    equity_at_entry = 1.0
-    equity_curve: list[float] = []
-    realized_returns: list[float] = []
-    trades: list[dict[str, Any]] = []
-
-    def mark_to_market(close_price: float) -> float:
-        nonlocal equity
-        if pos == 0 or entry_price is None:
-            return equity
-        if entry_price <= 0:
-            return equity
-        if pos == 1:
-            pnl = (close_price - entry_price) / entry_price
-        else:
-            pnl = (entry_price - close_price) / entry_price
-        equity = equity_at_entry * (1.0 + lev * pnl)
-        return equity
 
-    for i in range(len(candles)):
-        # mark equity at each candle close
-        mark_to_market(candles[i].close)
-        equity_curve.append(equity)
+    for i in range(n):
+        # Position marked at this candle close.
+        if pos != 0 and entry_price is not None:
+            bar_side[i] = pos
+            bar_entry[i] = entry_price
 
         # Need next candle open to execute changes
-        if i >= len(candles) - 2:
+        if i >= n - 2:
             continue
         if i < warmup:
             continue
 
-        desired = fn(i, candles, merged_params, pos)
+        desired = fn(i, candles, params, pos, **extra)
         if desired not in (-1, 0, 1):
             desired = 0
 
@@ -570,30 +895,11 @@ def backtest(
 
         # Close existing position at next open.
         if pos != 0 and entry_price is not None and next_open > 0:
-            if pos == 1:
-                gross = (next_open - entry_price) / entry_price
-            else:
-                gross = (entry_price - next_open) / entry_price
-
-            # Approx fees/slippage on notional (scaled by leverage).
-            net = lev * gross - (2.0 * cost_rate * lev)
-            equity *= 1.0 + net
-            realized_returns.append(net)
-            trades.append(
-                {
-                    "side": "LONG" if pos == 1 else "SHORT",
-                    "entry_ts_ms": int(entry_ts or 0),
-                    "entry_price": float(entry_price),
-                    "exit_ts_ms": int(next_ts),
-                    "exit_price": float(next_open),
-                    "return_pct": float(net * 100.0),
-                }
-            )
+            trades.append((pos, float(entry_price), float(next_open), i, int(entry_ts or 0), int(next_ts)))
             pos = 0
             entry_price = None
             entry_ts = None
             entry_idx = None
-            equity_at_entry = equity
 
         # Open new position at next open.
         if desired != 0 and next_open > 0 and not force_exit:
@@ -601,21 +907,139 @@ def backtest(
             entry_price = float(next_open)
             entry_ts = int(next_ts)
             entry_idx = i + 1
-            equity_at_entry = equity
 
-    total_return = (equity_curve[-1] - 1.0) if equity_curve else 0.0
-    bh_return = (candles[-1].close / candles[0].open - 1.0) if candles[0].open > 0 else 0.0
-    dd = _max_drawdown(equity_curve) if equity_curve else 0.0
+    cols = list(zip(*trades)) if trades else [(), (), (), (), (), ()]
+    return PositionPath(
+        bar_side=bar_side,
+        bar_entry=bar_entry,
+        trade_side=np.asarray(cols[0], dtype=np.int8),
+        trade_entry_price=np.asarray(cols[1], dtype=np.float64),
+        trade_exit_price=np.asarray(cols[2], dtype=np.float64),
+        trade_exit_bar=np.asarray(cols[3], dtype=np.int64),
+        trade_entry_ts=np.asarray(cols[4], dtype=np.int64),
+        trade_exit_ts=np.asarray(cols[5], dtype=np.int64),
+    )
+
+
+# Upper bound on bars x combinations priced in one block (float64 cells).
+_PRICING_BLOCK_CELLS = 4_000_000
+
+
+def _price_path(
+    path: PositionPath,
+    closes: Any,
+    leverages: Any,
+    cost_rates: Any,
+) -> dict[str, Any]:
+    """Re-price one position path for C (leverage, cost_rate) pairs at once.
+
+    Mirrors the bar loop of the original engine: equity is marked to each close
+    while in a position, and a closing trade compounds its net return on top of
+    the equity marked at the exit signal bar.
+    """
+    levs = np.asarray(leverages, dtype=np.float64)
+    costs = np.asarray(cost_rates, dtype=np.float64)
+    n_bars = len(closes)
+    n_combos = len(levs)
+
+    held = path.bar_side != 0
+    mark_pnl = np.zeros(n_bars, dtype=np.float64)
+    mark_pnl[held] = path.bar_side[held] * (closes[held] - path.bar_entry[held]) / path.bar_entry[held]
+
+    n_trades = len(path.trade_side)
+    if n_trades:
+        gross = path.trade_side * (path.trade_exit_price - path.trade_entry_price) / path.trade_entry_price
+        mark_at_exit = mark_pnl[path.trade_exit_bar]
+    else:
+        gross = np.zeros(0, dtype=np.float64)
+        mark_at_exit = np.zeros(0, dtype=np.float64)
+
+    # Approx fees/slippage on notional (scaled by leverage).
+    net = np.outer(gross, levs) - 2.0 * costs * levs  # (K, C)
+    step = (1.0 + np.outer(mark_at_exit, levs)) * (1.0 + net)
+    equity_after = np.ones((n_trades + 1, n_combos), dtype=np.float64)
+    if n_trades:
+        np.cumprod(step, axis=0, out=equity_after[1:])
+    # Number of trades already closed when bar i is marked.
+    closed_before = np.searchsorted(path.trade_exit_bar, np.arange(n_bars), side="left")
+
+    equity_end = np.empty(n_combos, dtype=np.float64)
+    max_dd = np.empty(n_combos, dtype=np.float64)
+    block = max(1, _PRICING_BLOCK_CELLS // max(1, n_bars))
+    for lo in range(0, n_combos, block):
+        hi = min(n_combos, lo + block)
+        curve = equity_after[closed_before, lo:hi] * (1.0 + np.outer(mark_pnl, levs[lo:hi]))
+        peak = np.maximum.accumulate(curve, axis=0)
+        dd = np.where(peak > 0, (peak - curve) / np.where(peak > 0, peak, 1.0), 0.0)
+        max_dd[lo:hi] = dd.max(axis=0) if n_bars else 0.0
+        equity_end[lo:hi] = curve[-1] if n_bars else 1.0
+
+    wins = net > 0
+    n_wins = wins.sum(axis=0)
+    sum_win = np.where(wins, net, 0.0).sum(axis=0) * 100.0
+    sum_loss = -np.where(wins, 0.0, net).sum(axis=0) * 100.0
+    if n_trades >= 3:
+        mean = net.mean(axis=0)
+        var = net.var(axis=0, ddof=1)
+    else:
+        mean = np.zeros(n_combos)
+        var = np.zeros(n_combos)
+
+    return {
+        "net": net,
+        "equity_end": equity_end,
+        "max_drawdown": max_dd,
+        "win_rate": (n_wins / n_trades) if n_trades else np.zeros(n_combos),
+        "profit_factor": [float(w / l) if l > 0 else None for w, l in zip(sum_win, sum_loss)],
+        "sharpe": [float(m / math.sqrt(v)) if v > 0 else None for m, v in zip(mean, var)],
+    }
+
+
+def _closes_array(candles: Sequence[Candle]) -> Any:
+    return np.fromiter((c.close for c in candles), dtype=np.float64, count=len(candles))
+
+
+def backtest(
+    candles: Sequence[Candle],
+    strategy_id: str,
+    params: Optional[dict[str, Any]] = None,
+    leverage: float = 1.0,
+    fee_bps: float = 5.0,
+    slippage_bps: float = 2.0,
+    frames: Optional[dict[str, TimeframeView]] = None,
+    features: Optional[dict[str, Any]] = None,
+) -> dict[str, Any]:
+    meta, merged_params = _resolve_strategy(strategy_id, params)
+
+    if len(candles) < 10:
+        raise ValueError("not enough kline data for backtest")
+
+    fn: StrategyFn = meta["fn"]
+    warmup = int(meta.get("warmup", 0))
+    lev = _clamp_leverage(leverage)
+    cost_rate = _cost_rate_from_bps(fee_bps) + _cost_rate_from_bps(slippage_bps)
 
-    wins = [t for t in trades if t.get("return_pct", 0.0) > 0]
-    losses = [t for t in trades if t.get("return_pct", 0.0) <= 0]
-    win_rate = (len(wins) / len(trades)) if trades else 0.0
+    path = _signal_pass(candles, fn, merged_params, warmup, _check_frames(meta, frames), features)
+    priced = _price_path(path, _closes_array(candles), [lev], [cost_rate])
 
-    sum_win = sum(t["return_pct"] for t in wins)
-    sum_loss = -sum(t["return_pct"] for t in losses)  # positive number
-    profit_factor = (sum_win / sum_loss) if sum_loss > 0 else None
+    net = priced["net"][:, 0]
+    trades: list[dict[str, Any]] = []
+    for k in range(len(net)):
+        trades.append(
+            {
+                "side": "LONG" if path.trade_side[k] == 1 else "SHORT",
+                "entry_ts_ms": int(path.trade_entry_ts[k]),
+                "entry_price": float(path.trade_entry_price[k]),
+                "exit_ts_ms": int(path.trade_exit_ts[k]),
+                "exit_price": float(path.trade_exit_price[k]),
+                "return_pct": float(net[k] * 100.0),
+            }
+        )
 
-    sharpe = _sharpe(realized_returns)
+    equity_end = float(priced["equity_end"][0])
+    bh_return = (candles[-1].close / candles[0].open - 1.0) if candles[0].open > 0 else 0.0
+    profit_factor = priced["profit_factor"][0]
+    sharpe = priced["sharpe"][0]
     return {
         "strategy": {
             "id": strategy_id,
@@ -625,21 +1049,181 @@ def backtest(
         },
         "candles": len(candles),
         "trades": len(trades),
-        "total_return_pct": float(total_return * 100.0),
+        "total_return_pct": float((equity_end - 1.0) * 100.0),
         "buy_hold_return_pct": float(bh_return * 100.0),
-        "max_drawdown_pct": float(dd * 100.0),
-        "win_rate_pct": float(win_rate * 100.0),
-        "profit_factor": None if profit_factor is None else float(profit_factor),
-        "sharpe_like": None if sharpe is None else float(sharpe),
+        "max_drawdown_pct": float(priced["max_drawdown"][0] * 100.0),
+        "win_rate_pct": float(priced["win_rate"][0] * 100.0),
+        "profit_factor": profit_factor,
+        "sharpe_like": sharpe,
         "leverage": float(lev),
         "fee_bps": float(fee_bps),
         "slippage_bps": float(slippage_bps),
         "cost_bps_total_per_side": float((cost_rate) * 10000.0),
         "trades_preview": trades[:50],
-        "equity_end": float(equity_curve[-1] if equity_curve else equity),
+        "equity_end": equity_end,
     }
 
 
+# Hard cap on grid size so a single request cannot allocate unbounded memory.
+MAX_SENSITIVITY_COMBINATIONS = 5000
+
+
+def _as_float_list(values: Any, default: float) -> list[float]:
+    if values is None:
+        return [float(default)]
+    if isinstance(values, (int, float, str)):
+        values = [values]
+    out: list[float] = []
+    for v in values:
+        try:
+            out.append(float(v))
+        except (TypeError, ValueError):
+            continue
+    return out or [float(default)]
+
+
+def backtest_sensitivity(
+    candles: Sequence[Candle],
+    strategy_id: str,
+    params: Optional[dict[str, Any]] = None,
+    leverages: Any = None,
+    fee_bps: Any = None,
+    slippage_bps: Any = None,
+    frames: Optional[dict[str, TimeframeView]] = None,
+    features: Optional[dict[str, Any]] = None,
+) -> dict[str, Any]:
+    """Run the strategy once and re-price its position path over a cost grid.
+
+    `leverages`, `fee_bps` and `slippage_bps` accept a scalar or a list; the
+    result holds one metrics row per combination of the three.
+    """
+    meta, merged_params = _resolve_strategy(strategy_id, params)
+
+    if len(candles) < 10:
+        raise ValueError("not enough kline data for backtest")
+
+    lev_values = [_clamp_leverage(v) for v in _as_float_list(leverages, 1.0)]
+    fee_values = _as_float_list(fee_bps, 5.0)
+    slip_values = _as_float_list(slippage_bps, 2.0)
+    grid = list(itertools.product(lev_values, fee_values, slip_values))
+    if len(grid) > MAX_SENSITIVITY_COMBINATIONS:
+        raise ValueError(f"too many combinations: {len(grid)} > {MAX_SENSITIVITY_COMBINATIONS}")
+
+    path = _signal_pass(
+        candles, meta["fn"], merged_params, int(meta.get("warmup", 0)), _check_frames(meta, frames), features
+    )
+    cost_rates = [_cost_rate_from_bps(f) + _cost_rate_from_bps(s) for _, f, s in grid]
+    priced = _price_path(path, _closes_array(candles), [g[0] for g in grid], cost_rates)
+
+    rows: list[dict[str, Any]] = []
+    for j, (lev, fee, slip) in enumerate(grid):
+        rows.append(
+            {
+                "leverage": float(lev),
+                "fee_bps": float(fee),
+                "slippage_bps": float(slip),
+                "cost_bps_total_per_side": float(cost_rates[j] * 10000.0),
+                "total_return_pct": float((priced["equity_end"][j] - 1.0) * 100.0),
+                "max_drawdown_pct": float(priced["max_drawdown"][j] * 100.0),
+                "win_rate_pct": float(priced["win_rate"][j] * 100.0),
+                "profit_factor": priced["profit_factor"][j],
+                "sharpe_like": priced["sharpe"][j],
+                "equity_end": float(priced["equity_end"][j]),
+            }
+        )
+
+    bh_return = (candles[-1].close / candles[0].open - 1.0) if candles[0].open > 0 else 0.0
+    return {
+        "strategy": {
+            "id": strategy_id,
+            "name": meta["name"],
+            "description": meta.get("description", ""),
+            "params": merged_params,
+        },
+        "candles": len(candles),
+        "trades": int(len(path.trade_side)),
+        "buy_hold_return_pct": float(bh_return * 100.0),
+        "combinations": len(rows),
+        "rows": rows,
+    }
+
+
+def _load_strategy_frames(
+    symbol: str, candles: Sequence[Candle], timeframe: str, strategy_id: str, start_ms: int, end_ms: int
+) -> Optional[dict[str, TimeframeView]]:
+    meta = STRATEGIES.get(strategy_id) or {}
+    timeframes = meta.get("timeframes") or {}
+    if not timeframes:
+        return None
+    if normalize_bar_spec(timeframe):
+        raise ValueError("multi-timeframe strategies need time bars, not custom bars")
+    return fetch_timeframe_views(
+        symbol,
+        candles,
+        timeframe,
+        timeframes,
+        start_ms,
+        end_ms,
+        warmup_bars=int(meta.get("timeframe_warmup", 0)),
+    )
+
+
+_STORED_PARAM_PREFIXES = (("sma_params", "sma"), ("rsi_params", "rsi"))
+
+
+def _stored_feature_names(meta: dict[str, Any], params: dict[str, Any]) -> list[str]:
+    names = []
+    for meta_key, prefix in _STORED_PARAM_PREFIXES:
+        for key in meta.get(meta_key) or ():
+            try:
+                name = f"{prefix}_{int(params[key])}"
+            except (KeyError, TypeError, ValueError):
+                continue
+            if name in STORED_FEATURES and name not in names:
+                names.append(name)
+    return names
+
+
+def load_strategy_features(
+    symbol: str,
+    candles: Sequence[Candle],
+    timeframe: str,
+    strategy_id: str,
+    params: Optional[dict[str, Any]] = None,
+) -> Optional[dict[str, Any]]:
+    """Stored SMAs/RSIs for the strategy's params when KLINE_FEATURES=1; None (no query) when none are stored."""
+    if not features_enabled() or not candles or os.getenv(LOCAL_STORE_ENV) or not normalize_timeframe(timeframe):
+        return None
+    if strategy_id not in STRATEGIES:
+        return None
+    meta, merged_params = _resolve_strategy(strategy_id, params)
+    names = _stored_feature_names(meta, merged_params)
+    if not names:
+        return None
+    try:
+        conn = mysql_connect(get_mysql_config())
+        try:
+            features = load_features(conn, symbol, timeframe, [c.ts_ms for c in candles], names)
+        finally:
+            conn.close()
+    except Exception as exc:
+        print(f"[warn] 读取预计算指标失败，改为实时计算: {exc}")
+        return None
+    return features if any(np.isfinite(v).any() for v in features.values()) else None
+
+
+def _attach_coverage(result: dict[str, Any], timeframe: str, start_ms: int, end_ms: int, count: int) -> None:
+    # Holes in okx_kline would otherwise shrink the test window silently.
+    if normalize_bar_spec(timeframe):
+        # Trade-driven bars have no expected count.
+        result["expected_candles"] = None
+        result["coverage_pct"] = None
+        return
+    expected = expected_bar_count(timeframe, start_ms, end_ms)
+    result["expected_candles"] = expected
+    result["coverage_pct"] = float(min(count, expected) / expected * 100.0) if expected else None
+
+
 def backtest_from_dates(
     symbol: str,
     timeframe: str,
@@ -652,11 +1236,13 @@ def backtest_from_dates(
     fee_bps: float = 5.0,
     slippage_bps: float = 2.0,
 ) -> dict[str, Any]:
-    tf = normalize_timeframe(timeframe)
+    tf = normalize_bar_type(timeframe)
     if not tf:
         raise ValueError("invalid timeframe")
     start_ms, end_ms = build_range_window(start_date, end_date, tf, tz_name)
-    candles = fetch_klines(symbol=symbol, timeframe=tf, start_ms=start_ms, end_ms=end_ms)
+    candles = load_klines(symbol=symbol, timeframe=tf, start_ms=start_ms, end_ms=end_ms)
+    frames = _load_strategy_frames(symbol, candles, tf, strategy_id, start_ms, end_ms)
+    features = load_strategy_features(symbol, candles, tf, strategy_id, params)
     result = backtest(
         candles=candles,
         strategy_id=strategy_id,
@@ -664,6 +1250,48 @@ def backtest_from_dates(
         leverage=leverage,
         fee_bps=fee_bps,
         slippage_bps=slippage_bps,
+        frames=frames,
+        features=features,
+    )
+    result["symbol"] = symbol
+    result["timeframe"] = tf
+    result["start_date"] = start_date
+    result["end_date"] = end_date
+    result["tz"] = tz_name
+    result["start_ms"] = int(start_ms)
+    result["end_ms"] = int(end_ms)
+    _attach_coverage(result, tf, start_ms, end_ms, len(candles))
+    return result
+
+
+def backtest_sensitivity_from_dates(
+    symbol: str,
+    timeframe: str,
+    start_date: str,
+    end_date: str,
+    tz_name: str,
+    strategy_id: str,
+    params: Optional[dict[str, Any]] = None,
+    leverages: Any = None,
+    fee_bps: Any = None,
+    slippage_bps: Any = None,
+) -> dict[str, Any]:
+    tf = normalize_bar_type(timeframe)
+    if not tf:
+        raise ValueError("invalid timeframe")
+    start_ms, end_ms = build_range_window(start_date, end_date, tf, tz_name)
+    candles = load_klines(symbol=symbol, timeframe=tf, start_ms=start_ms, end_ms=end_ms)
+    frames = _load_strategy_frames(symbol, candles, tf, strategy_id, start_ms, end_ms)
+    features = load_strategy_features(symbol, candles, tf, strategy_id, params)
+    result = backtest_sensitivity(
+        candles=candles,
+        strategy_id=strategy_id,
+        params=params,
+        leverages=leverages,
+        fee_bps=fee_bps,
+        slippage_bps=slippage_bps,
+        frames=frames,
+        features=features,
     )
     result["symbol"] = symbol
     result["timeframe"] = tf
@@ -672,4 +1300,5 @@ def backtest_from_dates(
     result["tz"] = tz_name
     result["start_ms"] = int(start_ms)
     result["end_ms"] = int(end_ms)
+    _attach_coverage(result, tf, start_ms, end_ms, len(candles))
     return result
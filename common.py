@@ -1,6 +1,8 @@
+import atexit
 import json
 import os
 import re
+import threading
 from datetime import datetime
 import sqlite3
 import pandas as pd
@@ -8,6 +10,8 @@ import time
 
 import pymysql
 
+from db_migrations import Migration, apply_migrations
+
 
 TRADE_LOG_COLUMNS = [
     "created_at", "symbol", "timeframe", "price", "price_change", "deepseek_raw", "signal", "reason",
@@ -164,23 +168,149 @@ def _create_trade_logs_table_mysql(cur):
                 ''')
 
 
+def _migrate_trade_logs_v1(conn):
+    with conn.cursor() as cur:
+        _create_trade_logs_table_mysql(cur)
+    conn.commit()
+
+
+TRADE_LOG_MIGRATIONS: list[Migration] = [
+    (1, "create trade_logs", _migrate_trade_logs_v1),
+]
+
+_ER_BAD_DB = 1049
+
+# INSERT statements are built once; every save only binds values.
+_TRADE_LOG_INSERT_MYSQL = (
+    f"INSERT INTO trade_logs ({', '.join(TRADE_LOG_COLUMNS)}) VALUES ({', '.join(['%s'] * len(TRADE_LOG_COLUMNS))})"
+)
+_TRADE_LOG_INSERT_SQLITE = (
+    f"INSERT INTO trade_logs ({', '.join(TRADE_LOG_COLUMNS)}) VALUES ({', '.join(['?'] * len(TRADE_LOG_COLUMNS))})"
+)
+
+
+class _TradeLogPool:
+    """Process-wide connections for save_trade_log.
+
+    MySQL connections are kept open between saves (up to
+    TRADE_LOG_POOL_SIZE idle ones, default 2) and pinged with reconnect
+    before reuse, so a connection dropped by the server's idle timeout is
+    re-established transparently. After MySQL fails, saves go straight to
+    SQLite for TRADE_LOG_MYSQL_RETRY_SECONDS (default 60) instead of paying
+    a connect timeout on every row. SQLite connections are cached per file.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._idle = []
+        self._cfg = None
+        self._cfg_loaded = False
+        self._down_until = 0.0
+        self._sqlite = {}
+
+    def _config(self):
+        if not self._cfg_loaded:
+            self._cfg = _mysql_config_from_env()
+            self._cfg_loaded = True
+        return self._cfg
+
+    def acquire_mysql(self):
+        """A live MySQL connection, or None when MySQL is not configured or cooling down."""
+        with self._lock:
+            cfg = self._config()
+            if cfg is None or time.monotonic() < self._down_until:
+                return None
+            conn = self._idle.pop() if self._idle else None
+        if conn is not None:
+            try:
+                conn.ping(reconnect=True)
+                return conn
+            except Exception:
+                self._close(conn)
+        try:
+            return _mysql_connect(cfg, with_database=True)
+        except Exception as e:
+            self.mark_down(e)
+            return None
+
+    def release_mysql(self, conn):
+        with self._lock:
+            if len(self._idle) < int(os.getenv("TRADE_LOG_POOL_SIZE", "2")):
+                self._idle.append(conn)
+                return
+        self._close(conn)
+
+    def discard_mysql(self, conn, error):
+        self._close(conn)
+        self.mark_down(error)
+
+    def mark_down(self, error):
+        retry = float(os.getenv("TRADE_LOG_MYSQL_RETRY_SECONDS", "60"))
+        with self._lock:
+            self._down_until = time.monotonic() + retry
+        print(f"[warn] MySQL 日志写入不可用，{retry:.0f} 秒内改写 SQLite: {error}")
+
+    def sqlite(self, db_path):
+        """Cached SQLite connection for db_path; callers hold self._lock while using it."""
+        conn = self._sqlite.get(db_path)
+        if conn is None:
+            conn = sqlite3.connect(db_path, check_same_thread=False)
+            _create_trade_logs_table_sqlite(conn.cursor())
+            conn.commit()
+            self._sqlite[db_path] = conn
+        return conn
+
+    def write_sqlite(self, db_path, params):
+        with self._lock:
+            conn = self.sqlite(db_path)
+            conn.execute(_TRADE_LOG_INSERT_SQLITE, params)
+            conn.commit()
+
+    @staticmethod
+    def _close(conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+            sqlite_conns, self._sqlite = list(self._sqlite.values()), {}
+            self._cfg_loaded = False
+            self._down_until = 0.0
+        for conn in idle + sqlite_conns:
+            self._close(conn)
+
+
+_TRADE_LOG_POOL = _TradeLogPool()
+atexit.register(_TRADE_LOG_POOL.close)
+
+
 def init_db(db_path):
-    """Initialize database schema. Use MySQL when MYSQL_* is set; otherwise fallback to SQLite."""
+    """Initialize database schema. Use MySQL when MYSQL_* is set; otherwise fallback to SQLite.
+
+    On MySQL the schema is versioned (schema_version table): once trade_logs is
+    current, startup costs one SELECT and issues no DDL.
+    """
     mysql_cfg = _mysql_config_from_env()
     if mysql_cfg:
         conn = None
         bootstrap_conn = None
         try:
-            # Create database first, then create trade_logs table.
-            bootstrap_conn = _mysql_connect(mysql_cfg, with_database=False)
-            with bootstrap_conn.cursor() as cur:
-                cur.execute(f"CREATE DATABASE IF NOT EXISTS `{mysql_cfg['database']}` CHARACTER SET utf8mb4")
-            bootstrap_conn.commit()
-
-            conn = _mysql_connect(mysql_cfg, with_database=True)
-            with conn.cursor() as cur:
-                _create_trade_logs_table_mysql(cur)
-            conn.commit()
+            try:
+                conn = _mysql_connect(mysql_cfg, with_database=True)
+            except pymysql.err.OperationalError as e:
+                if not e.args or e.args[0] != _ER_BAD_DB:
+                    raise
+                # Database does not exist yet: create it first, then reconnect.
+                bootstrap_conn = _mysql_connect(mysql_cfg, with_database=False)
+                with bootstrap_conn.cursor() as cur:
+                    cur.execute(f"CREATE DATABASE IF NOT EXISTS `{mysql_cfg['database']}` CHARACTER SET utf8mb4")
+                bootstrap_conn.commit()
+                conn = _mysql_connect(mysql_cfg, with_database=True)
+
+            apply_migrations(conn, "trade_logs", TRADE_LOG_MIGRATIONS)
             print(f"MySQL 数据库已就绪: {mysql_cfg['database']}.trade_logs")
             return
         except Exception as e:
@@ -216,7 +346,7 @@ def init_db(db_path):
 
 def save_trade_log(db_path, trade_config, price_data=None, deepseek_raw=None, signal_data=None, current_position=None,
                    operation_type=None, required_margin=None, order_status=None, updated_position=None, extra=None):
-    """Save a structured log row into MySQL (preferred) or SQLite fallback."""
+    """Save a structured log row into MySQL (preferred) or SQLite fallback, over pooled connections."""
     values = _build_trade_log_values(
         trade_config,
         price_data,
@@ -230,47 +360,32 @@ def save_trade_log(db_path, trade_config, price_data=None, deepseek_raw=None, si
         extra,
     )
 
-    mysql_cfg = _mysql_config_from_env()
-    if mysql_cfg:
-        conn = None
+    params = tuple(values[col] for col in TRADE_LOG_COLUMNS)
+
+    conn = _TRADE_LOG_POOL.acquire_mysql()
+    if conn is not None:
         try:
-            conn = _mysql_connect(mysql_cfg, with_database=True)
-            cols = ", ".join(TRADE_LOG_COLUMNS)
-            placeholders = ", ".join(["%s"] * len(TRADE_LOG_COLUMNS))
-            sql = f"INSERT INTO trade_logs ({cols}) VALUES ({placeholders})"
             with conn.cursor() as cur:
-                cur.execute(sql, tuple(values[col] for col in TRADE_LOG_COLUMNS))
+                cur.execute(_TRADE_LOG_INSERT_MYSQL, params)
             conn.commit()
+            _TRADE_LOG_POOL.release_mysql(conn)
             return
+        except (pymysql.err.OperationalError, pymysql.err.InterfaceError) as e:
+            print(f"保存日志到 MySQL 失败: {e}")
+            _TRADE_LOG_POOL.discard_mysql(conn, e)
         except Exception as e:
+            # A bad row, not a bad connection: keep the connection and MySQL in rotation.
             print(f"保存日志到 MySQL 失败: {e}")
-        finally:
             try:
-                if conn:
-                    conn.close()
-            except Exception:
-                pass
+                conn.rollback()
+                _TRADE_LOG_POOL.release_mysql(conn)
+            except Exception as rollback_error:
+                _TRADE_LOG_POOL.discard_mysql(conn, rollback_error)
 
-    conn = None
     try:
-        conn = sqlite3.connect(db_path)
-        cur = conn.cursor()
-        cur.execute('''
-                    INSERT INTO trade_logs (created_at, symbol, timeframe, price, price_change, deepseek_raw, signal,
-                                            reason, stop_loss, take_profit, confidence,
-                                            current_position, operation_type, required_margin, order_status,
-                                            updated_position, extra)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                    ''', tuple(values[col] for col in TRADE_LOG_COLUMNS))
-        conn.commit()
+        _TRADE_LOG_POOL.write_sqlite(db_path, params)
     except Exception as e:
         print(f"保存日志到 SQLite 失败: {e}")
-    finally:
-        try:
-            if conn:
-                conn.close()
-        except Exception:
-            pass
 
 
 def calculate_technical_indicators(df):
@@ -0,0 +1,78 @@
+"""Versioned schema migrations tracked in a `schema_version` table.
+
+Each component (okx_kline, trade_logs, ...) owns an ordered list of
+(version, description, apply) steps. apply_migrations only runs the steps
+newer than the recorded version, so the DDL happens once at startup/deploy
+and an up-to-date database costs a single SELECT.
+"""
+
+from typing import Any, Callable
+
+import pymysql
+
+Migration = tuple[int, str, Callable[[Any], None]]
+
+_ER_NO_SUCH_TABLE = 1146
+
+
+def _first_value(row, key: str):
+    if row is None:
+        return None
+    return row[key] if isinstance(row, dict) else row[0]
+
+
+def ensure_version_table(conn) -> None:
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS schema_version (
+                component VARCHAR(64) NOT NULL PRIMARY KEY,
+                version INT NOT NULL,
+                description VARCHAR(255),
+                applied_at DATETIME DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+            ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+            """
+        )
+    conn.commit()
+
+
+def current_version(conn, component: str) -> int:
+    """Recorded schema version of `component`; 0 when nothing has been applied yet."""
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT version FROM schema_version WHERE component=%s", (component,))
+            version = _first_value(cur.fetchone(), "version")
+    except pymysql.err.ProgrammingError as exc:
+        if exc.args and exc.args[0] == _ER_NO_SUCH_TABLE:
+            conn.rollback()
+            return 0
+        raise
+    return int(version or 0)
+
+
+def apply_migrations(conn, component: str, migrations: list[Migration]) -> list[int]:
+    """Apply pending migrations in order and return the versions that ran.
+
+    Steps must be idempotent (IF NOT EXISTS / column checks): two processes
+    starting at once may both run a step before either records it.
+    """
+    version = current_version(conn, component)
+    pending = [m for m in sorted(migrations, key=lambda m: m[0]) if m[0] > version]
+    if not pending:
+        return []
+
+    ensure_version_table(conn)
+    applied = []
+    for number, description, apply in pending:
+        apply(conn)
+        with conn.cursor() as cur:
+            cur.execute(
+                "INSERT INTO schema_version (component, version, description) VALUES (%s, %s, %s) "
+                "ON DUPLICATE KEY UPDATE version = GREATEST(version, VALUES(version)), "
+                "description = VALUES(description)",
+                (component, number, description),
+            )
+        conn.commit()
+        applied.append(number)
+        print(f"[migrate] {component} v{number}: {description}")
+    return applied
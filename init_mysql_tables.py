@@ -1,14 +1,30 @@
 from dotenv import load_dotenv
 
 import common
+from kline_custom_bars import migrate_custom_bars
+from kline_features import migrate_features
+from kline_sync_service import get_mysql_config, migrate, mysql_connect
 
 
 def main():
     load_dotenv()
     # common.init_db will prefer MySQL when MYSQL_* vars are configured.
     common.init_db("trading_logs.db")
+    if common._mysql_config_from_env() is None:
+        return
+
+    # Versioned okx_kline / sync state / backfill migrations; already-applied versions are skipped.
+    conn = mysql_connect(get_mysql_config())
+    try:
+        applied = migrate(conn)
+        applied_features = migrate_features(conn)
+        applied_custom_bars = migrate_custom_bars(conn)
+    finally:
+        conn.close()
+    print(f"okx_kline schema 已就绪，本次应用迁移: {applied or '无'}")
+    print(f"okx_kline_feature schema 已就绪，本次应用迁移: {applied_features or '无'}")
+    print(f"okx_custom_bar schema 已就绪，本次应用迁移: {applied_custom_bars or '无'}")
 
 
 if __name__ == "__main__":
     main()
-
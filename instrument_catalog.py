@@ -0,0 +1,236 @@
+import argparse
+import json
+import os
+import threading
+import time as pytime
+import zlib
+from pathlib import Path
+from typing import Optional
+
+from kline_sync_service import KLINE_SYMBOLS, _get_proxies, _request_okx, okx_api_url
+
+OKX_INSTRUMENTS_PATH = "/api/v5/public/instruments"
+INSTRUMENT_CACHE_FILE = Path(os.getenv("KLINE_INSTRUMENT_CACHE") or Path(__file__).resolve().parent / "okx_instruments.json")
+_INSTRUMENT_FIELDS = ("instId", "ctVal", "ctValCcy", "lotSz", "minSz", "tickSz", "lever", "listTime", "state")
+
+
+def inst_id_to_symbol(inst_id: str) -> str:
+    """BTC-USDT-SWAP -> BTC/USDT:USDT (inverse of _ccxt_symbol_to_inst_id for linear swaps)."""
+    base, quote = inst_id.split("-")[:2]
+    return f"{base}/{quote}:{quote}"
+
+
+def _fetch_usdt_swaps() -> dict[str, dict]:
+    rows = _request_okx(okx_api_url(OKX_INSTRUMENTS_PATH), {"instType": "SWAP"}, _get_proxies())
+    instruments = {}
+    for row in rows:
+        if row.get("settleCcy") != "USDT" or row.get("ctType") != "linear" or row.get("state") != "live":
+            continue
+        instruments[inst_id_to_symbol(row["instId"])] = {key: row.get(key) for key in _INSTRUMENT_FIELDS}
+    return instruments
+
+
+class InstrumentCatalog:
+    """Live OKX USDT-margined swaps, cached on disk for `ttl_seconds`.
+
+    The cache file (KLINE_INSTRUMENT_CACHE, default okx_instruments.json next
+    to this module) is refreshed from /api/v5/public/instruments once it is
+    older than KLINE_INSTRUMENT_TTL_SECONDS (default 6h). Lookups keep
+    answering from the cached set while a background thread reloads it; only
+    the very first load, with no cache on disk, waits for OKX. When OKX
+    cannot be reached a stale cache is used, and without any cache the
+    catalog falls back to KLINE_SYMBOLS.
+    """
+
+    def __init__(self, path: Optional[Path] = None, ttl_seconds: Optional[float] = None) -> None:
+        self.path = Path(path or INSTRUMENT_CACHE_FILE)
+        self.ttl_seconds = float(ttl_seconds or os.getenv("KLINE_INSTRUMENT_TTL_SECONDS", "21600"))
+        self._instruments: dict[str, dict] = {}
+        self._loaded_at = 0.0
+        self._fetched_at: Optional[float] = None
+        self._source = "none"
+        self._lock = threading.Lock()
+        # Held for the whole OKX round trip, so concurrent loads collapse into one request.
+        self._reload_lock = threading.Lock()
+        self._reloading = False
+
+    def _read_cache(self) -> Optional[tuple[float, dict]]:
+        try:
+            raw = json.loads(self.path.read_text(encoding="utf-8"))
+            return float(raw["fetched_at"]), dict(raw["instruments"])
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+    def _write_cache(self, fetched_at: float, instruments: dict) -> None:
+        tmp = self.path.with_suffix(".tmp")
+        tmp.write_text(json.dumps({"fetched_at": fetched_at, "instruments": instruments}, ensure_ascii=False), encoding="utf-8")
+        os.replace(tmp, self.path)
+
+    def _is_fresh(self, now: float) -> bool:
+        return bool(self._instruments) and now - self._loaded_at < self.ttl_seconds
+
+    def refresh(self, force: bool = False) -> None:
+        """Make sure the catalog is loaded; a stale one is reloaded in the background.
+
+        `force` reloads from OKX right away and waits for the result.
+        """
+        with self._lock:
+            now = pytime.time()
+            if not force:
+                if self._is_fresh(now):
+                    return
+                if not self._instruments:
+                    cached = self._read_cache()
+                    if cached is not None:
+                        self._loaded_at = self._fetched_at = cached[0]
+                        self._instruments = cached[1]
+                        self._source = "cache" if self._is_fresh(now) else "stale_cache"
+                        if self._source == "cache":
+                            return
+                if self._instruments:
+                    if not self._reloading:
+                        self._reloading = True
+                        threading.Thread(target=self._reload, name="instrument-catalog", daemon=True).start()
+                    return
+        self._reload(force=force)
+
+    def _reload(self, force: bool = False) -> None:
+        with self._reload_lock:
+            try:
+                with self._lock:
+                    if not force and self._is_fresh(pytime.time()):
+                        return
+                now = pytime.time()
+                try:
+                    instruments = _fetch_usdt_swaps()
+                    if not instruments:
+                        raise RuntimeError("OKX returned no USDT swaps")
+                except Exception as exc:
+                    with self._lock:
+                        if not self._instruments or self._source == "fallback":
+                            stale = self._read_cache()
+                            if stale is not None:
+                                self._fetched_at, self._instruments = stale
+                                self._source = "stale_cache"
+                        if self._instruments and self._source != "fallback":
+                            print(f"[warn] 合约列表刷新失败，继续使用缓存: {exc}")
+                            self._source = "stale_cache"
+                        else:
+                            print(f"[warn] 合约列表刷新失败，仅使用 KLINE_SYMBOLS: {exc}")
+                            self._instruments = {symbol: {} for symbol in KLINE_SYMBOLS}
+                            self._source = "fallback"
+                        # Try OKX again in a minute rather than after a full TTL.
+                        self._loaded_at = now - self.ttl_seconds + 60.0
+                    return
+                try:
+                    self._write_cache(now, instruments)
+                except OSError as exc:
+                    print(f"[warn] 合约列表缓存写入失败: {exc}")
+                with self._lock:
+                    self._loaded_at = self._fetched_at = now
+                    self._instruments = instruments
+                    self._source = "okx"
+            finally:
+                with self._lock:
+                    self._reloading = False
+
+    def symbols(self) -> list[str]:
+        """KLINE_SYMBOLS first, then every other catalog symbol alphabetically."""
+        self.refresh()
+        rest = sorted(set(self._instruments) - set(KLINE_SYMBOLS))
+        return [*KLINE_SYMBOLS, *rest]
+
+    def get(self, symbol: str) -> Optional[dict]:
+        self.refresh()
+        return self._instruments.get(symbol)
+
+    def __contains__(self, symbol: str) -> bool:
+        # The configured pairs stay valid even when OKX delists them (their history is still stored).
+        if symbol in KLINE_SYMBOLS:
+            return True
+        self.refresh()
+        return symbol in self._instruments
+
+    def info(self) -> dict:
+        self.refresh()
+        return {
+            "source": self._source,
+            "count": len(self._instruments),
+            "fetched_at_ms": int(self._fetched_at * 1000) if self._fetched_at else None,
+            "cache_file": str(self.path),
+        }
+
+
+_CATALOG: Optional[InstrumentCatalog] = None
+_CATALOG_LOCK = threading.Lock()
+
+
+def get_instrument_catalog() -> InstrumentCatalog:
+    global _CATALOG
+    if _CATALOG is None:
+        with _CATALOG_LOCK:
+            if _CATALOG is None:
+                _CATALOG = InstrumentCatalog()
+    return _CATALOG
+
+
+def is_supported_symbol(symbol: str) -> bool:
+    return symbol in get_instrument_catalog()
+
+
+def resolve_symbols(values: Optional[list[str]], default: Optional[list[str]] = None) -> list[str]:
+    """CLI/API symbol lists: None -> `default` (KLINE_SYMBOLS), ["all"] -> whole catalog; unknown symbols raise."""
+    if not values:
+        return list(default or KLINE_SYMBOLS)
+    if [v.lower() for v in values] == ["all"]:
+        return get_instrument_catalog().symbols()
+    unknown = [s for s in values if not is_supported_symbol(s)]
+    if unknown:
+        raise ValueError(f"unsupported symbol: {', '.join(unknown)}")
+    return list(dict.fromkeys(values))
+
+
+def sync_universe() -> list[str]:
+    """Symbols kept current by the daemon: KLINE_SYNC_UNIVERSE=all selects the whole catalog."""
+    if os.getenv("KLINE_SYNC_UNIVERSE", "").strip().lower() == "all":
+        return get_instrument_catalog().symbols()
+    return list(KLINE_SYMBOLS)
+
+
+def parse_shard(text: str) -> tuple[int, int]:
+    """'2/8' -> (2, 8); shard indexes are zero-based."""
+    try:
+        index, count = (int(part) for part in str(text).split("/"))
+    except ValueError:
+        raise ValueError(f"invalid shard {text!r}, expected INDEX/COUNT") from None
+    if count < 1 or not 0 <= index < count:
+        raise ValueError(f"invalid shard {text!r}, expected 0 <= INDEX < COUNT")
+    return index, count
+
+
+def shard_symbols(symbols: list[str], index: int, count: int) -> list[str]:
+    """Stable subset of `symbols` for shard index/count (crc32, so every process agrees)."""
+    if count <= 1:
+        return list(symbols)
+    return [s for s in symbols if zlib.crc32(s.encode()) % count == index]
+
+
+def main(argv=None) -> None:
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="OKX USDT swap instrument catalog")
+    parser.add_argument("--refresh", action="store_true", help="Ignore the cache and reload from OKX")
+    parser.add_argument("--shard", default=None, help="Only list symbols of shard INDEX/COUNT")
+    args = parser.parse_args(argv)
+
+    catalog = get_instrument_catalog()
+    catalog.refresh(force=args.refresh)
+    symbols = catalog.symbols()
+    if args.shard:
+        symbols = shard_symbols(symbols, *parse_shard(args.shard))
+    print(json.dumps({**catalog.info(), "symbols": symbols}, indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,244 @@
+import argparse
+import json
+from typing import Optional
+
+from kline_features import features_enabled, refresh_features
+from kline_sync_service import (
+    OKX_PAGE_LIMIT,
+    TIMEFRAME_MS,
+    build_range_window,
+    ensure_schema,
+    expected_bar_count,
+    fetch_okx_ohlcv_range,
+    get_mysql_config,
+    mysql_connect,
+    normalize_timeframe,
+    probe_older_candle,
+    upsert_rows,
+)
+
+
+def _load_job(conn, symbol: str, timeframe: str, start_ms: int, end_ms: int) -> dict:
+    with conn.cursor() as cur:
+        cur.execute(
+            "INSERT IGNORE INTO okx_kline_backfill_job (symbol, timeframe, start_ms, end_ms, cursor_ms) "
+            "VALUES (%s, %s, %s, %s, %s)",
+            (symbol, timeframe, int(start_ms), int(end_ms), int(end_ms)),
+        )
+        cur.execute(
+            "SELECT * FROM okx_kline_backfill_job WHERE symbol=%s AND timeframe=%s AND start_ms=%s AND end_ms=%s",
+            (symbol, timeframe, int(start_ms), int(end_ms)),
+        )
+        job = cur.fetchone()
+    conn.commit()
+    return job
+
+
+def _set_status(conn, job_id: int, status: str, error: Optional[str] = None) -> None:
+    with conn.cursor() as cur:
+        cur.execute(
+            "UPDATE okx_kline_backfill_job SET status=%s, last_error=%s WHERE id=%s",
+            (status, error, int(job_id)),
+        )
+    conn.commit()
+
+
+def completeness(conn, symbol: str, timeframe: str, start_ms: int, end_ms: int) -> dict:
+    with conn.cursor() as cur:
+        cur.execute(
+            "SELECT COUNT(*) AS n FROM okx_kline WHERE symbol=%s AND timeframe=%s "
+            "AND open_time_ms >= %s AND open_time_ms < %s",
+            (symbol, timeframe, int(start_ms), int(end_ms)),
+        )
+        stored = int((cur.fetchone() or {}).get("n") or 0)
+    expected = expected_bar_count(timeframe, start_ms, end_ms)
+    return {
+        "stored": stored,
+        "expected": expected,
+        "completeness_pct": (min(stored, expected) / expected * 100.0) if expected else None,
+    }
+
+
+def run_backfill(
+    symbol: str,
+    timeframe: str,
+    start_ms: int,
+    end_ms: int,
+    batch_pages: int = 20,
+    conn=None,
+) -> dict:
+    """Download [start_ms, end_ms) backward in committed batches, resuming from the saved cursor.
+
+    Each batch (batch_pages pages, fetched concurrently) is upserted in the same
+    transaction that moves the job cursor, so a crash loses at most one batch.
+    There is no page cap, and memory is bounded by one batch.
+    """
+    tf = normalize_timeframe(timeframe)
+    if not tf:
+        raise ValueError("invalid timeframe")
+    if start_ms >= end_ms:
+        raise ValueError("start must be before end")
+
+    own_conn = conn is None
+    if own_conn:
+        conn = mysql_connect(get_mysql_config())
+    try:
+        ensure_schema(conn)
+        job = _load_job(conn, symbol, tf, start_ms, end_ms)
+        job_id = int(job["id"])
+        cursor_ms = int(job["cursor_ms"])
+        pages = int(job["pages"])
+        fetched = int(job["fetched"])
+        if job["status"] != "done":
+            _set_status(conn, job_id, "running")
+
+        span = TIMEFRAME_MS[tf] * OKX_PAGE_LIMIT * max(1, int(batch_pages))
+        try:
+            while cursor_ms > start_ms and job["status"] != "done":
+                # 1M candles have no fixed span; the whole remainder is only a few pages.
+                batch_lo = start_ms if tf == "1M" else max(start_ms, cursor_ms - span)
+                rows = fetch_okx_ohlcv_range(symbol, tf, batch_lo, cursor_ms)
+                next_cursor = batch_lo
+                if not rows:
+                    # Empty stretch (before listing or exchange downtime): jump to older data, if any.
+                    older = probe_older_candle(symbol, tf, batch_lo)
+                    next_cursor = start_ms if older is None or older < start_ms else max(start_ms, older + 1)
+                batch_page_count = -(-len(rows) // OKX_PAGE_LIMIT) if rows else 1
+                upsert_rows(conn, symbol, tf, rows, commit=False)
+                with conn.cursor() as cur:
+                    cur.execute(
+                        "UPDATE okx_kline_backfill_job "
+                        "SET cursor_ms=%s, pages=pages+%s, fetched=fetched+%s, last_error=NULL WHERE id=%s",
+                        (int(next_cursor), batch_page_count, len(rows), job_id),
+                    )
+                conn.commit()
+                cursor_ms = next_cursor
+                pages += batch_page_count
+                fetched += len(rows)
+        except Exception as exc:
+            try:
+                conn.rollback()
+            except Exception:
+                pass
+            _set_status(conn, job_id, "failed", str(exc))
+            raise
+
+        if job["status"] != "done":
+            _set_status(conn, job_id, "done")
+        if features_enabled():
+            refresh_features(conn, symbol, tf, changed_from_ms=start_ms)
+        report = completeness(conn, symbol, tf, start_ms, end_ms)
+    finally:
+        if own_conn:
+            conn.close()
+
+    return {
+        "job_id": job_id,
+        "symbol": symbol,
+        "timeframe": tf,
+        "start_ms": int(start_ms),
+        "end_ms": int(end_ms),
+        "status": "done",
+        "pages": pages,
+        "fetched": fetched,
+        **report,
+    }
+
+
+def list_backfill_jobs(status: Optional[str] = None) -> list[dict]:
+    conn = mysql_connect(get_mysql_config())
+    try:
+        ensure_schema(conn)
+        with conn.cursor() as cur:
+            if status:
+                cur.execute("SELECT * FROM okx_kline_backfill_job WHERE status=%s ORDER BY id", (status,))
+            else:
+                cur.execute("SELECT * FROM okx_kline_backfill_job ORDER BY id")
+            jobs = list(cur.fetchall() or [])
+    finally:
+        conn.close()
+    for job in jobs:
+        for key in ("created_at", "updated_at"):
+            if job.get(key) is not None:
+                job[key] = str(job[key])
+    return jobs
+
+
+def _record_failure(job_id: int, error: str) -> None:
+    # Failures outside the download loop (connect, schema, completeness) would otherwise leave no trace.
+    try:
+        conn = mysql_connect(get_mysql_config())
+        try:
+            with conn.cursor() as cur:
+                cur.execute(
+                    "UPDATE okx_kline_backfill_job SET status='failed', last_error=%s WHERE id=%s AND status <> 'done'",
+                    (error, int(job_id)),
+                )
+            conn.commit()
+        finally:
+            conn.close()
+    except Exception as exc:
+        print(f"[warn] 回填任务 {job_id} 的错误无法写入数据库: {exc}")
+
+
+def resume_backfills() -> list[dict]:
+    """Continue every job that did not reach 'done' (e.g. after a crash or restart).
+
+    A failing job is marked 'failed' with its error and the remaining jobs
+    still run; its entry in the result carries "error".
+    """
+    results = []
+    for job in list_backfill_jobs():
+        if job["status"] == "done":
+            continue
+        try:
+            results.append(run_backfill(job["symbol"], job["timeframe"], int(job["start_ms"]), int(job["end_ms"])))
+        except Exception as exc:
+            print(f"[warn] 回填任务 {job['id']} ({job['symbol']} {job['timeframe']}) 失败: {exc}")
+            _record_failure(job["id"], str(exc))
+            results.append(
+                {
+                    "job_id": int(job["id"]),
+                    "symbol": job["symbol"],
+                    "timeframe": job["timeframe"],
+                    "start_ms": int(job["start_ms"]),
+                    "end_ms": int(job["end_ms"]),
+                    "status": "failed",
+                    "error": str(exc),
+                }
+            )
+    return results
+
+
+def main(argv=None) -> None:
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Resumable okx_kline backfill")
+    sub = parser.add_subparsers(dest="command", required=True)
+    run_p = sub.add_parser("run", help="Start or resume one backfill window")
+    run_p.add_argument("--symbol", required=True, help="Symbol, e.g. BTC/USDT:USDT")
+    run_p.add_argument("--timeframe", required=True)
+    run_p.add_argument("--start-date", required=True, help="YYYY-MM-DD")
+    run_p.add_argument("--end-date", required=True, help="YYYY-MM-DD")
+    run_p.add_argument("--tz", default="Asia/Shanghai")
+    run_p.add_argument("--batch-pages", type=int, default=20)
+    sub.add_parser("resume", help="Resume every unfinished job")
+    sub.add_parser("list", help="List jobs")
+    args = parser.parse_args(argv)
+
+    if args.command == "run":
+        tf = normalize_timeframe(args.timeframe)
+        if not tf:
+            parser.error("invalid timeframe")
+        start_ms, end_ms = build_range_window(args.start_date, args.end_date, tf, args.tz)
+        result = run_backfill(args.symbol, tf, start_ms, end_ms, batch_pages=args.batch_pages)
+    elif args.command == "resume":
+        result = resume_backfills()
+    else:
+        result = list_backfill_jobs()
+    print(json.dumps(result, indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,290 @@
+import argparse
+import json
+import os
+import queue
+import threading
+import time as pytime
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Iterator, Optional
+
+from instrument_catalog import parse_shard, resolve_symbols, shard_symbols
+from kline_features import features_enabled, refresh_features
+from kline_sync_service import (
+    OKX_PAGE_LIMIT,
+    SYNC_METRICS,
+    TIMEFRAME_MS,
+    UPSERT_COUNT_KEYS,
+    SyncMetrics,
+    _merge_sync_state,
+    build_range_window,
+    ensure_schema,
+    get_mysql_config,
+    get_sync_state,
+    iter_okx_ohlcv_pages,
+    mysql_connect,
+    normalize_timeframe,
+    plan_missing_windows,
+    save_sync_state,
+    stream_upsert,
+)
+
+
+def _merge_intervals(intervals: list[tuple[int, int]]) -> list[tuple[int, int]]:
+    merged: list[tuple[int, int]] = []
+    for start_ms, end_ms in sorted(intervals):
+        if merged and start_ms <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end_ms))
+        else:
+            merged.append((start_ms, end_ms))
+    return merged
+
+
+def plan_batch_sync(
+    conn,
+    symbols: list[str],
+    timeframes: list[str],
+    ranges: list[tuple[str, str]],
+    tz_name: str,
+    force: bool = False,
+    chunk_bars: Optional[int] = None,
+) -> dict:
+    """Expand symbols x timeframes x date ranges into deduplicated fetch chunks.
+
+    Overlapping ranges of one series are merged, windows already inside the
+    sync watermark are dropped unless `force`, and the rest is cut into
+    chunks of `chunk_bars` bars (KLINE_BATCH_CHUNK_BARS, default 20000).
+    Chunks are interleaved across series so every series makes progress.
+    """
+    bars = max(OKX_PAGE_LIMIT, int(chunk_bars or os.getenv("KLINE_BATCH_CHUNK_BARS", "20000")))
+    series_chunks: list[list[dict]] = []
+    series = []
+    for symbol in dict.fromkeys(symbols):
+        for timeframe in dict.fromkeys(timeframes):
+            requested = _merge_intervals(
+                [build_range_window(start_text, end_text, timeframe, tz_name) for start_text, end_text in ranges]
+            )
+            state = None if force else get_sync_state(conn, symbol, timeframe)
+            windows = []
+            for start_ms, end_ms in requested:
+                windows.extend([(start_ms, end_ms)] if force else plan_missing_windows(state, start_ms, end_ms))
+            chunks = []
+            for start_ms, end_ms in windows:
+                # 1M bars have no fixed length, but the whole history is only a few pages.
+                step = (end_ms - start_ms) if timeframe == "1M" else TIMEFRAME_MS[timeframe] * bars
+                for lo in range(start_ms, end_ms, step):
+                    chunks.append({"symbol": symbol, "timeframe": timeframe, "start_ms": lo, "end_ms": min(end_ms, lo + step)})
+            series.append(
+                {
+                    "symbol": symbol,
+                    "timeframe": timeframe,
+                    "requested": [list(w) for w in requested],
+                    "windows": [list(w) for w in windows],
+                    "chunks": len(chunks),
+                }
+            )
+            series_chunks.append(chunks)
+
+    ordered = []
+    for depth in range(max((len(c) for c in series_chunks), default=0)):
+        ordered.extend(chunks[depth] for chunks in series_chunks if depth < len(chunks))
+    for index, chunk in enumerate(ordered):
+        chunk["index"] = index
+    return {"series": series, "chunks": ordered}
+
+
+class _ConnectionPool:
+    """At most one MySQL connection per worker, reused across chunks."""
+
+    def __init__(self) -> None:
+        self._idle: queue.LifoQueue = queue.LifoQueue()
+        self._all: list = []
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                conn.ping(reconnect=True)
+                return conn
+            except Exception as exc:
+                print(f"[warn] 连接池中的 MySQL 连接不可用，已丢弃: {exc}")
+                self._discard(conn)
+        conn = mysql_connect(get_mysql_config())
+        with self._lock:
+            self._all.append(conn)
+        return conn
+
+    def release(self, conn, failed: bool = False) -> None:
+        """Return `conn` for reuse; after a failed chunk roll back first, and drop it if that fails too."""
+        if failed:
+            try:
+                conn.rollback()
+            except Exception:
+                self._discard(conn)
+                return
+        self._idle.put(conn)
+
+    def _discard(self, conn) -> None:
+        with self._lock:
+            if conn in self._all:
+                self._all.remove(conn)
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def close(self) -> None:
+        with self._lock:
+            connections, self._all = self._all, []
+        for conn in connections:
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+
+def _sync_chunk(pool: _ConnectionPool, chunk: dict, job_metrics: SyncMetrics) -> dict:
+    conn = pool.acquire()
+    metrics = SyncMetrics(parent=job_metrics)
+    try:
+        pages = iter_okx_ohlcv_pages(
+            chunk["symbol"], chunk["timeframe"], chunk["start_ms"], chunk["end_ms"], metrics=metrics
+        )
+        written = stream_upsert(conn, chunk["symbol"], chunk["timeframe"], pages, metrics=metrics)
+    except Exception:
+        # stream_upsert may stop mid-batch; never hand an open transaction to the next chunk.
+        pool.release(conn, failed=True)
+        raise
+    pool.release(conn)
+    snapshot = metrics.snapshot()
+    return {**written, "seconds": snapshot["wall_seconds"], "metrics": snapshot}
+
+
+def run_batch_sync(
+    symbols: list[str],
+    timeframes: list[str],
+    ranges: list[tuple[str, str]],
+    tz_name: str = "Asia/Shanghai",
+    force: bool = False,
+    workers: Optional[int] = None,
+    chunk_bars: Optional[int] = None,
+) -> Iterator[dict]:
+    """Plan and run a batch sync, yielding one progress event per finished chunk.
+
+    Events: {"event": "plan"} first, then {"event": "chunk"} per chunk
+    (failed chunks carry "error"), then {"event": "done"} with totals. Chunks
+    run on `workers` threads (KLINE_BATCH_WORKERS, default 4) with pooled
+    MySQL connections; HTTP keep-alive sessions and the OKX rate limiter are
+    shared process-wide, so the limiter, not the chunk count, sets the pace.
+    """
+    tfs = [normalize_timeframe(tf) for tf in timeframes]
+    if not tfs or not all(tfs):
+        raise ValueError("invalid timeframe")
+    if not symbols or not ranges:
+        raise ValueError("symbols and ranges are required")
+    workers = max(1, int(workers or os.getenv("KLINE_BATCH_WORKERS", "4")))
+    started = pytime.perf_counter()
+
+    conn = mysql_connect(get_mysql_config())
+    pool = _ConnectionPool()
+    try:
+        ensure_schema(conn)
+        plan = plan_batch_sync(conn, symbols, tfs, ranges, tz_name, force=force, chunk_bars=chunk_bars)
+        chunks = plan["chunks"]
+        yield {"event": "plan", "series": plan["series"], "total": len(chunks), "workers": workers}
+
+        totals = {"fetched": 0, **dict.fromkeys(UPSERT_COUNT_KEYS, 0), "failed": 0}
+        runs_by_series: dict[tuple[str, str], list[tuple[int, int]]] = {}
+        changed_from: dict[tuple[str, str], int] = {}
+        finished = 0
+        executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="kline-batch")
+        job_metrics = SyncMetrics(parent=SYNC_METRICS)
+        futures = {executor.submit(_sync_chunk, pool, chunk, job_metrics): chunk for chunk in chunks}
+        try:
+            pending = set(futures)
+            while pending:
+                completed, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in sorted(completed, key=lambda f: futures[f]["index"]):
+                    chunk = futures[future]
+                    finished += 1
+                    event = {"event": "chunk", **chunk, "done": finished, "total": len(chunks)}
+                    try:
+                        written = future.result()
+                    except Exception as exc:
+                        totals["failed"] += 1
+                        yield {**event, "error": str(exc)}
+                        continue
+                    totals["fetched"] += written["fetched"]
+                    for key in UPSERT_COUNT_KEYS:
+                        totals[key] += written[key]
+                    key = (chunk["symbol"], chunk["timeframe"])
+                    runs_by_series.setdefault(key, []).extend(written["confirmed_runs"])
+                    changed_from[key] = min(changed_from.get(key, chunk["start_ms"]), chunk["start_ms"])
+                    # State is folded on this thread only, so chunks finishing out of order cannot race;
+                    # every finished chunk's runs are re-folded, so a run waiting on a gap joins once it fills.
+                    state = get_sync_state(conn, *key)
+                    merged = _merge_sync_state(state, chunk["timeframe"], runs_by_series[key])
+                    if merged is not None and merged != state:
+                        save_sync_state(conn, chunk["symbol"], chunk["timeframe"], merged[0], merged[1])
+                    yield {
+                        **event,
+                        **{k: written[k] for k in ("fetched", *UPSERT_COUNT_KEYS)},
+                        "seconds": round(written["seconds"], 3),
+                        "metrics": written["metrics"],
+                    }
+        finally:
+            # Reached early when the consumer stops reading (e.g. the HTTP client went away).
+            for future in futures:
+                future.cancel()
+            executor.shutdown(wait=True)
+
+        if features_enabled():
+            # Historical chunks usually land behind the feature watermark, which means a rebuild.
+            for (symbol, timeframe), start_ms in sorted(changed_from.items()):
+                refresh_features(conn, symbol, timeframe, changed_from_ms=start_ms)
+
+        seconds = pytime.perf_counter() - started
+        yield {
+            "event": "done",
+            "total": len(chunks),
+            **totals,
+            "seconds": round(seconds, 3),
+            "rows_per_sec": round(totals["fetched"] / seconds, 1) if seconds > 0 else 0.0,
+            "metrics": job_metrics.finish(),
+        }
+    finally:
+        pool.close()
+        conn.close()
+
+
+def main(argv=None) -> None:
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Batch okx_kline sync over symbols x timeframes x date ranges")
+    parser.add_argument("--symbols", nargs="+", required=True, help="'all' for every USDT swap")
+    parser.add_argument("--timeframes", nargs="+", required=True)
+    parser.add_argument("--range", dest="ranges", nargs=2, action="append", required=True, metavar=("START", "END"))
+    parser.add_argument("--tz", default="Asia/Shanghai")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--force", action="store_true")
+    parser.add_argument("--shard", default=None, help="Only sync shard INDEX/COUNT of the symbols, e.g. 0/4")
+    args = parser.parse_args(argv)
+
+    try:
+        symbols = resolve_symbols(args.symbols)
+        if args.shard:
+            symbols = shard_symbols(symbols, *parse_shard(args.shard))
+    except ValueError as exc:
+        parser.error(str(exc))
+    for event in run_batch_sync(
+        symbols, args.timeframes, [tuple(r) for r in args.ranges], args.tz, force=args.force, workers=args.workers
+    ):
+        print(json.dumps(event, ensure_ascii=False), flush=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,316 @@
+import argparse
+import json
+import math
+import os
+import random
+import threading
+import time as pytime
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+from urllib.parse import parse_qs, urlparse
+
+from kline_sync_service import (
+    OKX_HISTORY_CANDLES_PATH,
+    OKX_PAGE_LIMIT,
+    TIMEFRAME_MS,
+    SyncMetrics,
+    ensure_schema,
+    fetch_okx_ohlcv_range,
+    get_mysql_config,
+    iter_okx_ohlcv_pages,
+    mysql_connect,
+    normalize_timeframe,
+    stream_upsert,
+    upsert_rows,
+)
+
+BENCH_SYMBOL = "BENCH/USDT:USDT"
+# Candles exist from here on; any window after it can be requested.
+BENCH_LISTING_MS = 1_546_300_800_000  # 2019-01-01 UTC
+OKX_HISTORY_TRADES_PATH = "/api/v5/market/history-trades"
+
+
+def _candle(ts_ms: int, tf_ms: int, now_ms: int) -> list[str]:
+    """Deterministic OKX-shaped row, so repeated runs write identical values."""
+    base = 100.0 + 20.0 * math.sin(ts_ms / 3.6e9) + (ts_ms // tf_ms % 97) * 0.01
+    high = base * 1.002
+    low = base * 0.998
+    close = base * (1.0005 if ts_ms // tf_ms % 2 else 0.9995)
+    volume = 10.0 + ts_ms // tf_ms % 50
+    confirm = "1" if ts_ms + tf_ms <= now_ms else "0"
+    return [str(ts_ms), f"{base:.4f}", f"{high:.4f}", f"{low:.4f}", f"{close:.4f}", f"{volume:.2f}", "0", "0", confirm]
+
+
+def _trade(trade_id: int, trade_interval_ms: int) -> dict:
+    """Deterministic trade; two trades share each timestamp so paging must not rely on ts alone."""
+    k = trade_id - 1
+    ts = BENCH_LISTING_MS + (k // 2) * trade_interval_ms
+    px = 100.0 + 20.0 * math.sin(ts / 3.6e9) + (k % 13) * 0.01
+    return {
+        "instId": "BENCH-USDT-SWAP",
+        "tradeId": str(trade_id),
+        "px": f"{px:.4f}",
+        "sz": str(1 + k % 7),
+        "side": "buy" if k % 3 else "sell",
+        "ts": str(ts),
+    }
+
+
+class FakeOkxServer:
+    """Local HTTP stand-in for GET /api/v5/market/history-candles and history-trades.
+
+    Serves synthetic candles newest-first with the `after`/`before`/`limit`
+    semantics of OKX, and trades (one pair every `trade_interval_ms`) paged
+    backwards by timestamp (type=2) or tradeId (type=1). `latency_ms` (+ uniform `jitter_ms`) delays every
+    response, `page_size` caps rows per page, more than `rate_limit` requests
+    per `rate_window` seconds get HTTP 429 / code 50011 like the real API, and
+    `error_rate` injects 429s at random on top of that.
+    """
+
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        latency_ms: float = 50.0,
+        jitter_ms: float = 0.0,
+        page_size: int = OKX_PAGE_LIMIT,
+        rate_limit: int = 20,
+        rate_window: float = 2.0,
+        error_rate: float = 0.0,
+        seed: Optional[int] = None,
+        trade_interval_ms: int = 250,
+    ) -> None:
+        self.latency_ms = float(latency_ms)
+        self.jitter_ms = float(jitter_ms)
+        self.page_size = max(1, int(page_size))
+        self.rate_limit = int(rate_limit)
+        self.rate_window = float(rate_window)
+        self.error_rate = float(error_rate)
+        self.trade_interval_ms = max(1, int(trade_interval_ms))
+        self.stats = {"requests": 0, "rate_limited": 0, "injected_429": 0, "rows": 0}
+        self._random = random.Random(seed)
+        self._recent: deque = deque()
+        self._lock = threading.Lock()
+
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                status, body = server._handle(self.path)
+                payload = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._httpd = ThreadingHTTPServer((host, int(port)), Handler)
+        self._httpd.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "FakeOkxServer":
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name="fake-okx", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self) -> "FakeOkxServer":
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+    def _admit(self) -> Optional[str]:
+        now = pytime.monotonic()
+        with self._lock:
+            self.stats["requests"] += 1
+            while self._recent and now - self._recent[0] >= self.rate_window:
+                self._recent.popleft()
+            if self.rate_limit > 0 and len(self._recent) >= self.rate_limit:
+                self.stats["rate_limited"] += 1
+                return "rate_limited"
+            self._recent.append(now)
+            if self.error_rate > 0 and self._random.random() < self.error_rate:
+                self.stats["injected_429"] += 1
+                return "injected_429"
+            delay = self.latency_ms + (self._random.random() * self.jitter_ms if self.jitter_ms else 0.0)
+        if delay > 0:
+            pytime.sleep(delay / 1000.0)
+        return None
+
+    def _handle(self, path: str) -> tuple[int, dict]:
+        url = urlparse(path)
+        if url.path not in (OKX_HISTORY_CANDLES_PATH, OKX_HISTORY_TRADES_PATH):
+            return 404, {"code": "404", "msg": "Not Found", "data": []}
+        if self._admit() is not None:
+            return 429, {"code": "50011", "msg": "Too Many Requests", "data": []}
+
+        query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        if url.path == OKX_HISTORY_TRADES_PATH:
+            return self._trades(query)
+        tf_ms = TIMEFRAME_MS.get(query.get("bar", "1m"))
+        if tf_ms is None or query.get("bar") == "1M":
+            return 200, {"code": "51000", "msg": "Parameter bar error", "data": []}
+        now_ms = int(pytime.time() * 1000)
+        limit = min(self.page_size, int(query.get("limit", OKX_PAGE_LIMIT)))
+        after = int(query.get("after", now_ms + 1))
+        before = int(query.get("before", BENCH_LISTING_MS - 1))
+        # Newest open strictly before `after`, aligned to the bar grid.
+        newest = min((after - 1) // tf_ms * tf_ms, now_ms // tf_ms * tf_ms)
+        data = []
+        ts = newest
+        while len(data) < limit and ts > before and ts >= BENCH_LISTING_MS:
+            data.append(_candle(ts, tf_ms, now_ms))
+            ts -= tf_ms
+        with self._lock:
+            self.stats["rows"] += len(data)
+        return 200, {"code": "0", "msg": "", "data": data}
+
+    def _trades(self, query: dict) -> tuple[int, dict]:
+        interval = self.trade_interval_ms
+        now_ms = int(pytime.time() * 1000)
+        # tradeId k+1 trades at BENCH_LISTING_MS + (k // 2) * interval.
+        newest = (max(now_ms - BENCH_LISTING_MS, -1) // interval) * 2 + 2
+        limit = min(self.page_size, int(query.get("limit", 100)))
+        after = query.get("after")
+        if after is None:
+            top = newest
+        elif query.get("type", "1") == "2":
+            # Newest trade strictly before the timestamp.
+            top = min(newest, -(-(int(after) - BENCH_LISTING_MS) // interval) * 2)
+        else:
+            top = min(newest, int(after) - 1)
+        data = [_trade(trade_id, interval) for trade_id in range(top, max(0, top - limit), -1)]
+        with self._lock:
+            self.stats["rows"] += len(data)
+        return 200, {"code": "0", "msg": "", "data": data}
+
+
+def _stage(rows: int, seconds: float) -> dict:
+    return {"rows": rows, "seconds": round(seconds, 3), "candles_per_sec": round(rows / seconds, 1) if seconds > 0 else 0.0}
+
+
+def _delete_series(conn, symbol: str, timeframe: str) -> None:
+    with conn.cursor() as cur:
+        cur.execute("DELETE FROM okx_kline WHERE symbol=%s AND timeframe=%s", (symbol, timeframe))
+    conn.commit()
+
+
+def run_benchmark(
+    server: FakeOkxServer,
+    timeframe: str = "1m",
+    bars: int = 50_000,
+    workers: Optional[int] = None,
+    use_db: bool = True,
+    symbol: str = BENCH_SYMBOL,
+    keep: bool = False,
+) -> dict:
+    """Time each sync stage against `server` and return candles/sec per stage.
+
+    fetch:            fetch_okx_ohlcv_range over `bars` closed bars
+    upsert_insert:    upsert_rows of those rows into an empty series
+    upsert_unchanged: the same rows again (change detection, no writes)
+    end_to_end:       iter_okx_ohlcv_pages + stream_upsert into an empty series
+
+    The database stages use the configured MySQL (point MYSQL_* at a local
+    instance) and only touch `symbol` rows, which are deleted afterwards
+    unless `keep`.
+    """
+    os.environ["OKX_API_BASE"] = server.base_url
+    tf_ms = TIMEFRAME_MS[timeframe]
+    end_ms = int(pytime.time() * 1000) // tf_ms * tf_ms
+    start_ms = end_ms - int(bars) * tf_ms
+    report = {"timeframe": timeframe, "bars": int(bars), "start_ms": start_ms, "end_ms": end_ms, "stages": {}}
+
+    metrics = SyncMetrics()
+    started = pytime.perf_counter()
+    rows = fetch_okx_ohlcv_range(symbol, timeframe, start_ms, end_ms, max_workers=workers, metrics=metrics)
+    report["stages"]["fetch"] = _stage(len(rows), pytime.perf_counter() - started)
+    report["fetch_metrics"] = metrics.snapshot()
+
+    if use_db:
+        conn = mysql_connect(get_mysql_config())
+        try:
+            ensure_schema(conn)
+            _delete_series(conn, symbol, timeframe)
+            for name in ("upsert_insert", "upsert_unchanged"):
+                started = pytime.perf_counter()
+                counts = upsert_rows(conn, symbol, timeframe, rows)
+                report["stages"][name] = {**_stage(len(rows), pytime.perf_counter() - started), **counts}
+
+            _delete_series(conn, symbol, timeframe)
+            metrics = SyncMetrics()
+            started = pytime.perf_counter()
+            pages = iter_okx_ohlcv_pages(symbol, timeframe, start_ms, end_ms, max_workers=workers, metrics=metrics)
+            written = stream_upsert(conn, symbol, timeframe, pages, metrics=metrics)
+            report["stages"]["end_to_end"] = {
+                **_stage(written["fetched"], pytime.perf_counter() - started),
+                "batches": written["batches"],
+            }
+            report["end_to_end_metrics"] = metrics.snapshot()
+            if not keep:
+                _delete_series(conn, symbol, timeframe)
+        finally:
+            conn.close()
+
+    report["server"] = dict(server.stats)
+    return report
+
+
+def main(argv=None) -> None:
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Benchmark kline sync against a local OKX history-candles stand-in")
+    parser.add_argument("--timeframe", default="1m")
+    parser.add_argument("--bars", type=int, default=50_000)
+    parser.add_argument("--workers", type=int, default=None, help="Default: OKX_FETCH_WORKERS")
+    parser.add_argument("--latency-ms", type=float, default=50.0)
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    parser.add_argument("--page-size", type=int, default=OKX_PAGE_LIMIT)
+    parser.add_argument("--rate-limit", type=int, default=20, help="Requests per --rate-window before 429 (0: off)")
+    parser.add_argument("--rate-window", type=float, default=2.0)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Probability of an injected 429")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--no-db", action="store_true", help="Only measure the fetch stage")
+    parser.add_argument("--keep", action="store_true", help=f"Keep the {BENCH_SYMBOL} rows afterwards")
+    args = parser.parse_args(argv)
+
+    timeframe = normalize_timeframe(args.timeframe)
+    if not timeframe or timeframe == "1M":
+        parser.error("invalid timeframe (1M is not supported by the stand-in)")
+    # The stand-in is local; an HTTPS_PROXY from .env would route it through the proxy.
+    for key in ("HTTPS_PROXY", "https_proxy", "HTTP_PROXY", "http_proxy"):
+        os.environ.pop(key, None)
+
+    server = FakeOkxServer(
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        page_size=args.page_size,
+        rate_limit=args.rate_limit,
+        rate_window=args.rate_window,
+        error_rate=args.error_rate,
+        seed=args.seed,
+    )
+    with server:
+        print(f"[benchmark] fake OKX at {server.base_url}: {args.bars} x {timeframe}")
+        report = run_benchmark(server, timeframe, args.bars, workers=args.workers, use_db=not args.no_db, keep=args.keep)
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,495 @@
+import argparse
+import json
+import os
+import threading
+import time as pytime
+from typing import Iterator, Optional
+
+import numpy as np
+
+from db_migrations import Migration, apply_migrations
+from instrument_catalog import get_instrument_catalog
+from kline_sync_service import (
+    SYNC_METRICS,
+    SyncMetrics,
+    TokenBucket,
+    _ccxt_symbol_to_inst_id,
+    _get_proxies,
+    _request_okx,
+    build_range_window,
+    ensure_schema,
+    get_mysql_config,
+    mysql_connect,
+    okx_api_url,
+)
+
+OKX_HISTORY_TRADES_PATH = "/api/v5/market/history-trades"
+OKX_TRADES_PAGE_LIMIT = 100
+# market/history-trades has its own 20 requests / 2s budget, separate from history-candles;
+# burst + 2 * rate <= 20 as for HISTORY_CANDLES_LIMITER.
+HISTORY_TRADES_LIMITER = TokenBucket(
+    rate_per_sec=float(os.getenv("OKX_TRADES_RATE_PER_SEC", "9")),
+    capacity=float(os.getenv("OKX_TRADES_BURST", "2")),
+)
+BAR_TYPES = ("tick", "volume", "dollar")
+TRADE_DTYPE = np.dtype([("trade_id", "<i8"), ("ts", "<i8"), ("px", "<f8"), ("sz", "<f8")])
+CUSTOM_BAR_DTYPE = np.dtype(
+    [
+        ("seq", "<i8"),
+        ("open_time_ms", "<i8"),
+        ("close_time_ms", "<i8"),
+        ("open", "<f8"),
+        ("high", "<f8"),
+        ("low", "<f8"),
+        ("close", "<f8"),
+        ("volume", "<f8"),
+        ("quote_volume", "<f8"),
+        ("trades", "<i8"),
+        ("first_trade_id", "<i8"),
+        ("last_trade_id", "<i8"),
+    ]
+)
+
+
+def parse_bar_spec(text) -> Optional[tuple[str, float]]:
+    """'volume:250000' -> ('volume', 250000.0); None when `text` is not a bar spec.
+
+    tick: trades per bar, volume: base-currency size per bar, dollar: quote
+    (USDT) notional per bar.
+    """
+    kind, sep, raw = str(text or "").strip().lower().partition(":")
+    if not sep or kind not in BAR_TYPES:
+        return None
+    try:
+        threshold = float(raw)
+    except ValueError:
+        return None
+    if not np.isfinite(threshold) or threshold <= 0 or (kind == "tick" and threshold != int(threshold)):
+        return None
+    return kind, threshold
+
+
+def format_bar_spec(kind: str, threshold: float) -> str:
+    return f"{kind}:{int(threshold) if float(threshold).is_integer() else float(threshold)!r}"
+
+
+def normalize_bar_spec(text) -> Optional[str]:
+    """Canonical spelling of a bar spec (the okx_custom_bar key), or None."""
+    parsed = parse_bar_spec(text)
+    return format_bar_spec(*parsed) if parsed else None
+
+
+# -- schema ----------------------------------------------------------------------
+
+
+def _create_custom_bar_tables(conn) -> None:
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS okx_custom_bar (
+                symbol VARCHAR(40) CHARACTER SET ascii COLLATE ascii_bin NOT NULL,
+                bar_spec VARCHAR(32) CHARACTER SET ascii COLLATE ascii_bin NOT NULL,
+                seq BIGINT NOT NULL COMMENT 'bar number within the series, from 0',
+                open_time_ms BIGINT NOT NULL COMMENT 'first trade of the bar',
+                close_time_ms BIGINT NOT NULL COMMENT 'last trade of the bar',
+                open_price DOUBLE NOT NULL,
+                high_price DOUBLE NOT NULL,
+                low_price DOUBLE NOT NULL,
+                close_price DOUBLE NOT NULL,
+                volume DOUBLE NOT NULL COMMENT 'base currency',
+                quote_volume DOUBLE NOT NULL,
+                trades INT NOT NULL,
+                first_trade_id BIGINT NOT NULL,
+                last_trade_id BIGINT NOT NULL,
+                PRIMARY KEY (symbol, bar_spec, seq),
+                KEY idx_custom_bar_time (symbol, bar_spec, open_time_ms)
+            ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+            """
+        )
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS okx_custom_bar_state (
+                symbol VARCHAR(40) CHARACTER SET ascii COLLATE ascii_bin NOT NULL,
+                bar_spec VARCHAR(32) CHARACTER SET ascii COLLATE ascii_bin NOT NULL,
+                cursor_ms BIGINT NOT NULL COMMENT 'every trade before this time is aggregated',
+                next_seq BIGINT NOT NULL,
+                partial MEDIUMTEXT NULL COMMENT 'JSON of the unfinished bar',
+                updated_at DATETIME DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+                PRIMARY KEY (symbol, bar_spec)
+            ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+            """
+        )
+    conn.commit()
+
+
+CUSTOM_BAR_SCHEMA_COMPONENT = "okx_custom_bar"
+CUSTOM_BAR_MIGRATIONS: list[Migration] = [
+    (1, "create okx_custom_bar and okx_custom_bar_state", _create_custom_bar_tables),
+]
+_CUSTOM_BAR_SCHEMA_READY = False
+_CUSTOM_BAR_SCHEMA_LOCK = threading.Lock()
+
+
+def migrate_custom_bars(conn) -> list[int]:
+    """Create/upgrade the custom bar tables; run at deploy (init_mysql_tables.py)."""
+    global _CUSTOM_BAR_SCHEMA_READY
+    applied = apply_migrations(conn, CUSTOM_BAR_SCHEMA_COMPONENT, CUSTOM_BAR_MIGRATIONS)
+    _CUSTOM_BAR_SCHEMA_READY = True
+    return applied
+
+
+def ensure_custom_bar_schema(conn) -> None:
+    global _CUSTOM_BAR_SCHEMA_READY
+    if _CUSTOM_BAR_SCHEMA_READY:
+        return
+    with _CUSTOM_BAR_SCHEMA_LOCK:
+        if not _CUSTOM_BAR_SCHEMA_READY:
+            ensure_schema(conn)
+            apply_migrations(conn, CUSTOM_BAR_SCHEMA_COMPONENT, CUSTOM_BAR_MIGRATIONS)
+            _CUSTOM_BAR_SCHEMA_READY = True
+
+
+# -- trade history ---------------------------------------------------------------
+
+
+def _parse_trades(rows: list[dict]) -> np.ndarray:
+    trades = np.empty(len(rows), dtype=TRADE_DTYPE)
+    trades["trade_id"] = [int(r["tradeId"]) for r in rows]
+    trades["ts"] = [int(r["ts"]) for r in rows]
+    trades["px"] = [float(r["px"]) for r in rows]
+    trades["sz"] = [float(r["sz"]) for r in rows]
+    return trades
+
+
+def _fetch_trade_slice(inst_id: str, lo_ms: int, hi_ms: int, proxies: dict, metrics: Optional[SyncMetrics]) -> np.ndarray:
+    """Trades with lo_ms <= ts < hi_ms, oldest first.
+
+    OKX only pages backwards: the first page is addressed by timestamp, the
+    following ones by tradeId, so trades sharing a millisecond are never lost
+    or repeated at a page edge.
+    """
+    url = okx_api_url(OKX_HISTORY_TRADES_PATH)
+    params = {"instId": inst_id, "type": "2", "after": str(int(hi_ms)), "limit": str(OKX_TRADES_PAGE_LIMIT)}
+    pages = []
+    while True:
+        rows = _request_okx(url, params, proxies, limiter=HISTORY_TRADES_LIMITER, metrics=metrics)
+        if not rows:
+            break
+        started = pytime.perf_counter()
+        page = _parse_trades(rows)
+        kept = page[page["ts"] >= lo_ms]
+        if metrics is not None:
+            metrics.add(pages=1, rows_parsed=len(page), parse_seconds=pytime.perf_counter() - started)
+        pages.append(kept)
+        if len(kept) < len(page) or len(rows) < OKX_TRADES_PAGE_LIMIT:
+            break
+        params = {"instId": inst_id, "type": "1", "after": str(int(page["trade_id"].min())), "limit": str(OKX_TRADES_PAGE_LIMIT)}
+    if not pages:
+        return np.empty(0, dtype=TRADE_DTYPE)
+    trades = np.concatenate(pages)
+    return trades[np.lexsort((trades["trade_id"], trades["ts"]))]
+
+
+def iter_trade_slices(
+    symbol: str,
+    start_ms: int,
+    end_ms: int,
+    slice_ms: Optional[int] = None,
+    metrics: Optional[SyncMetrics] = None,
+) -> Iterator[tuple[int, np.ndarray]]:
+    """Yield (slice_end_ms, trades) for consecutive slices of [start_ms, end_ms), oldest first.
+
+    Only one slice (KLINE_TRADE_SLICE_SECONDS, default 900) is held in memory
+    at a time. Empty slices are yielded too so callers can move their cursor.
+    """
+    step = int(slice_ms or float(os.getenv("KLINE_TRADE_SLICE_SECONDS", "900")) * 1000)
+    inst_id = _ccxt_symbol_to_inst_id(symbol)
+    proxies = _get_proxies()
+    lo = int(start_ms)
+    while lo < end_ms:
+        hi = min(int(end_ms), lo + step)
+        yield hi, _fetch_trade_slice(inst_id, lo, hi, proxies, metrics)
+        lo = hi
+
+
+def contract_value(symbol: str) -> float:
+    """Base currency per contract (ctVal) for swaps; 1 for spot."""
+    if ":" not in symbol:
+        return 1.0
+    info = get_instrument_catalog().get(symbol) or {}
+    try:
+        value = float(info.get("ctVal"))
+    except (TypeError, ValueError):
+        raise ValueError(f"contract value unknown for {symbol}; refresh the instrument catalog") from None
+    if value <= 0:
+        raise ValueError(f"invalid contract value for {symbol}: {value}")
+    return value
+
+
+# -- aggregation -----------------------------------------------------------------
+
+
+class BarAggregator:
+    """Single-pass builder of tick / volume / dollar bars.
+
+    `feed()` takes trades oldest first and returns the bars completed by
+    them. A bar closes on the trade that brings its measure (trade count,
+    base volume or quote notional) to the threshold; trades are not split.
+    The unfinished bar is exposed through `state()` so aggregation can resume
+    exactly where a previous run stopped.
+    """
+
+    def __init__(self, kind: str, threshold: float, ct_val: float = 1.0, state: Optional[dict] = None) -> None:
+        if kind not in BAR_TYPES:
+            raise ValueError(f"unknown bar type: {kind}")
+        self.kind = kind
+        self.threshold = float(threshold)
+        self.ct_val = float(ct_val)
+        state = state or {}
+        self.next_seq = int(state.get("next_seq", 0))
+        self.partial: Optional[dict] = state.get("partial")
+
+    def state(self) -> dict:
+        return {"next_seq": self.next_seq, "partial": self.partial}
+
+    def feed(self, trades: np.ndarray) -> np.ndarray:
+        if not len(trades):
+            return np.empty(0, dtype=CUSTOM_BAR_DTYPE)
+        px = trades["px"]
+        base = trades["sz"] * self.ct_val
+        quote = base * px
+        measure = {"tick": np.ones(len(trades)), "volume": base, "dollar": quote}[self.kind]
+        cum = np.cumsum(measure)
+
+        # Bar boundaries: each bar ends at the first trade where its running measure reaches the threshold.
+        ends = []
+        carried = float(self.partial["measure"]) if self.partial else 0.0
+        offset = 0.0
+        while True:
+            end = int(np.searchsorted(cum, offset + self.threshold - carried, side="left"))
+            if end >= len(trades):
+                break
+            ends.append(end)
+            offset = float(cum[end])
+            carried = 0.0
+        starts = np.array([0, *(e + 1 for e in ends)], dtype=np.int64)
+        starts = starts[starts < len(trades)]
+
+        highs = np.maximum.reduceat(px, starts)
+        lows = np.minimum.reduceat(px, starts)
+        base_sums = np.add.reduceat(base, starts)
+        quote_sums = np.add.reduceat(quote, starts)
+        measure_sums = np.add.reduceat(measure, starts)
+        last = np.append(starts[1:] - 1, len(trades) - 1)
+
+        bars = np.empty(len(ends), dtype=CUSTOM_BAR_DTYPE)
+        n = len(ends)
+        bars["seq"] = np.arange(self.next_seq, self.next_seq + n)
+        bars["open_time_ms"] = trades["ts"][starts[:n]]
+        bars["close_time_ms"] = trades["ts"][last[:n]]
+        bars["open"] = px[starts[:n]]
+        bars["high"] = highs[:n]
+        bars["low"] = lows[:n]
+        bars["close"] = px[last[:n]]
+        bars["volume"] = base_sums[:n]
+        bars["quote_volume"] = quote_sums[:n]
+        bars["trades"] = last[:n] - starts[:n] + 1
+        bars["first_trade_id"] = trades["trade_id"][starts[:n]]
+        bars["last_trade_id"] = trades["trade_id"][last[:n]]
+        if n and self.partial:
+            # The first bar began in an earlier batch.
+            p = self.partial
+            bars["open_time_ms"][0] = p["open_time_ms"]
+            bars["open"][0] = p["open"]
+            bars["high"][0] = max(bars["high"][0], p["high"])
+            bars["low"][0] = min(bars["low"][0], p["low"])
+            bars["volume"][0] += p["volume"]
+            bars["quote_volume"][0] += p["quote_volume"]
+            bars["trades"][0] += p["trades"]
+            bars["first_trade_id"][0] = p["first_trade_id"]
+            self.partial = None
+        self.next_seq += n
+
+        if len(starts) > n:
+            # Trades after the last boundary start (or extend) the unfinished bar.
+            s = int(starts[n])
+            tail = {
+                "open_time_ms": int(trades["ts"][s]),
+                "open": float(px[s]),
+                "high": float(highs[n]),
+                "low": float(lows[n]),
+                "volume": float(base_sums[n]),
+                "quote_volume": float(quote_sums[n]),
+                "trades": int(len(trades) - s),
+                "first_trade_id": int(trades["trade_id"][s]),
+                "measure": float(measure_sums[n]),
+            }
+            p = self.partial
+            if p:
+                tail.update(
+                    open_time_ms=p["open_time_ms"],
+                    open=p["open"],
+                    high=max(tail["high"], p["high"]),
+                    low=min(tail["low"], p["low"]),
+                    volume=tail["volume"] + p["volume"],
+                    quote_volume=tail["quote_volume"] + p["quote_volume"],
+                    trades=tail["trades"] + p["trades"],
+                    first_trade_id=p["first_trade_id"],
+                    measure=tail["measure"] + p["measure"],
+                )
+            self.partial = tail
+        return bars
+
+
+# -- storage ---------------------------------------------------------------------
+
+
+def _load_state(conn, symbol: str, spec: str) -> Optional[dict]:
+    with conn.cursor() as cur:
+        cur.execute(
+            "SELECT cursor_ms, next_seq, partial FROM okx_custom_bar_state WHERE symbol=%s AND bar_spec=%s",
+            (symbol, spec),
+        )
+        row = cur.fetchone()
+    if not row:
+        return None
+    return {
+        "cursor_ms": int(row["cursor_ms"]),
+        "next_seq": int(row["next_seq"]),
+        "partial": json.loads(row["partial"]) if row["partial"] else None,
+    }
+
+
+def _bar_rows(symbol: str, spec: str, bars: np.ndarray) -> list[tuple]:
+    return [(symbol, spec, *row) for row in bars.tolist()]
+
+
+def build_custom_bars(
+    symbol: str,
+    spec: str,
+    start_ms: Optional[int] = None,
+    end_ms: Optional[int] = None,
+    rebuild: bool = False,
+    ct_val: Optional[float] = None,
+    conn=None,
+) -> dict:
+    """Stream OKX trade history into okx_custom_bar for one (symbol, bar spec).
+
+    Resumes from the saved cursor and unfinished bar; `start_ms` is only used
+    for a new (or rebuilt) series. Each trade slice's bars commit together
+    with the advanced state, so an interrupted run loses at most one slice.
+    OKX keeps about three months of trade history.
+    """
+    parsed = parse_bar_spec(spec)
+    if parsed is None:
+        raise ValueError(f"invalid bar spec: {spec} (expected tick:N, volume:N or dollar:N)")
+    spec = format_bar_spec(*parsed)
+    ct_val = contract_value(symbol) if ct_val is None else float(ct_val)
+    # Trades of the last seconds may still be missing from history-trades.
+    end_ms = int(end_ms if end_ms is not None else pytime.time() * 1000 - 5000)
+
+    own_conn = conn is None
+    if own_conn:
+        conn = mysql_connect(get_mysql_config())
+    metrics = SyncMetrics(parent=SYNC_METRICS)
+    try:
+        ensure_custom_bar_schema(conn)
+        if rebuild:
+            with conn.cursor() as cur:
+                cur.execute("DELETE FROM okx_custom_bar WHERE symbol=%s AND bar_spec=%s", (symbol, spec))
+                cur.execute("DELETE FROM okx_custom_bar_state WHERE symbol=%s AND bar_spec=%s", (symbol, spec))
+            conn.commit()
+        state = _load_state(conn, symbol, spec)
+        if state is None:
+            if start_ms is None:
+                raise ValueError("start is required for a new custom bar series")
+            cursor_ms = int(start_ms)
+        else:
+            cursor_ms = state["cursor_ms"]
+        aggregator = BarAggregator(parsed[0], parsed[1], ct_val=ct_val, state=state)
+
+        trades = 0
+        written = 0
+        for slice_end, batch in iter_trade_slices(symbol, cursor_ms, end_ms, metrics=metrics):
+            bars = aggregator.feed(batch)
+            started = pytime.perf_counter()
+            with conn.cursor() as cur:
+                if len(bars):
+                    cur.executemany(
+                        "INSERT INTO okx_custom_bar (symbol, bar_spec, seq, open_time_ms, close_time_ms, open_price, "
+                        "high_price, low_price, close_price, volume, quote_volume, trades, first_trade_id, last_trade_id) "
+                        "VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s) "
+                        "ON DUPLICATE KEY UPDATE open_time_ms=VALUES(open_time_ms), close_time_ms=VALUES(close_time_ms), "
+                        "open_price=VALUES(open_price), high_price=VALUES(high_price), low_price=VALUES(low_price), "
+                        "close_price=VALUES(close_price), volume=VALUES(volume), quote_volume=VALUES(quote_volume), "
+                        "trades=VALUES(trades), first_trade_id=VALUES(first_trade_id), last_trade_id=VALUES(last_trade_id)",
+                        _bar_rows(symbol, spec, bars),
+                    )
+                cur.execute(
+                    "INSERT INTO okx_custom_bar_state (symbol, bar_spec, cursor_ms, next_seq, partial) "
+                    "VALUES (%s, %s, %s, %s, %s) ON DUPLICATE KEY UPDATE "
+                    "cursor_ms=VALUES(cursor_ms), next_seq=VALUES(next_seq), partial=VALUES(partial)",
+                    (
+                        symbol,
+                        spec,
+                        int(slice_end),
+                        aggregator.next_seq,
+                        json.dumps(aggregator.partial) if aggregator.partial else None,
+                    ),
+                )
+            conn.commit()
+            metrics.observe_upsert(len(bars), pytime.perf_counter() - started)
+            cursor_ms = slice_end
+            trades += len(batch)
+            written += len(bars)
+    finally:
+        if own_conn:
+            conn.close()
+
+    return {
+        "symbol": symbol,
+        "bar_spec": spec,
+        "trades": trades,
+        "bars": written,
+        "next_seq": aggregator.next_seq,
+        "cursor_ms": cursor_ms,
+        "metrics": metrics.finish(),
+    }
+
+
+def fetch_custom_bar_rows(conn, symbol: str, spec: str, start_ms: int, end_ms: int) -> list[dict]:
+    """Bars opening in [start_ms, end_ms) in the row shape of backtest_service.fetch_klines."""
+    ensure_custom_bar_schema(conn)
+    with conn.cursor() as cur:
+        cur.execute(
+            "SELECT open_time_ms, open_price, high_price, low_price, close_price, volume FROM okx_custom_bar "
+            "WHERE symbol=%s AND bar_spec=%s AND open_time_ms >= %s AND open_time_ms < %s ORDER BY seq",
+            (symbol, spec, int(start_ms), int(end_ms)),
+        )
+        return list(cur.fetchall() or [])
+
+
+def main(argv=None) -> None:
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Build tick/volume/dollar bars from OKX trade history")
+    parser.add_argument("--symbols", nargs="+", required=True)
+    parser.add_argument("--specs", nargs="+", required=True, help="e.g. volume:5000000 dollar:1000000 tick:500")
+    parser.add_argument("--start-date", default=None, help="YYYY-MM-DD, required for new series")
+    parser.add_argument("--tz", default="Asia/Shanghai")
+    parser.add_argument("--rebuild", action="store_true", help="Drop stored bars and start again from --start-date")
+    args = parser.parse_args(argv)
+
+    specs = [normalize_bar_spec(spec) for spec in args.specs]
+    if not all(specs):
+        parser.error("invalid bar spec (expected tick:N, volume:N or dollar:N)")
+    start_ms = build_range_window(args.start_date, args.start_date, "1D", args.tz)[0] if args.start_date else None
+    for symbol in args.symbols:
+        for spec in specs:
+            result = build_custom_bars(symbol, spec, start_ms=start_ms, rebuild=args.rebuild)
+            print(json.dumps(result, ensure_ascii=False), flush=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,267 @@
+import argparse
+import io
+import json
+import os
+import sqlite3
+import time as pytime
+import zipfile
+from typing import Iterator, Optional
+
+import numpy as np
+import pymysql
+
+from kline_sync_service import (
+    build_range_window,
+    bulk_write_rows,
+    ensure_schema,
+    get_mysql_config,
+    mysql_connect,
+    normalize_timeframe,
+)
+
+# Format 2 stores one .npy per field for each chunk (<series>/<chunk>/<field>.npy); format 1 stored
+# each chunk as a single record array and is still readable.
+DATASET_FORMAT = 2
+READABLE_FORMATS = (1, 2)
+KLINE_DTYPE = np.dtype(
+    [
+        ("ts", "<i8"),
+        ("open", "<f8"),
+        ("high", "<f8"),
+        ("low", "<f8"),
+        ("close", "<f8"),
+        ("volume", "<f8"),
+        ("confirmed", "i1"),
+    ]
+)
+# Backtests read from this SQLite file instead of MySQL when it is set (offline machines).
+LOCAL_STORE_ENV = "KLINE_LOCAL_STORE"
+
+
+def _series_dir(symbol: str, timeframe: str) -> str:
+    return f"{symbol.replace('/', '_').replace(':', '_')}/{timeframe}"
+
+
+def _iter_mysql_chunks(
+    conn, symbol: str, timeframe: str, start_ms: int, end_ms: int, chunk_rows: int
+) -> Iterator[dict[str, np.ndarray]]:
+    """Stream rows with an unbuffered cursor so memory stays at one chunk of per-field columns."""
+    with conn.cursor(pymysql.cursors.SSCursor) as cur:
+        cur.execute(
+            "SELECT open_time_ms, open_price, high_price, low_price, close_price, volume, confirmed "
+            "FROM okx_kline WHERE symbol=%s AND timeframe=%s AND open_time_ms >= %s AND open_time_ms < %s "
+            "ORDER BY open_time_ms",
+            (symbol, timeframe, int(start_ms), int(end_ms)),
+        )
+        while True:
+            rows = cur.fetchmany(chunk_rows)
+            if not rows:
+                break
+            values = np.array([row[:6] for row in rows], dtype=np.float64)  # NULL prices become nan
+            chunk = {"ts": values[:, 0].astype(KLINE_DTYPE["ts"])}
+            for i, name in enumerate(("open", "high", "low", "close", "volume"), start=1):
+                chunk[name] = np.ascontiguousarray(values[:, i])
+            chunk["confirmed"] = np.array([row[6] for row in rows], dtype=KLINE_DTYPE["confirmed"])
+            yield chunk
+
+
+def export_dataset(path: str, series: list[tuple[str, str, int, int]], chunk_rows: Optional[int] = None) -> dict:
+    """Write (symbol, timeframe, start_ms, end_ms) slices to a compressed columnar zip plus manifest.json.
+
+    Every chunk of `chunk_rows` rows is stored as one .npy per field
+    (<series>/<chunk>/<field>.npy), so each column deflates on its own.
+    """
+    size = max(1000, int(chunk_rows or os.getenv("KLINE_EXPORT_CHUNK_ROWS", "100000")))
+    started = pytime.perf_counter()
+    manifest = {"format": DATASET_FORMAT, "fields": list(KLINE_DTYPE.names), "series": []}
+    conn = mysql_connect(get_mysql_config())
+    try:
+        ensure_schema(conn)
+        with zipfile.ZipFile(path, "w", compression=zipfile.ZIP_DEFLATED, compresslevel=6) as zf:
+            for symbol, timeframe, start_ms, end_ms in series:
+                entry = {
+                    "symbol": symbol,
+                    "timeframe": timeframe,
+                    "start_ms": int(start_ms),
+                    "end_ms": int(end_ms),
+                    "rows": 0,
+                    "chunks": [],
+                }
+                for index, chunk in enumerate(_iter_mysql_chunks(conn, symbol, timeframe, start_ms, end_ms, size)):
+                    name = f"{_series_dir(symbol, timeframe)}/{index:05d}"
+                    for field in KLINE_DTYPE.names:
+                        with zf.open(f"{name}/{field}.npy", "w", force_zip64=True) as fh:
+                            np.save(fh, chunk[field], allow_pickle=False)
+                    entry["chunks"].append(name)
+                    entry["rows"] += len(chunk["ts"])
+                manifest["series"].append(entry)
+                print(f"[export] {symbol} {timeframe}: {entry['rows']} rows")
+            zf.writestr("manifest.json", json.dumps(manifest, ensure_ascii=False, indent=2))
+    finally:
+        conn.close()
+    seconds = pytime.perf_counter() - started
+    rows = sum(s["rows"] for s in manifest["series"])
+    return {"path": path, "rows": rows, "seconds": seconds, "bytes": os.path.getsize(path), "series": manifest["series"]}
+
+
+def _load_npy(zf: zipfile.ZipFile, name: str) -> np.ndarray:
+    with zf.open(name) as fh:
+        return np.load(io.BytesIO(fh.read()), allow_pickle=False)
+
+
+def iter_dataset(path: str) -> Iterator[tuple[str, str, dict[str, np.ndarray]]]:
+    """Yield (symbol, timeframe, columns) from an exported dataset, one chunk in memory at a time.
+
+    `columns` maps every KLINE_DTYPE field to an equally long array.
+    """
+    with zipfile.ZipFile(path) as zf:
+        manifest = json.loads(zf.read("manifest.json"))
+        version = manifest.get("format")
+        if version not in READABLE_FORMATS:
+            raise ValueError(f"unsupported dataset format: {version}")
+        fields = manifest.get("fields") or list(KLINE_DTYPE.names)
+        for entry in manifest["series"]:
+            for name in entry["chunks"]:
+                if version == 1:
+                    records = _load_npy(zf, name)
+                    chunk = {field: records[field] for field in KLINE_DTYPE.names}
+                else:
+                    chunk = {field: _load_npy(zf, f"{name}/{field}.npy") for field in fields}
+                yield entry["symbol"], entry["timeframe"], chunk
+
+
+def _chunk_rows(chunk: dict[str, np.ndarray]) -> list[tuple]:
+    return list(
+        zip(
+            chunk["ts"].tolist(),
+            chunk["open"].tolist(),
+            chunk["high"].tolist(),
+            chunk["low"].tolist(),
+            chunk["close"].tolist(),
+            chunk["volume"].tolist(),
+            chunk["confirmed"].tolist(),
+        )
+    )
+
+
+# -- local SQLite store ----------------------------------------------------------
+
+
+def open_local_store(path: str) -> sqlite3.Connection:
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS okx_kline (
+            symbol TEXT NOT NULL,
+            timeframe TEXT NOT NULL,
+            open_time_ms INTEGER NOT NULL,
+            open_price REAL,
+            high_price REAL,
+            low_price REAL,
+            close_price REAL,
+            volume REAL,
+            confirmed INTEGER NOT NULL DEFAULT 1,
+            PRIMARY KEY (symbol, timeframe, open_time_ms)
+        ) WITHOUT ROWID
+        """
+    )
+    return conn
+
+
+def fetch_local_rows(path: str, symbol: str, timeframe: str, start_ms: int, end_ms: int) -> list[dict]:
+    """Same row shape as the MySQL query in backtest_service.fetch_klines."""
+    conn = open_local_store(path)
+    try:
+        cur = conn.execute(
+            "SELECT open_time_ms, open_price, high_price, low_price, close_price, volume FROM okx_kline "
+            "WHERE symbol=? AND timeframe=? AND open_time_ms >= ? AND open_time_ms < ? ORDER BY open_time_ms",
+            (symbol, timeframe, int(start_ms), int(end_ms)),
+        )
+        columns = [d[0] for d in cur.description]
+        return [dict(zip(columns, row)) for row in cur.fetchall()]
+    finally:
+        conn.close()
+
+
+def import_dataset(
+    path: str,
+    sqlite_path: Optional[str] = None,
+    method: str = "insert",
+    batch_size: Optional[int] = None,
+) -> dict:
+    """Load an exported dataset into okx_kline (bulk_write_rows) or a local SQLite store."""
+    started = pytime.perf_counter()
+    rows = 0
+    if sqlite_path:
+        conn = open_local_store(sqlite_path)
+        try:
+            for symbol, timeframe, chunk in iter_dataset(path):
+                conn.executemany(
+                    "INSERT OR REPLACE INTO okx_kline (symbol, timeframe, open_time_ms, open_price, high_price, "
+                    "low_price, close_price, volume, confirmed) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    ((symbol, timeframe, *row) for row in _chunk_rows(chunk)),
+                )
+                conn.commit()
+                rows += len(chunk["ts"])
+        finally:
+            conn.close()
+        target = sqlite_path
+    else:
+        conn = mysql_connect(get_mysql_config(), local_infile=method == "load_data")
+        try:
+            ensure_schema(conn)
+            for symbol, timeframe, chunk in iter_dataset(path):
+                bulk_write_rows(conn, symbol, timeframe, _chunk_rows(chunk), batch_size=batch_size, method=method)
+                rows += len(chunk["ts"])
+        finally:
+            conn.close()
+        target = "mysql"
+    seconds = pytime.perf_counter() - started
+    return {
+        "target": target,
+        "rows": rows,
+        "seconds": seconds,
+        "rows_per_min": (rows / seconds * 60.0) if seconds > 0 else 0.0,
+    }
+
+
+def main(argv=None) -> None:
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Offline export/import of okx_kline datasets")
+    sub = parser.add_subparsers(dest="command", required=True)
+    exp = sub.add_parser("export", help="Export slices to a compressed columnar .zip (one .npy per field and chunk)")
+    exp.add_argument("--symbols", nargs="+", required=True)
+    exp.add_argument("--timeframes", nargs="+", required=True)
+    exp.add_argument("--start-date", required=True, help="YYYY-MM-DD")
+    exp.add_argument("--end-date", required=True, help="YYYY-MM-DD")
+    exp.add_argument("--tz", default="Asia/Shanghai")
+    exp.add_argument("--out", required=True)
+    exp.add_argument("--chunk-rows", type=int, default=None)
+    imp = sub.add_parser("import", help="Import a dataset into MySQL or a local SQLite store")
+    imp.add_argument("--file", required=True)
+    imp.add_argument("--sqlite", default=None, help=f"Local store path (set {LOCAL_STORE_ENV} to backtest from it)")
+    imp.add_argument("--method", choices=["insert", "load_data"], default="insert")
+    imp.add_argument("--batch-size", type=int, default=None)
+    args = parser.parse_args(argv)
+
+    if args.command == "export":
+        timeframes = [normalize_timeframe(tf) for tf in args.timeframes]
+        if not all(timeframes):
+            parser.error("invalid timeframe")
+        series = [
+            (symbol, tf, *build_range_window(args.start_date, args.end_date, tf, args.tz))
+            for symbol in args.symbols
+            for tf in timeframes
+        ]
+        result = export_dataset(args.out, series, chunk_rows=args.chunk_rows)
+    else:
+        result = import_dataset(args.file, sqlite_path=args.sqlite, method=args.method, batch_size=args.batch_size)
+    print(json.dumps(result, indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,350 @@
+import argparse
+import json
+import os
+import threading
+import time as pytime
+from typing import Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+from db_migrations import Migration, apply_migrations
+from kline_sync_service import (
+    KLINE_SYMBOLS,
+    ensure_schema,
+    get_mysql_config,
+    mysql_connect,
+    normalize_timeframe,
+)
+
+# Default windows cover the backtest strategies' defaults and presets (fast/slow legs) plus sma_5/20/50.
+SMA_WINDOWS = tuple(
+    sorted({int(w) for w in os.getenv("KLINE_FEATURE_SMA_WINDOWS", "5,10,15,20,25,30,50,60,80,100").split(",") if w.strip()})
+)
+RSI_PERIOD = 14
+# Only what the backtests read; the bots' EMA/MACD/Bollinger indicators use a different
+# (fetch-window) definition, see common.calculate_technical_indicators.
+FEATURES = (*(f"sma_{w}" for w in SMA_WINDOWS), f"rsi_{RSI_PERIOD}")
+# Closes kept in the state so rolling windows continue across updates.
+_TAIL = max(max(SMA_WINDOWS) - 1, 1)
+FEATURES_ENV = "KLINE_FEATURES"
+
+
+def features_enabled() -> bool:
+    """KLINE_FEATURES=1 turns on store maintenance (daemon, WebSocket, batch) and store reads."""
+    return os.getenv(FEATURES_ENV, "0") == "1"
+
+
+# -- schema ----------------------------------------------------------------------
+
+
+def _create_feature_tables(conn) -> None:
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS okx_kline_feature (
+                symbol VARCHAR(40) CHARACTER SET ascii COLLATE ascii_bin NOT NULL,
+                timeframe VARCHAR(4) CHARACTER SET ascii COLLATE ascii_bin NOT NULL,
+                open_time_ms BIGINT NOT NULL,
+                feature VARCHAR(32) CHARACTER SET ascii COLLATE ascii_bin NOT NULL,
+                value DOUBLE NOT NULL,
+                PRIMARY KEY (symbol, timeframe, open_time_ms, feature)
+            ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+            """
+        )
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS okx_kline_feature_state (
+                symbol VARCHAR(40) CHARACTER SET ascii COLLATE ascii_bin NOT NULL,
+                timeframe VARCHAR(4) CHARACTER SET ascii COLLATE ascii_bin NOT NULL,
+                last_open_ms BIGINT NOT NULL COMMENT 'newest confirmed candle folded into the state',
+                bars BIGINT NOT NULL,
+                state MEDIUMTEXT NOT NULL COMMENT 'JSON recurrence state (EMA/RSI averages, close tail)',
+                updated_at DATETIME DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+                PRIMARY KEY (symbol, timeframe)
+            ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+            """
+        )
+    conn.commit()
+
+
+FEATURE_SCHEMA_COMPONENT = "okx_kline_feature"
+FEATURE_MIGRATIONS: list[Migration] = [
+    (1, "create okx_kline_feature and okx_kline_feature_state", _create_feature_tables),
+]
+_FEATURE_SCHEMA_READY = False
+_FEATURE_SCHEMA_LOCK = threading.Lock()
+
+
+def migrate_features(conn) -> list[int]:
+    """Create/upgrade the feature tables; run at deploy (init_mysql_tables.py)."""
+    global _FEATURE_SCHEMA_READY
+    ensure_schema(conn)
+    applied = apply_migrations(conn, FEATURE_SCHEMA_COMPONENT, FEATURE_MIGRATIONS)
+    _FEATURE_SCHEMA_READY = True
+    return applied
+
+
+def ensure_feature_schema(conn) -> None:
+    global _FEATURE_SCHEMA_READY
+    if _FEATURE_SCHEMA_READY:
+        return
+    with _FEATURE_SCHEMA_LOCK:
+        if not _FEATURE_SCHEMA_READY:
+            ensure_schema(conn)
+            apply_migrations(conn, FEATURE_SCHEMA_COMPONENT, FEATURE_MIGRATIONS)
+            _FEATURE_SCHEMA_READY = True
+
+
+# -- computation -----------------------------------------------------------------
+
+
+def _rolling(values: np.ndarray, window: int, func) -> np.ndarray:
+    out = np.full(len(values), np.nan)
+    if len(values) >= window:
+        out[window - 1 :] = func(np.lib.stride_tricks.sliding_window_view(values, window), axis=1)
+    return out
+
+
+def _ewm(values: np.ndarray, alpha: float, seed: Optional[float]) -> np.ndarray:
+    """y[t] = (1 - alpha) * y[t-1] + alpha * x[t], continuing from `seed` (or starting at x[0])."""
+    if not len(values):
+        return values.astype(np.float64)
+    series = pd.Series(values if seed is None else np.concatenate([[seed], values]))
+    out = series.ewm(alpha=alpha, adjust=False).mean().to_numpy()
+    return out if seed is None else out[1:]
+
+
+def _rsi_from(avg_gain: np.ndarray, avg_loss: np.ndarray) -> np.ndarray:
+    with np.errstate(divide="ignore", invalid="ignore"):
+        rsi = 100.0 - 100.0 / (1.0 + avg_gain / avg_loss)
+    return np.where(avg_loss <= 0, 100.0, rsi)
+
+
+def _last(values: np.ndarray, default: Optional[float]) -> Optional[float]:
+    return float(values[-1]) if len(values) else default
+
+
+def compute_features(closes: Sequence[float], state: Optional[dict] = None) -> tuple[dict[str, np.ndarray], dict]:
+    """Indicators for `closes` continuing from `state`; returns (arrays aligned to closes, new state).
+
+    Definitions match backtest_service: SMAs need a full window, RSI is
+    Wilder's smoothing seeded with the mean of the first RSI_PERIOD changes.
+    Splitting a series into any number of calls gives the same result as one
+    call over the whole series.
+    """
+    state = dict(state or {})
+    closes = np.asarray(closes, dtype=np.float64)
+    tail = np.asarray(state.get("tail", []), dtype=np.float64)
+    ext = np.concatenate([tail, closes])
+    k = len(tail)
+    out: dict[str, np.ndarray] = {}
+
+    for window in SMA_WINDOWS:
+        out[f"sma_{window}"] = _rolling(ext, window, np.mean)[k:]
+
+    # deltas[j] is the change into closes[j + offset].
+    prev = state.get("prev_close")
+    offset = 1 if prev is None else 0
+    deltas = np.diff(closes if prev is None else np.concatenate([[prev], closes]))
+    gains = np.maximum(deltas, 0.0)
+    losses = np.maximum(-deltas, 0.0)
+    rsi = np.full(len(closes), np.nan)
+    avg_gain, avg_loss = state.get("avg_gain"), state.get("avg_loss")
+    alpha = 1.0 / RSI_PERIOD
+    pending_gains, pending_losses = [], []
+    if avg_gain is None:
+        pending_gains = [*state.get("pending_gains", []), *gains.tolist()]
+        pending_losses = [*state.get("pending_losses", []), *losses.tolist()]
+        if len(pending_gains) >= RSI_PERIOD:
+            # Seed at the RSI_PERIOD-th change overall, then continue with the batch remainder.
+            used = RSI_PERIOD - len(state.get("pending_gains", []))
+            avg_gain = float(np.mean(pending_gains[:RSI_PERIOD]))
+            avg_loss = float(np.mean(pending_losses[:RSI_PERIOD]))
+            seed_at = used - 1 + offset
+            rsi[seed_at] = _rsi_from(np.array([avg_gain]), np.array([avg_loss]))[0]
+            ag = _ewm(gains[used:], alpha, avg_gain)
+            al = _ewm(losses[used:], alpha, avg_loss)
+            rsi[seed_at + 1 :] = _rsi_from(ag, al)
+            avg_gain, avg_loss = _last(ag, avg_gain), _last(al, avg_loss)
+            pending_gains, pending_losses = [], []
+    else:
+        ag = _ewm(gains, alpha, avg_gain)
+        al = _ewm(losses, alpha, avg_loss)
+        rsi[offset:] = _rsi_from(ag, al)
+        avg_gain, avg_loss = _last(ag, avg_gain), _last(al, avg_loss)
+    out[f"rsi_{RSI_PERIOD}"] = rsi
+
+    new_state = {
+        "features": list(FEATURES),
+        "tail": ext[-_TAIL:].tolist(),
+        "prev_close": _last(closes, prev),
+        "avg_gain": avg_gain,
+        "avg_loss": avg_loss,
+    }
+    if avg_gain is None:
+        new_state["pending_gains"] = pending_gains
+        new_state["pending_losses"] = pending_losses
+    return out, new_state
+
+
+# -- storage ---------------------------------------------------------------------
+
+
+def _load_state(conn, symbol: str, timeframe: str) -> tuple[Optional[int], int, dict]:
+    with conn.cursor() as cur:
+        cur.execute(
+            "SELECT last_open_ms, bars, state FROM okx_kline_feature_state WHERE symbol=%s AND timeframe=%s",
+            (symbol, timeframe),
+        )
+        row = cur.fetchone()
+    if not row:
+        return None, 0, {}
+    return int(row["last_open_ms"]), int(row["bars"]), json.loads(row["state"])
+
+
+def _feature_rows(symbol: str, timeframe: str, ts: np.ndarray, values: dict[str, np.ndarray]) -> list[tuple]:
+    rows = []
+    ts_list = ts.tolist()
+    for name in FEATURES:
+        column = values[name]
+        keep = np.flatnonzero(np.isfinite(column))
+        rows.extend((symbol, timeframe, ts_list[i], name, v) for i, v in zip(keep.tolist(), column[keep].tolist()))
+    return rows
+
+
+def update_features(
+    conn, symbol: str, timeframe: str, rebuild: bool = False, chunk_rows: Optional[int] = None
+) -> dict:
+    """Fold confirmed candles newer than the feature watermark into okx_kline_feature.
+
+    Candles are read in open-time order (rows without open/close prices are
+    skipped, like fetch_klines) in chunks of KLINE_FEATURE_CHUNK_ROWS (default
+    50000); each chunk's features and the advanced state commit together.
+    Candles older than the watermark (historical backfills) need `rebuild`.
+    """
+    tf = normalize_timeframe(timeframe)
+    if not tf:
+        raise ValueError("invalid timeframe")
+    size = max(100, int(chunk_rows or os.getenv("KLINE_FEATURE_CHUNK_ROWS", "50000")))
+    ensure_feature_schema(conn)
+    started = pytime.perf_counter()
+    if rebuild:
+        with conn.cursor() as cur:
+            cur.execute("DELETE FROM okx_kline_feature WHERE symbol=%s AND timeframe=%s", (symbol, tf))
+            cur.execute("DELETE FROM okx_kline_feature_state WHERE symbol=%s AND timeframe=%s", (symbol, tf))
+        conn.commit()
+
+    last_ms, bars, state = _load_state(conn, symbol, tf)
+    if state and state.get("features") != list(FEATURES) and not rebuild:
+        # The close tail was sized for other windows (or the state holds dropped features); start over.
+        return update_features(conn, symbol, tf, rebuild=True, chunk_rows=chunk_rows)
+    processed = 0
+    written = 0
+    while True:
+        with conn.cursor() as cur:
+            cur.execute(
+                "SELECT open_time_ms, close_price FROM okx_kline "
+                "WHERE symbol=%s AND timeframe=%s AND open_time_ms > %s AND confirmed=1 "
+                "AND open_price IS NOT NULL AND close_price IS NOT NULL ORDER BY open_time_ms LIMIT %s",
+                (symbol, tf, -1 if last_ms is None else int(last_ms), size),
+            )
+            candles = cur.fetchall() or []
+        if not candles:
+            break
+        ts = np.fromiter((int(r["open_time_ms"]) for r in candles), dtype=np.int64, count=len(candles))
+        closes = np.fromiter((float(r["close_price"]) for r in candles), dtype=np.float64, count=len(candles))
+        values, state = compute_features(closes, state)
+        rows = _feature_rows(symbol, tf, ts, values)
+        last_ms = int(ts[-1])
+        bars += len(candles)
+        with conn.cursor() as cur:
+            if rows:
+                cur.executemany(
+                    "INSERT INTO okx_kline_feature (symbol, timeframe, open_time_ms, feature, value) "
+                    "VALUES (%s, %s, %s, %s, %s) ON DUPLICATE KEY UPDATE value=VALUES(value)",
+                    rows,
+                )
+            cur.execute(
+                "INSERT INTO okx_kline_feature_state (symbol, timeframe, last_open_ms, bars, state) "
+                "VALUES (%s, %s, %s, %s, %s) ON DUPLICATE KEY UPDATE "
+                "last_open_ms=VALUES(last_open_ms), bars=VALUES(bars), state=VALUES(state)",
+                (symbol, tf, last_ms, bars, json.dumps(state)),
+            )
+        conn.commit()
+        processed += len(candles)
+        written += len(rows)
+        if len(candles) < size:
+            break
+    return {
+        "symbol": symbol,
+        "timeframe": tf,
+        "bars": processed,
+        "rows": written,
+        "last_open_ms": last_ms,
+        "rebuilt": bool(rebuild),
+        "seconds": pytime.perf_counter() - started,
+    }
+
+
+def refresh_features(conn, symbol: str, timeframe: str, changed_from_ms: Optional[int] = None) -> dict:
+    """update_features, rebuilding when candles at or before the feature watermark changed."""
+    ensure_feature_schema(conn)
+    last_ms, _, _ = _load_state(conn, symbol, normalize_timeframe(timeframe) or timeframe)
+    stale = changed_from_ms is not None and last_ms is not None and int(changed_from_ms) <= last_ms
+    return update_features(conn, symbol, timeframe, rebuild=stale)
+
+
+def load_features(
+    conn, symbol: str, timeframe: str, ts_ms: Sequence[int], names: Sequence[str] = FEATURES
+) -> dict[str, np.ndarray]:
+    """Stored features aligned to the given candle open times (NaN where missing), one query."""
+    tf = normalize_timeframe(timeframe)
+    ts = np.asarray(ts_ms, dtype=np.int64)
+    out = {name: np.full(len(ts), np.nan) for name in names}
+    if not len(ts) or not names:
+        return out
+    ensure_feature_schema(conn)
+    with conn.cursor() as cur:
+        cur.execute(
+            f"SELECT open_time_ms, feature, value FROM okx_kline_feature WHERE symbol=%s AND timeframe=%s "
+            f"AND open_time_ms >= %s AND open_time_ms <= %s AND feature IN ({', '.join(['%s'] * len(names))})",
+            (symbol, tf, int(ts[0]), int(ts[-1]), *names),
+        )
+        rows = cur.fetchall() or []
+    for name in names:
+        picked = [(int(r["open_time_ms"]), float(r["value"])) for r in rows if r["feature"] == name]
+        if not picked:
+            continue
+        at = np.array([p[0] for p in picked], dtype=np.int64)
+        idx = np.clip(np.searchsorted(ts, at), 0, len(ts) - 1)
+        hit = ts[idx] == at
+        out[name][idx[hit]] = np.array([p[1] for p in picked])[hit]
+    return out
+
+
+def main(argv=None) -> None:
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Maintain the okx_kline_feature indicator store")
+    parser.add_argument("--symbols", nargs="*", default=None, help="Default: KLINE_SYMBOLS")
+    parser.add_argument("--timeframes", nargs="+", required=True)
+    parser.add_argument("--rebuild", action="store_true", help="Recompute from the first candle (after backfills)")
+    args = parser.parse_args(argv)
+
+    timeframes = [normalize_timeframe(tf) for tf in args.timeframes]
+    if not all(timeframes):
+        parser.error("invalid timeframe")
+    conn = mysql_connect(get_mysql_config())
+    try:
+        for symbol in args.symbols or KLINE_SYMBOLS:
+            for timeframe in timeframes:
+                result = update_features(conn, symbol, timeframe, rebuild=args.rebuild)
+                print(json.dumps(result, ensure_ascii=False), flush=True)
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
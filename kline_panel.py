@@ -0,0 +1,188 @@
+import os
+import time as pytime
+from dataclasses import dataclass
+from typing import Optional, Sequence
+
+import numpy as np
+import pymysql
+
+from kline_dataset import LOCAL_STORE_ENV, open_local_store
+from kline_sync_service import (
+    TIMEFRAME_MS,
+    _SHANGHAI_OFFSET_MS,
+    bar_close_ms,
+    ensure_schema,
+    get_mysql_config,
+    mysql_connect,
+    normalize_timeframe,
+)
+
+PANEL_FIELDS = ("open", "high", "low", "close", "volume")
+
+
+@dataclass(frozen=True)
+class KlinePanel:
+    """OHLCV of many symbols on one shared time axis.
+
+    `values[f, t, s]` holds field PANEL_FIELDS[f] of symbols[s] for the bar
+    opening at ts_ms[t]; missing bars are NaN and `mask[t, s]` is True only
+    where a candle with open and close prices exists. `open`, `close`, ...
+    are views into `values`, not copies.
+    """
+
+    timeframe: str
+    symbols: tuple[str, ...]
+    ts_ms: np.ndarray  # int64 [T]
+    values: np.ndarray  # float64 [len(PANEL_FIELDS), T, N]
+    mask: np.ndarray  # bool [T, N]
+
+    @property
+    def shape(self) -> tuple[int, int]:
+        return self.mask.shape
+
+    def field(self, name: str) -> np.ndarray:
+        return self.values[PANEL_FIELDS.index(name)]
+
+    @property
+    def open(self) -> np.ndarray:
+        return self.values[0]
+
+    @property
+    def high(self) -> np.ndarray:
+        return self.values[1]
+
+    @property
+    def low(self) -> np.ndarray:
+        return self.values[2]
+
+    @property
+    def close(self) -> np.ndarray:
+        return self.values[3]
+
+    @property
+    def volume(self) -> np.ndarray:
+        return self.values[4]
+
+    def column(self, symbol: str) -> int:
+        return self.symbols.index(symbol)
+
+    def coverage(self) -> dict[str, float]:
+        """Share of bars present per symbol, in percent."""
+        if not len(self.ts_ms):
+            return {s: 100.0 for s in self.symbols}
+        present = self.mask.mean(axis=0) * 100.0
+        return dict(zip(self.symbols, present.tolist()))
+
+
+def panel_time_axis(timeframe: str, start_ms: int, end_ms: int, now_ms: Optional[int] = None) -> np.ndarray:
+    """Bar opens in [start_ms, min(end_ms, now)] on the OKX grid (Shanghai-aligned days and months)."""
+    now_ms = int(pytime.time() * 1000) if now_ms is None else int(now_ms)
+    upper = min(int(end_ms), now_ms + 1)
+    if timeframe == "1M":
+        opens = []
+        ts = bar_close_ms("1M", int(start_ms) - 1)
+        # bar_close_ms of the month containing start-1 is the first month start >= start.
+        while ts < upper:
+            opens.append(ts)
+            ts = bar_close_ms("1M", ts)
+        return np.asarray(opens, dtype=np.int64)
+    tf_ms = TIMEFRAME_MS[timeframe]
+    first = -(-(int(start_ms) + _SHANGHAI_OFFSET_MS) // tf_ms) * tf_ms - _SHANGHAI_OFFSET_MS
+    return np.arange(first, max(first, upper), tf_ms, dtype=np.int64)
+
+
+def _mysql_panel_query(n_symbols: int) -> str:
+    symbols = ", ".join(["%s"] * n_symbols)
+    # IN (...) becomes one primary-key range per symbol inside the timeframe partition.
+    return (
+        f"SELECT FIELD(symbol, {symbols}) - 1 AS col, open_time_ms, open_price, high_price, low_price, "
+        f"close_price, volume FROM okx_kline WHERE symbol IN ({symbols}) AND timeframe=%s "
+        "AND open_time_ms >= %s AND open_time_ms < %s"
+    )
+
+
+def _sqlite_panel_query(n_symbols: int) -> str:
+    # SQLite has no FIELD(); joining a constant table keeps the per-symbol key range and numeric columns.
+    wanted = " UNION ALL ".join(f"SELECT {i} AS col, ? AS symbol" for i in range(n_symbols))
+    return (
+        "SELECT w.col, k.open_time_ms, k.open_price, k.high_price, k.low_price, k.close_price, k.volume "
+        f"FROM ({wanted}) AS w JOIN okx_kline AS k ON k.symbol = w.symbol AND k.timeframe = ? "
+        "AND k.open_time_ms >= ? AND k.open_time_ms < ?"
+    )
+
+
+def _scatter(panel: KlinePanel, rows: list[tuple], tf_ms: Optional[int]) -> int:
+    block = np.array(rows, dtype=np.float64)  # NULL prices become nan
+    cols = block[:, 0].astype(np.int64)
+    ts = block[:, 1].astype(np.int64)
+    axis = panel.ts_ms
+    if tf_ms is None:
+        idx = np.minimum(np.searchsorted(axis, ts), len(axis) - 1)
+    else:
+        idx = np.clip((ts - axis[0]) // tf_ms, 0, len(axis) - 1)
+    on_grid = axis[idx] == ts
+    idx, cols, block = idx[on_grid], cols[on_grid], block[on_grid]
+    panel.values[:, idx, cols] = block[:, 2:7].T
+    panel.mask[idx, cols] = ~(np.isnan(block[:, 2]) | np.isnan(block[:, 5]))
+    return int((~on_grid).sum())
+
+
+def load_panel(
+    symbols: Sequence[str],
+    timeframe: str,
+    start_ms: int,
+    end_ms: int,
+    chunk_rows: Optional[int] = None,
+    now_ms: Optional[int] = None,
+) -> KlinePanel:
+    """Load symbols x [start_ms, end_ms) of one timeframe with a single query.
+
+    The time axis is the full bar grid of the window (clipped at now), so
+    bars no symbol has are still present as masked rows. All arrays are
+    allocated once up front; rows stream through an unbuffered cursor in
+    chunks of KLINE_PANEL_CHUNK_ROWS (default 100000) and are scattered into
+    place with numpy. Reads the KLINE_LOCAL_STORE SQLite store when set.
+    """
+    tf = normalize_timeframe(timeframe)
+    if not tf:
+        raise ValueError("invalid timeframe")
+    symbols = tuple(dict.fromkeys(symbols))
+    if not symbols:
+        raise ValueError("symbols are required")
+    size = max(1000, int(chunk_rows or os.getenv("KLINE_PANEL_CHUNK_ROWS", "100000")))
+    axis = panel_time_axis(tf, start_ms, end_ms, now_ms=now_ms)
+    panel = KlinePanel(
+        timeframe=tf,
+        symbols=symbols,
+        ts_ms=axis,
+        values=np.full((len(PANEL_FIELDS), len(axis), len(symbols)), np.nan),
+        mask=np.zeros((len(axis), len(symbols)), dtype=bool),
+    )
+    if not len(axis):
+        return panel
+
+    tf_ms = None if tf == "1M" else TIMEFRAME_MS[tf]
+    window = (tf, int(axis[0]), int(axis[-1]) + 1)
+    off_grid = 0
+    local_store = os.getenv(LOCAL_STORE_ENV)
+    if local_store:
+        conn = open_local_store(local_store)
+        try:
+            cur = conn.execute(_sqlite_panel_query(len(symbols)), (*symbols, *window))
+            while rows := cur.fetchmany(size):
+                off_grid += _scatter(panel, rows, tf_ms)
+        finally:
+            conn.close()
+    else:
+        conn = mysql_connect(get_mysql_config())
+        try:
+            ensure_schema(conn)
+            with conn.cursor(pymysql.cursors.SSCursor) as cur:
+                cur.execute(_mysql_panel_query(len(symbols)), (*symbols, *symbols, *window))
+                while rows := cur.fetchmany(size):
+                    off_grid += _scatter(panel, rows, tf_ms)
+        finally:
+            conn.close()
+    if off_grid:
+        print(f"[warn] {tf} panel: {off_grid} rows off the bar grid were skipped")
+    return panel
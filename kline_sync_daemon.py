@@ -0,0 +1,352 @@
+import argparse
+import heapq
+import json
+import os
+import signal
+import threading
+import time as pytime
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional
+
+from instrument_catalog import parse_shard, resolve_symbols, shard_symbols, sync_universe
+from kline_features import features_enabled, update_features
+from kline_sync_service import (
+    DAY_TIMEFRAMES,
+    RANGE_TIMEFRAMES,
+    TIMEFRAME_MS,
+    bar_close_ms,
+    ensure_schema,
+    get_mysql_config,
+    mysql_connect,
+    normalize_timeframe,
+    sync_lag,
+    sync_to_now,
+)
+
+ALL_TIMEFRAMES = sorted({*DAY_TIMEFRAMES, *RANGE_TIMEFRAMES}, key=lambda tf: TIMEFRAME_MS[tf])
+
+
+class KlineSyncDaemon:
+    """Keep every (symbol, timeframe) current by syncing just after each bar closes.
+
+    Each series is scheduled for its next bar close plus `settle_seconds`
+    (KLINE_DAEMON_SETTLE_SECONDS) and synced with sync_to_now on a pool of
+    `workers` threads (KLINE_DAEMON_WORKERS). All OKX requests of the process
+    go through the shared HISTORY_CANDLES_LIMITER, so adding series never
+    raises the request rate. A series whose newest bar is not confirmed yet is
+    retried every `retry_seconds`; failures back off exponentially.
+
+    Without explicit `symbols` the universe comes from sync_universe()
+    (KLINE_SYNC_UNIVERSE=all: every live USDT swap) and is re-read every
+    KLINE_DAEMON_UNIVERSE_SECONDS so new listings are picked up and delisted
+    series stop being scheduled. `shard`
+    (or KLINE_SYNC_SHARD, e.g. "0/4") keeps only a stable subset of the
+    symbols, so the universe can be split across processes on separate IPs.
+    """
+
+    def __init__(
+        self,
+        symbols: Optional[list[str]] = None,
+        timeframes: Optional[list[str]] = None,
+        workers: Optional[int] = None,
+        settle_seconds: Optional[float] = None,
+        retry_seconds: Optional[float] = None,
+        max_backoff_seconds: float = 300.0,
+        on_synced: Optional[Callable[[str, str, dict], None]] = None,
+        shard: Optional[str] = None,
+    ) -> None:
+        shard_text = shard or os.getenv("KLINE_SYNC_SHARD")
+        self.shard = parse_shard(shard_text) if shard_text else (0, 1)
+        self.follow_universe = not symbols
+        self.universe_ms = int(float(os.getenv("KLINE_DAEMON_UNIVERSE_SECONDS", "3600")) * 1000)
+        self.symbols = shard_symbols(list(symbols or sync_universe()), *self.shard)
+        self.timeframes = list(timeframes or ALL_TIMEFRAMES)
+        self.workers = max(1, int(workers or os.getenv("KLINE_DAEMON_WORKERS", "4")))
+        self.settle_ms = int(float(settle_seconds or os.getenv("KLINE_DAEMON_SETTLE_SECONDS", "3")) * 1000)
+        self.retry_ms = int(float(retry_seconds or os.getenv("KLINE_DAEMON_RETRY_SECONDS", "5")) * 1000)
+        self.max_backoff_ms = int(max_backoff_seconds * 1000)
+        self.on_synced = on_synced
+
+        self._heap: list[tuple[int, str, str]] = []
+        self._series: dict[tuple[str, str], dict] = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._local = threading.local()
+        self._connections: list = []
+        self._universe_checked_ms = 0
+
+    # -- lifecycle -----------------------------------------------------------
+
+    def start(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self.run_forever, name="kline-sync-daemon", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: Optional[float] = 30.0) -> None:
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def run_forever(self) -> None:
+        self._bootstrap()
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="kline-sync") as pool:
+            while not self._stop.is_set():
+                now_ms = int(pytime.time() * 1000)
+                if self.follow_universe and now_ms - self._universe_checked_ms >= self.universe_ms:
+                    self._refresh_universe(now_ms)
+                with self._lock:
+                    while self._heap and self._heap[0][0] <= now_ms:
+                        _, symbol, timeframe = heapq.heappop(self._heap)
+                        entry = self._series[(symbol, timeframe)]
+                        entry["running"] = True
+                        entry["next_run_ms"] = None
+                        pool.submit(self._run_series, symbol, timeframe)
+                    wait_ms = (self._heap[0][0] - now_ms) if self._heap else 1000
+                self._wake.wait(min(max(wait_ms, 10), 1000) / 1000.0)
+                self._wake.clear()
+            # Leaving the with-block waits for syncs that are already running.
+        self._close_all_connections()
+
+    def run_once(self) -> list[dict]:
+        """Sync every series a single time (no scheduling) and return the status."""
+        self._bootstrap()
+        with self._lock:
+            for entry in self._series.values():
+                entry["running"] = True
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="kline-sync") as pool:
+            list(pool.map(lambda key: self._run_series(*key), list(self._series)))
+        self._close_all_connections()
+        with self._lock:
+            self._heap.clear()
+        return self.status()
+
+    # -- scheduling ----------------------------------------------------------
+
+    def _bootstrap(self) -> None:
+        with self._lock:
+            self._heap.clear()
+            self._series.clear()
+        self._add_series(self.symbols, int(pytime.time() * 1000))
+
+    def _refresh_universe(self, now_ms: int) -> None:
+        self._universe_checked_ms = now_ms
+        try:
+            symbols = shard_symbols(sync_universe(), *self.shard)
+        except Exception as exc:
+            print(f"[kline-daemon] 刷新合约列表失败: {exc}")
+            return
+        keep = set(symbols)
+        removed = [s for s in self.symbols if s not in keep]
+        if removed:
+            print(f"[kline-daemon] 移除 {len(removed)} 个已下线合约: {', '.join(removed[:10])}{' ...' if len(removed) > 10 else ''}")
+            self.symbols = [s for s in self.symbols if s in keep]
+            self._remove_series(removed)
+        added = [s for s in symbols if s not in self.symbols]
+        if added:
+            print(f"[kline-daemon] 新增 {len(added)} 个合约: {', '.join(added[:10])}{' ...' if len(added) > 10 else ''}")
+            self.symbols.extend(added)
+            self._add_series(added, now_ms)
+
+    def _remove_series(self, symbols: list[str]) -> None:
+        dropped = set(symbols)
+        with self._lock:
+            for key in [k for k in self._series if k[0] in dropped]:
+                del self._series[key]
+            # A sync already running for a dropped series finishes but is not rescheduled.
+            self._heap = [item for item in self._heap if item[1] not in dropped]
+            heapq.heapify(self._heap)
+
+    def _add_series(self, symbols: list[str], now_ms: int) -> None:
+        conn = mysql_connect(get_mysql_config())
+        try:
+            ensure_schema(conn)
+            known = {(r["symbol"], r["timeframe"]): r for r in sync_lag(conn, symbols, self.timeframes)}
+        finally:
+            conn.close()
+        with self._lock:
+            order = 0
+            for timeframe in self.timeframes:
+                for symbol in symbols:
+                    key = (symbol, timeframe)
+                    self._series[key] = {
+                        "last_confirmed_ms": known.get(key, {}).get("last_confirmed_ms"),
+                        "next_run_ms": now_ms,
+                        "last_run_ms": None,
+                        "last_duration_ms": None,
+                        "last_result": None,
+                        "last_error": None,
+                        "runs": 0,
+                        "failures": 0,
+                        "running": False,
+                    }
+                    # Everything is due now; the 1 ms steps make short timeframes go first.
+                    heapq.heappush(self._heap, (now_ms + order, symbol, timeframe))
+                    order += 1
+
+    def _next_run_ms(self, timeframe: str, last_confirmed_ms: Optional[int], now_ms: int) -> int:
+        if last_confirmed_ms is None:
+            # Nothing listed in the lookback window yet; look again a bar (at most 15 min) later.
+            return now_ms + min(TIMEFRAME_MS[timeframe], 15 * 60_000)
+        forming_open = bar_close_ms(timeframe, last_confirmed_ms)
+        next_close = bar_close_ms(timeframe, forming_open)
+        # When next_close already passed, OKX has not confirmed the bar yet: poll again shortly.
+        return max(next_close + self.settle_ms, now_ms + self.retry_ms)
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = mysql_connect(get_mysql_config())
+            self._local.conn = conn
+            with self._lock:
+                self._connections.append(conn)
+        else:
+            conn.ping(reconnect=True)
+        return conn
+
+    def _close_connection(self) -> None:
+        conn = getattr(self._local, "conn", None)
+        self._local.conn = None
+        if conn is not None:
+            with self._lock:
+                if conn in self._connections:
+                    self._connections.remove(conn)
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+    def _close_all_connections(self) -> None:
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+    def _run_series(self, symbol: str, timeframe: str) -> None:
+        key = (symbol, timeframe)
+        started = pytime.time()
+        result = None
+        error = None
+        try:
+            result = sync_to_now(symbol, timeframe, conn=self._connection())
+        except Exception as exc:
+            error = str(exc)
+            self._close_connection()
+            print(f"[kline-daemon] {symbol} {timeframe} 同步失败: {exc}")
+        if error is None and features_enabled():
+            try:
+                update_features(self._connection(), symbol, timeframe)
+            except Exception as exc:
+                # Features catch up on the next run; the candle sync itself succeeded.
+                self._close_connection()
+                print(f"[kline-daemon] {symbol} {timeframe} 指标更新失败: {exc}")
+
+        now_ms = int(pytime.time() * 1000)
+        with self._lock:
+            entry = self._series.get(key)
+            if entry is None or not entry["running"]:
+                # Dropped from the universe while syncing (or re-added with a fresh schedule).
+                return
+            entry["runs"] += 1
+            entry["running"] = False
+            entry["last_run_ms"] = int(started * 1000)
+            entry["last_duration_ms"] = now_ms - int(started * 1000)
+            if error is None:
+                entry["failures"] = 0
+                entry["last_error"] = None
+                entry["last_confirmed_ms"] = result.get("last_confirmed_ms")
+                entry["last_result"] = {k: result.get(k) for k in ("fetched", "inserted", "updated", "unchanged")}
+                due = self._next_run_ms(timeframe, entry["last_confirmed_ms"], now_ms)
+            else:
+                entry["failures"] += 1
+                entry["last_error"] = error
+                due = now_ms + min(self.max_backoff_ms, self.retry_ms * 2 ** (entry["failures"] - 1))
+            entry["next_run_ms"] = due
+            if not self._stop.is_set():
+                heapq.heappush(self._heap, (due, symbol, timeframe))
+        self._wake.set()
+
+        if error is None and self.on_synced is not None and (result.get("inserted") or result.get("updated")):
+            try:
+                self.on_synced(symbol, timeframe, result)
+            except Exception as exc:
+                print(f"[kline-daemon] on_synced 回调失败: {exc}")
+
+    # -- status --------------------------------------------------------------
+
+    def status(self, now_ms: Optional[int] = None) -> list[dict]:
+        """Per-series lag (time since the newest confirmed candle closed) and scheduler state."""
+        now_ms = int(pytime.time() * 1000) if now_ms is None else int(now_ms)
+        report = []
+        with self._lock:
+            for (symbol, timeframe), entry in self._series.items():
+                last_ms = entry["last_confirmed_ms"]
+                lag_ms = None if last_ms is None else max(0, now_ms - bar_close_ms(timeframe, last_ms))
+                report.append(
+                    {
+                        "symbol": symbol,
+                        "timeframe": timeframe,
+                        "lag_ms": lag_ms,
+                        "lag_bars": None if lag_ms is None else lag_ms // TIMEFRAME_MS[timeframe],
+                        **entry,
+                    }
+                )
+        return report
+
+
+def main(argv=None) -> None:
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Continuous okx_kline sync for all symbols and timeframes")
+    parser.add_argument("--symbols", nargs="*", default=None, help="'all' for every USDT swap (default: KLINE_SYNC_UNIVERSE)")
+    parser.add_argument("--timeframes", nargs="*", default=None, help="Default: all day and range timeframes")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--shard", default=None, help="Only sync shard INDEX/COUNT of the symbols, e.g. 0/4")
+    parser.add_argument("--once", action="store_true", help="Sync every series once and exit")
+    args = parser.parse_args(argv)
+
+    timeframes = None
+    if args.timeframes:
+        timeframes = [normalize_timeframe(tf) for tf in args.timeframes]
+        if not all(timeframes):
+            parser.error("invalid timeframe")
+
+    symbols = args.symbols
+    if symbols and [s.lower() for s in symbols] == ["all"]:
+        # Follow the catalog (new listings included) instead of a fixed snapshot.
+        os.environ["KLINE_SYNC_UNIVERSE"] = "all"
+        symbols = None
+    try:
+        symbols = resolve_symbols(symbols) if symbols else None
+        daemon = KlineSyncDaemon(symbols=symbols, timeframes=timeframes, workers=args.workers, shard=args.shard)
+    except ValueError as exc:
+        parser.error(str(exc))
+    if args.once:
+        print(json.dumps(daemon.run_once(), indent=2, ensure_ascii=False))
+        return
+
+    def handle_stop(signum, frame):
+        print(f"[kline-daemon] 收到信号 {signum}，正在停止...")
+        daemon.stop(timeout=0)
+
+    signal.signal(signal.SIGTERM, handle_stop)
+    signal.signal(signal.SIGINT, handle_stop)
+    print(f"[kline-daemon] 启动: {len(daemon.symbols)} symbols x {len(daemon.timeframes)} timeframes, workers={daemon.workers}")
+    daemon.run_forever()
+    print("[kline-daemon] 已停止")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,31 @@
+import math
 import os
+import queue
+import random
+import tempfile
+import threading
 import time as pytime
 from datetime import date, datetime, time, timedelta, timezone
-from typing import Optional, Union
+from typing import Callable, Iterable, Iterator, Optional, Union
 from zoneinfo import ZoneInfo
 
+import numpy as np
 import pymysql
 import requests
+import requests.adapters
+
+from db_migrations import Migration, apply_migrations, current_version
 
 STORAGE_TZ_NAME = "Asia/Shanghai"
 STORAGE_TZ = ZoneInfo(STORAGE_TZ_NAME)
 
+KLINE_SYMBOLS = [
+    "BTC/USDT:USDT",
+    "ETH/USDT:USDT",
+    "DOGE/USDT:USDT",
+    "XRP/USDT:USDT",
+]
+
 TIMEFRAME_ALIASES = {
     "1m": "1m",
     "5m": "5m",
@@ -24,6 +40,16 @@ TIMEFRAME_ALIASES = {
 DAY_TIMEFRAMES = {"1m", "5m", "15m", "1H"}
 RANGE_TIMEFRAMES = {"1D", "1M"}
 
+# Nominal bar length. "1M" uses the longest month so it never closes a bar early.
+TIMEFRAME_MS = {
+    "1m": 60_000,
+    "5m": 5 * 60_000,
+    "15m": 15 * 60_000,
+    "1H": 60 * 60_000,
+    "1D": 24 * 60 * 60_000,
+    "1M": 31 * 24 * 60 * 60_000,
+}
+
 
 def normalize_timeframe(value: Optional[str]) -> Optional[str]:
     if value is None:
@@ -31,6 +57,13 @@ def normalize_timeframe(value: Optional[str]) -> Optional[str]:
     return TIMEFRAME_ALIASES.get(str(value).strip())
 
 
+def timeframe_to_ms(timeframe: str) -> int:
+    tf = normalize_timeframe(timeframe)
+    if not tf:
+        raise ValueError(f"unsupported timeframe: {timeframe}")
+    return TIMEFRAME_MS[tf]
+
+
 def parse_iso_date(value: str) -> date:
     return datetime.strptime(value, "%Y-%m-%d").date()
 
@@ -98,7 +131,7 @@ def get_mysql_config() -> dict:
     }
 
 
-def mysql_connect(cfg: dict):
+def mysql_connect(cfg: dict, local_infile: bool = False):
     kwargs = {
         "host": cfg["host"],
         "port": cfg["port"],
@@ -108,7 +141,12 @@ def mysql_connect(cfg: dict):
         "charset": "utf8mb4",
         "autocommit": False,
         "cursorclass": pymysql.cursors.DictCursor,
+        # Shanghai session time zone on connect instead of a SET round trip per call.
+        "init_command": "SET time_zone = '+08:00'",
     }
+    if local_infile:
+        # Required for the LOAD DATA LOCAL INFILE route of bulk_write_rows.
+        kwargs["local_infile"] = True
     if os.getenv("MYSQL_SSL_DISABLED", "0") != "1":
         kwargs["ssl"] = {"ssl": {}}
     return pymysql.connect(**kwargs)
@@ -125,16 +163,15 @@ def _is_tidb(conn) -> bool:
         return False
 
 
-def ensure_session_timezone(conn, tz_offset: str = "+08:00") -> None:
-    try:
-        with conn.cursor() as cur:
-            cur.execute("SET time_zone = %s", (tz_offset,))
-        conn.commit()
-    except Exception:
-        try:
-            conn.rollback()
-        except Exception:
-            pass
+# Shanghai local time from the database clock, so every writer and the migration watermark agree.
+_SHANGHAI_NOW_SQL = "DATE_ADD(UTC_TIMESTAMP(), INTERVAL 8 HOUR)"
+
+
+def _has_kline_id(conn) -> bool:
+    """True while okx_kline still has the pre-clustered layout (surrogate id column)."""
+    with conn.cursor() as cur:
+        cur.execute("SHOW COLUMNS FROM okx_kline LIKE 'id'")
+        return bool(cur.fetchone())
 
 
 def ensure_kline_triggers(conn, table: str = "okx_kline") -> None:
@@ -142,56 +179,44 @@ def ensure_kline_triggers(conn, table: str = "okx_kline") -> None:
     Ensure DB-side timestamps are Shanghai local time regardless of MySQL server/session time_zone.
 
     We do this via triggers using UTC_TIMESTAMP()+8 hours so it doesn't depend on time zone tables.
+    Errors (e.g. no TRIGGER privilege, or binary logging without
+    log_bin_trust_function_creators) propagate, so migration 4 is not recorded as applied.
     """
     if _is_tidb(conn):
         return
     trigger_insert = f"{table}_bi_shanghai_ts"
     trigger_update = f"{table}_bu_shanghai_ts"
 
-    existing = set()
-    try:
-        with conn.cursor() as cur:
-            cur.execute(
-                """
-                SELECT trigger_name
-                FROM information_schema.triggers
-                WHERE trigger_schema = DATABASE()
-                  AND trigger_name IN (%s, %s)
-                """,
-                (trigger_insert, trigger_update),
-            )
-            existing = {str(r.get("trigger_name")) for r in (cur.fetchall() or []) if r.get("trigger_name")}
-    except Exception:
-        return
-
-    utc_plus_8 = "DATE_ADD(UTC_TIMESTAMP(), INTERVAL 8 HOUR)"
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            SELECT trigger_name
+            FROM information_schema.triggers
+            WHERE trigger_schema = DATABASE()
+              AND trigger_name IN (%s, %s)
+            """,
+            (trigger_insert, trigger_update),
+        )
+        existing = {str(r.get("trigger_name")) for r in (cur.fetchall() or []) if r.get("trigger_name")}
 
+    utc_plus_8 = _SHANGHAI_NOW_SQL
+    statements = []
     if trigger_insert not in existing:
-        sql = (
+        statements.append(
             f"CREATE TRIGGER `{trigger_insert}` BEFORE INSERT ON `{table}` "
             f"FOR EACH ROW BEGIN "
             f"SET NEW.created_at = COALESCE(NEW.created_at, {utc_plus_8}); "
             f"SET NEW.updated_at = COALESCE(NEW.updated_at, {utc_plus_8}); "
             f"END"
         )
-        try:
-            with conn.cursor() as cur:
-                cur.execute(sql)
-            conn.commit()
-        except Exception as exc:
-            try:
-                conn.rollback()
-            except Exception:
-                pass
-            print(f"[warn] cannot create trigger {trigger_insert}: {exc}")
-
     if trigger_update not in existing:
-        sql = (
+        statements.append(
             f"CREATE TRIGGER `{trigger_update}` BEFORE UPDATE ON `{table}` "
             f"FOR EACH ROW BEGIN "
             f"SET NEW.updated_at = {utc_plus_8}; "
             f"END"
         )
+    for sql in statements:
         try:
             with conn.cursor() as cur:
                 cur.execute(sql)
@@ -201,15 +226,118 @@ def ensure_kline_triggers(conn, table: str = "okx_kline") -> None:
                 conn.rollback()
             except Exception:
                 pass
-            print(f"[warn] cannot create trigger {trigger_update}: {exc}")
+            raise RuntimeError(f"cannot create trigger on {table}: {exc}") from exc
+
+
+def _create_kline_table(conn) -> None:
+    # Fresh installs start on the clustered layout; an existing table is upgraded by the later steps.
+    with conn.cursor() as cur:
+        cur.execute("SHOW TABLES LIKE 'okx_kline'")
+        exists = bool(cur.fetchone())
+    if not exists:
+        _create_clustered_kline_table(conn, "okx_kline")
+
+
+def _rename_open_time_utc(conn) -> None:
+    # Backward compatible: if an older table still uses `open_time_utc`, rename it in-place.
+    with conn.cursor() as cur:
+        cur.execute("SHOW COLUMNS FROM okx_kline LIKE 'open_time_shanghai'")
+        has_new = bool(cur.fetchone())
+        cur.execute("SHOW COLUMNS FROM okx_kline LIKE 'open_time_utc'")
+        has_old = bool(cur.fetchone())
+        if (not has_new) and has_old:
+            cur.execute(
+                "ALTER TABLE okx_kline "
+                "CHANGE COLUMN open_time_utc open_time_shanghai DATETIME NOT NULL "
+                "COMMENT 'Asia/Shanghai local time (UTC+8)'"
+            )
+    conn.commit()
 
 
-def ensure_table(conn) -> None:
+def _add_confirmed_column(conn) -> None:
+    with conn.cursor() as cur:
+        cur.execute("SHOW COLUMNS FROM okx_kline LIKE 'confirmed'")
+        if not cur.fetchone():
+            cur.execute(
+                "ALTER TABLE okx_kline "
+                "ADD COLUMN confirmed TINYINT NOT NULL DEFAULT 1 "
+                "COMMENT 'OKX confirm flag: 0 = candle still forming' AFTER volume"
+            )
+            # Rows last written before their bar closed were still forming. open_time_shanghai and
+            # updated_at are both Shanghai local time, so compare them directly.
+            for timeframe, tf_ms in TIMEFRAME_MS.items():
+                interval = "INTERVAL 1 MONTH" if timeframe == "1M" else f"INTERVAL {tf_ms // 1000} SECOND"
+                cur.execute(
+                    "UPDATE okx_kline SET confirmed = 0, updated_at = updated_at "
+                    f"WHERE BINARY timeframe = %s AND updated_at < DATE_ADD(open_time_shanghai, {interval})",
+                    (timeframe,),
+                )
+    conn.commit()
+
+
+def _create_sync_state_table(conn) -> None:
     sql = """
-    CREATE TABLE IF NOT EXISTS okx_kline (
+    CREATE TABLE IF NOT EXISTS okx_kline_sync_state (
+        symbol VARCHAR(64) NOT NULL,
+        timeframe VARCHAR(16) NOT NULL,
+        first_confirmed_ms BIGINT NOT NULL COMMENT 'start of the contiguous confirmed range',
+        last_confirmed_ms BIGINT NOT NULL COMMENT 'open_time_ms of the newest confirmed candle',
+        updated_at DATETIME DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+        PRIMARY KEY (symbol, timeframe)
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+    """
+    with conn.cursor() as cur:
+        cur.execute(sql)
+    conn.commit()
+
+
+def _create_backfill_table(conn) -> None:
+    sql = """
+    CREATE TABLE IF NOT EXISTS okx_kline_backfill_job (
         id BIGINT PRIMARY KEY AUTO_INCREMENT,
         symbol VARCHAR(64) NOT NULL,
         timeframe VARCHAR(16) NOT NULL,
+        start_ms BIGINT NOT NULL,
+        end_ms BIGINT NOT NULL,
+        cursor_ms BIGINT NOT NULL COMMENT '[cursor_ms, end_ms) is already stored',
+        status VARCHAR(16) NOT NULL DEFAULT 'running',
+        pages BIGINT NOT NULL DEFAULT 0,
+        fetched BIGINT NOT NULL DEFAULT 0,
+        last_error TEXT,
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        updated_at DATETIME DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+        UNIQUE KEY uq_backfill_window (symbol, timeframe, start_ms, end_ms)
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+    """
+    with conn.cursor() as cur:
+        cur.execute(sql)
+    conn.commit()
+
+
+# Clustered layout: the primary key is the only index, and timeframe is case-sensitive so "1m"
+# and "1M" never collide (they did under the old utf8mb4_general_ci unique key).
+_KLINE_PARTITIONS = {"1m": "p_1min", "5m": "p_5min", "15m": "p_15min", "1H": "p_1h", "1D": "p_1d", "1M": "p_1mon"}
+_KLINE_COPY_COLUMNS = (
+    "symbol, timeframe, open_time_ms, open_time_shanghai, open_price, high_price, low_price, close_price, "
+    "volume, confirmed, created_at, updated_at"
+)
+_KLINE_NEWER_WINS = (
+    "open_price = IF(VALUES(updated_at) >= updated_at, VALUES(open_price), open_price), "
+    "high_price = IF(VALUES(updated_at) >= updated_at, VALUES(high_price), high_price), "
+    "low_price = IF(VALUES(updated_at) >= updated_at, VALUES(low_price), low_price), "
+    "close_price = IF(VALUES(updated_at) >= updated_at, VALUES(close_price), close_price), "
+    "volume = IF(VALUES(updated_at) >= updated_at, VALUES(volume), volume), "
+    "confirmed = IF(VALUES(updated_at) >= updated_at, VALUES(confirmed), confirmed), "
+    "updated_at = GREATEST(updated_at, VALUES(updated_at))"
+)
+
+
+def _create_clustered_kline_table(conn, table: str) -> None:
+    partitions = ",\n        ".join(f"PARTITION {name} VALUES IN ('{tf}')" for tf, name in _KLINE_PARTITIONS.items())
+    sql = f"""
+    CREATE TABLE IF NOT EXISTS {table} (
+        symbol VARCHAR(40) CHARACTER SET ascii COLLATE ascii_bin NOT NULL,
+        timeframe VARCHAR(4) CHARACTER SET ascii COLLATE ascii_bin NOT NULL,
         open_time_ms BIGINT NOT NULL,
         open_time_shanghai DATETIME NOT NULL COMMENT 'Asia/Shanghai local time (UTC+8)',
         open_price DOUBLE,
@@ -217,33 +345,152 @@ def ensure_table(conn) -> None:
         low_price DOUBLE,
         close_price DOUBLE,
         volume DOUBLE,
-        created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-        updated_at DATETIME DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
-        UNIQUE KEY uq_symbol_tf_open (symbol, timeframe, open_time_ms),
-        INDEX idx_symbol_tf_time (symbol, timeframe, open_time_ms)
+        confirmed TINYINT NOT NULL DEFAULT 1 COMMENT 'OKX confirm flag: 0 = candle still forming',
+        created_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        updated_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+        PRIMARY KEY (symbol, timeframe, open_time_ms)
     ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+    PARTITION BY LIST COLUMNS (timeframe) (
+        {partitions}
+    )
     """
     with conn.cursor() as cur:
         cur.execute(sql)
     conn.commit()
 
-    ensure_session_timezone(conn, tz_offset="+08:00")
 
-    # Backward compatible: if an older table still uses `open_time_utc`, rename it in-place.
+def _db_now(conn) -> datetime:
+    """Delta watermark on the clock that stamps updated_at (see _SHANGHAI_NOW_SQL).
+
+    updated_at has second precision and MySQL rounds fractions, so the
+    watermark is floored and moved back a second; re-copying a few rows
+    is harmless because the newer updated_at wins.
+    """
     with conn.cursor() as cur:
-        cur.execute("SHOW COLUMNS FROM okx_kline LIKE 'open_time_shanghai'")
-        has_new = bool(cur.fetchone())
-        cur.execute("SHOW COLUMNS FROM okx_kline LIKE 'open_time_utc'")
-        has_old = bool(cur.fetchone())
-        if (not has_new) and has_old:
-            cur.execute(
-                "ALTER TABLE okx_kline "
-                "CHANGE COLUMN open_time_utc open_time_shanghai DATETIME NOT NULL "
-                "COMMENT 'Asia/Shanghai local time (UTC+8)'"
-            )
+        cur.execute(f"SELECT DATE_SUB({_SHANGHAI_NOW_SQL}, INTERVAL 1 SECOND) AS now")
+        return cur.fetchone()["now"]
+
+
+def _copy_kline_delta(conn, source: str, target: str, since: datetime) -> int:
+    """Re-copy rows written to `source` since `since`; the newer updated_at wins on conflicts."""
+    with conn.cursor() as cur:
+        affected = cur.execute(
+            f"INSERT INTO {target} ({_KLINE_COPY_COLUMNS}) "
+            f"SELECT {_KLINE_COPY_COLUMNS} FROM {source} WHERE updated_at >= %s "
+            f"ON DUPLICATE KEY UPDATE {_KLINE_NEWER_WINS}",
+            (since,),
+        )
+    conn.commit()
+    return int(affected or 0)
+
+
+def _migrate_clustered_layout(conn, chunk_rows: Optional[int] = None) -> None:
+    """Move okx_kline to the clustered, partitioned layout without stopping writers.
+
+    1. Create okx_kline_new and copy the old table in id-range chunks (one
+       short transaction each; INSERT IGNORE, so a crashed run can resume).
+    2. Re-copy rows written during the copy (updated_at >= copy start).
+    3. Swap both tables in one atomic RENAME.
+    4. Re-copy rows that reached the old table between step 2 and the swap.
+    okx_kline_old is kept for inspection and can be dropped afterwards.
+    """
+    if not _has_kline_id(conn):
+        return
+    size = max(1000, int(chunk_rows or os.getenv("KLINE_MIGRATE_CHUNK_ROWS", "50000")))
+    _create_clustered_kline_table(conn, "okx_kline_new")
+
+    copy_started = _db_now(conn)
+    with conn.cursor() as cur:
+        cur.execute("SELECT MIN(id) AS lo, MAX(id) AS hi FROM okx_kline")
+        bounds = cur.fetchone() or {}
+    if bounds.get("lo") is not None:
+        lo, hi = int(bounds["lo"]), int(bounds["hi"])
+        for chunk_lo in range(lo, hi + 1, size):
+            with conn.cursor() as cur:
+                cur.execute(
+                    f"INSERT IGNORE INTO okx_kline_new ({_KLINE_COPY_COLUMNS}) "
+                    f"SELECT {_KLINE_COPY_COLUMNS} FROM okx_kline WHERE id >= %s AND id < %s",
+                    (chunk_lo, chunk_lo + size),
+                )
             conn.commit()
+            print(f"[migrate] okx_kline copy: id {min(chunk_lo + size - 1, hi)}/{hi}")
+
+    delta_started = _db_now(conn)
+    _copy_kline_delta(conn, "okx_kline", "okx_kline_new", copy_started)
+    with conn.cursor() as cur:
+        cur.execute("RENAME TABLE okx_kline TO okx_kline_old, okx_kline_new TO okx_kline")
+    conn.commit()
+    _copy_kline_delta(conn, "okx_kline_old", "okx_kline", delta_started)
+
+    if not _is_tidb(conn):
+        # Triggers followed the old table; created_at/updated_at are written explicitly now.
+        with conn.cursor() as cur:
+            cur.execute("DROP TRIGGER IF EXISTS `okx_kline_bi_shanghai_ts`")
+            cur.execute("DROP TRIGGER IF EXISTS `okx_kline_bu_shanghai_ts`")
+        conn.commit()
+    print("[migrate] okx_kline 已切换为聚簇主键布局；确认无误后可执行 DROP TABLE okx_kline_old")
 
-    ensure_kline_triggers(conn, table="okx_kline")
+
+def _create_kline_triggers(conn) -> None:
+    # The clustered layout writes created_at/updated_at explicitly and carries no triggers.
+    if _has_kline_id(conn):
+        ensure_kline_triggers(conn, table="okx_kline")
+
+
+KLINE_SCHEMA_COMPONENT = "okx_kline"
+KLINE_MIGRATIONS: list[Migration] = [
+    (1, "create okx_kline", _create_kline_table),
+    (2, "rename open_time_utc to open_time_shanghai", _rename_open_time_utc),
+    (3, "add okx_kline.confirmed", _add_confirmed_column),
+    (4, "Shanghai timestamp triggers", _create_kline_triggers),
+    (5, "create okx_kline_sync_state", _create_sync_state_table),
+    (6, "create okx_kline_backfill_job", _create_backfill_table),
+    (7, "clustered primary key, LIST partitions by timeframe, no triggers", _migrate_clustered_layout),
+]
+KLINE_SCHEMA_VERSION = KLINE_MIGRATIONS[-1][0]
+# Runtime code works on every layout from this version on. Later steps may copy the whole table,
+# so ensure_schema leaves them to init_mysql_tables.py unless okx_kline is still empty.
+KLINE_REQUIRED_SCHEMA_VERSION = 6
+
+_SCHEMA_READY = False
+_SCHEMA_LOCK = threading.Lock()
+
+
+def migrate(conn) -> list[int]:
+    """Bring the kline tables to KLINE_SCHEMA_VERSION; run at deploy (init_mysql_tables.py)."""
+    global _SCHEMA_READY
+    applied = apply_migrations(conn, KLINE_SCHEMA_COMPONENT, KLINE_MIGRATIONS)
+    _SCHEMA_READY = True
+    return applied
+
+
+def ensure_schema(conn) -> None:
+    """Check the recorded schema version once per process; later calls cost nothing.
+
+    A database that was never migrated is migrated on the spot, so running
+    init_mysql_tables.py first is recommended but not required. Steps past
+    KLINE_REQUIRED_SCHEMA_VERSION (full table copies) only run here while
+    okx_kline is empty.
+    """
+    global _SCHEMA_READY
+    if _SCHEMA_READY:
+        return
+    with _SCHEMA_LOCK:
+        if _SCHEMA_READY:
+            return
+        version = current_version(conn, KLINE_SCHEMA_COMPONENT)
+        if version < KLINE_REQUIRED_SCHEMA_VERSION:
+            required = [m for m in KLINE_MIGRATIONS if m[0] <= KLINE_REQUIRED_SCHEMA_VERSION]
+            version = max([version, *apply_migrations(conn, KLINE_SCHEMA_COMPONENT, required)])
+        if version < KLINE_SCHEMA_VERSION:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1 FROM okx_kline LIMIT 1")
+                empty = cur.fetchone() is None
+            if empty:
+                apply_migrations(conn, KLINE_SCHEMA_COMPONENT, KLINE_MIGRATIONS)
+            else:
+                print("[warn] okx_kline 有待执行的表结构迁移，请运行 python init_mysql_tables.py")
+        _SCHEMA_READY = True
 
 
 def _ccxt_symbol_to_inst_id(symbol: str) -> str:
@@ -267,45 +514,446 @@ def _get_proxies() -> dict:
     return {}
 
 
-def _request_okx(url: str, params: dict, proxies: dict) -> list:
+class _CountingHTTPAdapter(requests.adapters.HTTPAdapter):
+    """HTTPAdapter whose connection pools report each new connection.
+
+    Both the direct pool manager and every proxy manager get pool subclasses
+    that call `on_new_connection` from `_new_conn`, so the count survives
+    LRU eviction of pools and includes proxied requests.
+    """
+
+    def __init__(self, on_new_connection: Callable[[], None], **kwargs) -> None:
+        self._on_new_connection = on_new_connection
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs) -> None:
+        super().init_poolmanager(*args, **kwargs)
+        self._instrument(self.poolmanager)
+
+    def proxy_manager_for(self, proxy, **proxy_kwargs):
+        fresh = proxy not in self.proxy_manager
+        manager = super().proxy_manager_for(proxy, **proxy_kwargs)
+        if fresh:
+            self._instrument(manager)
+        return manager
+
+    def _instrument(self, manager) -> None:
+        hook = self._on_new_connection
+
+        def counting(pool_cls):
+            def _new_conn(pool):
+                hook()
+                return pool_cls._new_conn(pool)
+
+            return type(pool_cls.__name__, (pool_cls,), {"_new_conn": _new_conn})
+
+        # The default mapping is shared module state in urllib3; replace it rather than mutate it.
+        manager.pool_classes_by_scheme = {
+            scheme: counting(pool_cls) for scheme, pool_cls in manager.pool_classes_by_scheme.items()
+        }
+
+
+class OkxHttpClient:
+    """Process-wide keep-alive HTTP client for OKX REST calls.
+
+    One requests.Session with a bounded urllib3 pool per host (pool_block caps
+    concurrent connections per host), gzip enabled and no adapter-level
+    retries (_request_okx owns retry policy). Counters show how many requests
+    reused a pooled connection versus paying a new TCP/TLS handshake.
+    """
+
+    def __init__(self, pool_connections: int = 4, pool_maxsize: int = 16, timeout: float = 20.0) -> None:
+        self.timeout = float(timeout)
+        self._session = requests.Session()
+        self._lock = threading.Lock()
+        self._connections = 0
+        adapter = _CountingHTTPAdapter(
+            self._count_connection,
+            pool_connections=int(pool_connections),
+            pool_maxsize=int(pool_maxsize),
+            pool_block=True,
+            max_retries=0,
+        )
+        self._adapter = adapter
+        self._session.mount("https://", adapter)
+        self._session.mount("http://", adapter)
+        self._session.headers.update({"Accept": "application/json", "Accept-Encoding": "gzip, deflate"})
+        self._requests = 0
+        self._errors = 0
+        self._latency_total = 0.0
+        self._latency_max = 0.0
+
+    def get(self, url: str, params: Optional[dict] = None, proxies: Optional[dict] = None):
+        started = pytime.perf_counter()
+        try:
+            return self._session.get(url, params=params, timeout=self.timeout, proxies=proxies or None)
+        except requests.RequestException:
+            with self._lock:
+                self._errors += 1
+            raise
+        finally:
+            elapsed = pytime.perf_counter() - started
+            with self._lock:
+                self._requests += 1
+                self._latency_total += elapsed
+                self._latency_max = max(self._latency_max, elapsed)
+
+    def _count_connection(self) -> None:
+        with self._lock:
+            self._connections += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            count = self._requests
+            errors = self._errors
+            total = self._latency_total
+            worst = self._latency_max
+            new_conns = self._connections
+        return {
+            "requests": count,
+            "errors": errors,
+            "new_connections": new_conns,
+            "reused_connections": max(0, count - new_conns),
+            "avg_latency_ms": (total / count * 1000.0) if count else 0.0,
+            "max_latency_ms": worst * 1000.0,
+        }
+
+
+_HTTP_CLIENT: Optional[OkxHttpClient] = None
+_HTTP_CLIENT_LOCK = threading.Lock()
+
+
+def get_http_client() -> OkxHttpClient:
+    global _HTTP_CLIENT
+    if _HTTP_CLIENT is None:
+        with _HTTP_CLIENT_LOCK:
+            if _HTTP_CLIENT is None:
+                _HTTP_CLIENT = OkxHttpClient(
+                    pool_connections=int(os.getenv("OKX_HTTP_POOL_HOSTS", "4")),
+                    pool_maxsize=int(os.getenv("OKX_HTTP_POOL_MAXSIZE", "16")),
+                    timeout=float(os.getenv("OKX_HTTP_TIMEOUT", "20")),
+                )
+    return _HTTP_CLIENT
+
+
+def get_http_stats() -> dict:
+    return get_http_client().stats()
+
+
+class TokenBucket:
+    """Thread-safe token bucket with AIMD rate adaptation.
+
+    `throttled()` halves the refill rate and pauses every caller for the
+    backoff period; each successful request closes a fixed fraction of the
+    gap to the configured ceiling, so recovery is quick after a deep cut and
+    gentle near the limit. Any window of `w` seconds admits at most
+    `capacity + w * rate_per_sec` requests.
+    """
+
+    def __init__(self, rate_per_sec: float, capacity: float, min_rate: float = 0.5) -> None:
+        self.max_rate = max(float(rate_per_sec), 0.01)
+        self.min_rate = min(float(min_rate), self.max_rate)
+        self.rate = self.max_rate
+        self.capacity = max(float(capacity), 1.0)
+        self._tokens = self.capacity
+        self._updated = pytime.monotonic()
+        self._blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        while True:
+            with self._lock:
+                now = pytime.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if now >= self._blocked_until and self._tokens >= 1.0:
+                    self._tokens -= 1.0
+                    return
+                wait = max(self._blocked_until - now, (1.0 - self._tokens) / self.rate)
+            pytime.sleep(min(max(wait, 0.001), 5.0))
+
+    def succeeded(self) -> None:
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + (self.max_rate - self.rate) * 0.05)
+
+    def throttled(self, backoff_seconds: float) -> None:
+        with self._lock:
+            self.rate = max(self.min_rate, self.rate / 2.0)
+            self._tokens = 0.0
+            self._blocked_until = max(self._blocked_until, pytime.monotonic() + backoff_seconds)
+
+
+# Upper bounds (seconds) shared by the request and upsert latency histograms.
+LATENCY_BUCKETS = (0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class LatencyHistogram:
+    def __init__(self, buckets: tuple = LATENCY_BUCKETS) -> None:
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds: float) -> None:
+        index = next((i for i, bound in enumerate(self.buckets) if seconds <= bound), len(self.buckets))
+        self.counts[index] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def snapshot(self) -> dict:
+        labels = [f"le_{int(b * 1000)}ms" for b in self.buckets] + ["inf"]
+        return {
+            "count": self.count,
+            "avg_ms": (self.total / self.count * 1000.0) if self.count else 0.0,
+            "max_ms": self.max * 1000.0,
+            "buckets": dict(zip(labels, self.counts)),
+        }
+
+    def prometheus(self, name: str) -> list[str]:
+        lines = [f"# TYPE {name} histogram"]
+        cumulative = 0
+        for bound, n in zip(self.buckets, self.counts):
+            cumulative += n
+            lines.append(f'{name}_bucket{{le="{bound}"}} {cumulative}')
+        lines.append(f'{name}_bucket{{le="+Inf"}} {self.count}')
+        lines.append(f"{name}_sum {self.total:.6f}")
+        lines.append(f"{name}_count {self.count}")
+        return lines
+
+
+_SYNC_COUNTERS = (
+    "pages",
+    "requests",
+    "request_errors",
+    "retries",
+    "throttled",
+    "backoff_seconds",
+    "limiter_wait_seconds",
+    "rows_parsed",
+    "parse_seconds",
+    "upsert_rows",
+)
+
+
+class SyncMetrics:
+    """Thread-safe throughput counters for one sync job.
+
+    Every fetch worker and the upsert loop report here; with a `parent`
+    (the process-wide SYNC_METRICS) each observation is also added to the
+    totals served on /metrics.
+    """
+
+    def __init__(self, parent: Optional["SyncMetrics"] = None) -> None:
+        self.parent = parent
+        self.started = pytime.perf_counter()
+        self.jobs = 0
+        self.counters = dict.fromkeys(_SYNC_COUNTERS, 0)
+        self.request_latency = LatencyHistogram()
+        self.upsert_latency = LatencyHistogram()
+        self._lock = threading.Lock()
+
+    def add(self, **values) -> None:
+        with self._lock:
+            for key, value in values.items():
+                self.counters[key] += value
+        if self.parent is not None:
+            self.parent.add(**values)
+
+    def observe_request(self, seconds: float) -> None:
+        with self._lock:
+            self.request_latency.observe(seconds)
+            self.counters["requests"] += 1
+        if self.parent is not None:
+            self.parent.observe_request(seconds)
+
+    def observe_upsert(self, rows: int, seconds: float) -> None:
+        with self._lock:
+            self.upsert_latency.observe(seconds)
+            self.counters["upsert_rows"] += rows
+        if self.parent is not None:
+            self.parent.observe_upsert(rows, seconds)
+
+    def finish(self) -> dict:
+        if self.parent is not None:
+            with self.parent._lock:
+                self.parent.jobs += 1
+        return self.snapshot()
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            counters = dict(self.counters)
+            request_latency = self.request_latency.snapshot()
+            upsert_latency = self.upsert_latency.snapshot()
+        wall = pytime.perf_counter() - self.started
+        return {
+            **counters,
+            "wall_seconds": wall,
+            "rows_per_sec": counters["rows_parsed"] / wall if wall > 0 else 0.0,
+            "parse_rows_per_sec": (counters["rows_parsed"] / counters["parse_seconds"]) if counters["parse_seconds"] else 0.0,
+            "upsert_seconds": upsert_latency["avg_ms"] * upsert_latency["count"] / 1000.0,
+            "request_latency": request_latency,
+            "upsert_latency": upsert_latency,
+        }
+
+    def prometheus(self, prefix: str = "okx_kline_sync") -> str:
+        with self._lock:
+            lines = [f"# TYPE {prefix}_jobs_total counter", f"{prefix}_jobs_total {self.jobs}"]
+            for key, value in self.counters.items():
+                lines.append(f"# TYPE {prefix}_{key}_total counter")
+                lines.append(f"{prefix}_{key}_total {value:.6f}" if isinstance(value, float) else f"{prefix}_{key}_total {value}")
+            lines.extend(self.request_latency.prometheus(f"{prefix}_request_duration_seconds"))
+            lines.extend(self.upsert_latency.prometheus(f"{prefix}_upsert_duration_seconds"))
+        return "\n".join(lines) + "\n"
+
+
+# Process-wide totals; per-job SyncMetrics forward into it.
+SYNC_METRICS = SyncMetrics()
+
+
+def render_prometheus_metrics() -> str:
+    """Sync totals plus HTTP pool gauges in the Prometheus text exposition format."""
+    lines = [SYNC_METRICS.prometheus().rstrip("\n")]
+    for key, value in get_http_stats().items():
+        lines.append(f"# TYPE okx_http_{key} gauge")
+        lines.append(f"okx_http_{key} {value}")
+    return "\n".join(lines) + "\n"
+
+
+class OkxRateLimited(RuntimeError):
+    def __init__(self, message: str, retry_after: Optional[float] = None) -> None:
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+# OKX allows 20 requests / 2s per IP on market/history-candles; shared by every sync in this process.
+# Keep burst + 2 * rate <= 20 so no 2s window can exceed the quota.
+HISTORY_CANDLES_LIMITER = TokenBucket(
+    rate_per_sec=float(os.getenv("OKX_HISTORY_RATE_PER_SEC", "9")),
+    capacity=float(os.getenv("OKX_HISTORY_BURST", "2")),
+)
+OKX_RATE_LIMIT_CODES = {"50011", "50061"}
+OKX_PAGE_LIMIT = 100
+OKX_HISTORY_CANDLES_PATH = "/api/v5/market/history-candles"
+
+
+def okx_api_url(path: str) -> str:
+    """Absolute REST URL; OKX_API_BASE points syncs at a local stand-in (see kline_benchmark.py)."""
+    return os.getenv("OKX_API_BASE", "https://www.okx.com").rstrip("/") + path
+
+
+def _retry_after_seconds(resp) -> Optional[float]:
+    try:
+        return float(resp.headers.get("Retry-After"))
+    except (TypeError, ValueError):
+        return None
+
+
+def _request_okx(
+    url: str,
+    params: dict,
+    proxies: dict,
+    limiter: Optional[TokenBucket] = None,
+    metrics: Optional[SyncMetrics] = None,
+) -> list:
     retries = 3
-    for attempt in range(1, retries + 1):
+    throttle_retries = 8
+    attempt = 0
+    throttled = 0
+    while True:
+        if limiter is not None:
+            waited = pytime.perf_counter()
+            limiter.acquire()
+            if metrics is not None:
+                metrics.add(limiter_wait_seconds=pytime.perf_counter() - waited)
+        started = pytime.perf_counter()
         try:
-            resp = requests.get(url, params=params, timeout=20, proxies=proxies or None)
+            try:
+                resp = get_http_client().get(url, params=params, proxies=proxies)
+            finally:
+                # Latency of the HTTP exchange only; backoff sleeps below are counted separately.
+                if metrics is not None:
+                    metrics.observe_request(pytime.perf_counter() - started)
+            if resp.status_code == 429:
+                raise OkxRateLimited("OKX HTTP 429", _retry_after_seconds(resp))
             resp.raise_for_status()
             body = resp.json()
-            if body.get("code") != "0":
-                raise RuntimeError(f"OKX API error code={body.get('code')}: {body.get('msg', '')}")
+            code = str(body.get("code"))
+            if code in OKX_RATE_LIMIT_CODES:
+                raise OkxRateLimited(f"OKX API error code={code}: {body.get('msg', '')}")
+            if code != "0":
+                raise RuntimeError(f"OKX API error code={code}: {body.get('msg', '')}")
+            if limiter is not None:
+                limiter.succeeded()
             return body.get("data", [])
+        except OkxRateLimited as exc:
+            throttled += 1
+            if metrics is not None:
+                metrics.add(request_errors=1, throttled=1)
+            if throttled > throttle_retries:
+                raise
+            backoff = exc.retry_after or min(0.5 * (2 ** (throttled - 1)), 16.0)
+            backoff *= 1.0 + random.random() * 0.25
+            if metrics is not None:
+                metrics.add(retries=1, backoff_seconds=backoff)
+            if limiter is not None:
+                limiter.throttled(backoff)
+            else:
+                pytime.sleep(backoff)
         except (requests.RequestException, RuntimeError):
-            if attempt == retries:
+            attempt += 1
+            if metrics is not None:
+                metrics.add(request_errors=1)
+            if attempt >= retries:
                 raise
-            pytime.sleep(1.5)
-    return []
-
-
-def fetch_okx_ohlcv_range(symbol: str, timeframe: str, start_ms: int, end_ms: int) -> list[list[float]]:
-    if start_ms >= end_ms:
-        return []
-
-    url = "https://www.okx.com/api/v5/market/history-candles"
-    inst_id = _ccxt_symbol_to_inst_id(symbol)
-    proxies = _get_proxies()
-
+            backoff = min(0.5 * (2 ** attempt), 8.0)
+            if metrics is not None:
+                metrics.add(retries=1, backoff_seconds=backoff)
+            pytime.sleep(backoff)
+
+
+def parse_okx_candle(row: list) -> list[float]:
+    """OKX candle array (REST or WebSocket) -> [ts, open, high, low, close, volume, confirmed]."""
+    return [
+        int(row[0]),
+        float(row[1]),
+        float(row[2]),
+        float(row[3]),
+        float(row[4]),
+        float(row[5]),
+        # OKX confirm flag (index 8): "0" while the candle is still forming.
+        int(row[8]) if len(row) > 8 and str(row[8]) != "" else 1,
+    ]
+
+
+def _fetch_slice(
+    url: str,
+    inst_id: str,
+    timeframe: str,
+    start_ms: int,
+    end_ms: int,
+    proxies: dict,
+    limiter: Optional[TokenBucket],
+    max_pages: int = 2000,
+    metrics: Optional[SyncMetrics] = None,
+) -> dict[int, list[float]]:
+    """Page backward from end_ms until start_ms; returns rows keyed by open time."""
     cursor = end_ms
     rows_by_ts: dict[int, list[float]] = {}
 
-    for _ in range(2000):
+    for _ in range(max_pages):
         params = {
             "instId": inst_id,
             "bar": timeframe,
             "after": str(cursor),
-            "limit": "100",
+            "limit": str(OKX_PAGE_LIMIT),
         }
-        candles = _request_okx(url, params, proxies)
+        candles = _request_okx(url, params, proxies, limiter, metrics)
         if not candles:
             break
 
+        parse_started = pytime.perf_counter()
         oldest_ts = cursor
         reached_lower_bound = False
         for row in candles:
@@ -316,79 +964,516 @@ def fetch_okx_ohlcv_range(symbol: str, timeframe: str, start_ms: int, end_ms: in
                 continue
             if ts_ms >= end_ms:
                 continue
-            rows_by_ts[ts_ms] = [
-                ts_ms,
-                float(row[1]),
-                float(row[2]),
-                float(row[3]),
-                float(row[4]),
-                float(row[5]),
-            ]
+            rows_by_ts[ts_ms] = parse_okx_candle(row)
+        if metrics is not None:
+            metrics.add(pages=1, rows_parsed=len(candles), parse_seconds=pytime.perf_counter() - parse_started)
 
         if oldest_ts >= cursor:
             break
         cursor = oldest_ts
 
-        if reached_lower_bound:
+        if reached_lower_bound or cursor <= start_ms:
             break
+    else:
+        print(f"[warn] {inst_id} {timeframe}: page cap {max_pages} reached before {start_ms}, range truncated")
+
+    return rows_by_ts
+
+
+def plan_slices(timeframe: str, start_ms: int, end_ms: int, pages_per_slice: int = 1) -> list[tuple[int, int]]:
+    """Split [start_ms, end_ms) into independent, page-aligned time slices."""
+    if start_ms >= end_ms:
+        return []
+    if timeframe == "1M":
+        # Calendar months have no fixed length; a handful of pages covers decades.
+        return [(start_ms, end_ms)]
+    span = TIMEFRAME_MS[timeframe] * OKX_PAGE_LIMIT * max(1, int(pages_per_slice))
+    return [(lo, min(lo + span, end_ms)) for lo in range(start_ms, end_ms, span)]
+
+
+_WORKER_DONE = object()
+
+
+def iter_okx_ohlcv_pages(
+    symbol: str,
+    timeframe: str,
+    start_ms: int,
+    end_ms: int,
+    max_workers: Optional[int] = None,
+    max_pending: Optional[int] = None,
+    metrics: Optional[SyncMetrics] = None,
+) -> Iterator[list[list[float]]]:
+    """Yield slices of candles (each sorted, slices in completion order) as they arrive.
+
+    Worker threads fetch slices concurrently and hand them over through a
+    bounded queue, so a slow consumer throttles downloading instead of
+    letting fetched pages pile up in memory.
+    """
+    slices = plan_slices(timeframe, start_ms, end_ms, int(os.getenv("OKX_PAGES_PER_SLICE", "1")))
+    if not slices:
+        return
+
+    url = okx_api_url(OKX_HISTORY_CANDLES_PATH)
+    inst_id = _ccxt_symbol_to_inst_id(symbol)
+    proxies = _get_proxies()
+    workers = min(len(slices), max(1, int(max_workers or os.getenv("OKX_FETCH_WORKERS", "8"))))
+    pending: queue.Queue = queue.Queue(maxsize=max(1, int(max_pending or workers * 2)))
+    stop = threading.Event()
+    slice_iter = iter(slices)
+    slice_lock = threading.Lock()
+
+    def put(item) -> bool:
+        while not stop.is_set():
+            try:
+                pending.put(item, timeout=0.2)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def work() -> None:
+        try:
+            while not stop.is_set():
+                with slice_lock:
+                    bounds = next(slice_iter, None)
+                if bounds is None:
+                    break
+                rows = _fetch_slice(
+                    url, inst_id, timeframe, bounds[0], bounds[1], proxies, HISTORY_CANDLES_LIMITER, metrics=metrics
+                )
+                if rows and not put([rows[k] for k in sorted(rows)]):
+                    return
+        except Exception as exc:
+            put(exc)
+        finally:
+            put(_WORKER_DONE)
+
+    threads = [threading.Thread(target=work, name=f"okx-fetch-{i}", daemon=True) for i in range(workers)]
+    for t in threads:
+        t.start()
+    finished = 0
+    try:
+        while finished < workers:
+            item = pending.get()
+            if item is _WORKER_DONE:
+                finished += 1
+            elif isinstance(item, Exception):
+                raise item
+            else:
+                yield item
+    finally:
+        stop.set()
+
+
+def fetch_okx_ohlcv_range(
+    symbol: str,
+    timeframe: str,
+    start_ms: int,
+    end_ms: int,
+    max_workers: Optional[int] = None,
+    metrics: Optional[SyncMetrics] = None,
+) -> list[list[float]]:
+    if start_ms >= end_ms:
+        return []
+
+    rows_by_ts: dict[int, list[float]] = {}
+    for page in iter_okx_ohlcv_pages(symbol, timeframe, start_ms, end_ms, max_workers=max_workers, metrics=metrics):
+        for row in page:
+            rows_by_ts[row[0]] = row
 
     return [rows_by_ts[k] for k in sorted(rows_by_ts)]
 
 
-def upsert_rows(conn, symbol: str, timeframe: str, rows: list[list[float]]) -> int:
+def probe_older_candle(symbol: str, timeframe: str, before_ms: int) -> Optional[int]:
+    """Open time of the newest candle strictly before `before_ms`, or None if OKX has none."""
+    params = {
+        "instId": _ccxt_symbol_to_inst_id(symbol),
+        "bar": timeframe,
+        "after": str(int(before_ms)),
+        "limit": "1",
+    }
+    candles = _request_okx(okx_api_url(OKX_HISTORY_CANDLES_PATH), params, _get_proxies(), HISTORY_CANDLES_LIMITER)
+    return int(candles[0][0]) if candles else None
+
+
+KLINE_DATA_COLUMNS = (
+    "symbol",
+    "timeframe",
+    "open_time_ms",
+    "open_time_shanghai",
+    "open_price",
+    "high_price",
+    "low_price",
+    "close_price",
+    "volume",
+    "confirmed",
+)
+# created_at/updated_at are stamped server-side with _SHANGHAI_NOW_SQL.
+KLINE_WRITE_COLUMNS = (*KLINE_DATA_COLUMNS, "created_at", "updated_at")
+WRITE_METHODS = {"insert", "load_data"}
+# Asia/Shanghai has had no DST since 1991, so a fixed UTC+8 offset is exact for exchange data.
+_SHANGHAI_OFFSET_MS = 8 * 60 * 60 * 1000
+
+
+def _kline_columns(rows: list[list[float]]) -> tuple:
+    """Columnar view of candle rows with the Shanghai open time computed in one numpy pass."""
+    data = np.asarray([row[:6] for row in rows], dtype=np.float64)
+    ts = data[:, 0].astype(np.int64)
+    confirmed = [int(row[6]) if len(row) > 6 else 1 for row in rows]
+    local = (ts + _SHANGHAI_OFFSET_MS).astype("datetime64[ms]")
+    shanghai = np.char.replace(np.datetime_as_string(local, unit="s"), "T", " ").tolist()
+    return ts.tolist(), data[:, 1:6].tolist(), confirmed, shanghai
+
+
+def _sql_float(value: float) -> str:
+    return repr(value) if math.isfinite(value) else "NULL"
+
+
+def _tsv_float(value: float) -> str:
+    # LOAD DATA reads \\N as NULL.
+    return repr(value) if math.isfinite(value) else "\\N"
+
+
+def _bulk_insert_batch(cur, prefix: str, suffix: str, values: list[str]) -> int:
+    # Values are pre-rendered literals, so execute() must not apply %-formatting.
+    return int(cur.execute(prefix + ",".join(values) + suffix) or 0)
+
+
+def _load_data_batch(cur, lines: list[str], on_duplicate: str) -> int:
+    with tempfile.NamedTemporaryFile("w", suffix=".tsv", delete=False, encoding="utf-8") as fh:
+        fh.writelines(lines)
+        path = fh.name
+    try:
+        mode = "IGNORE" if on_duplicate == "ignore" else "REPLACE"
+        return int(
+            cur.execute(
+                f"LOAD DATA LOCAL INFILE %s {mode} INTO TABLE okx_kline "
+                "FIELDS TERMINATED BY '\\t' LINES TERMINATED BY '\\n' "
+                f"({', '.join(KLINE_DATA_COLUMNS)}) "
+                f"SET created_at = {_SHANGHAI_NOW_SQL}, updated_at = {_SHANGHAI_NOW_SQL}",
+                (path,),
+            )
+            or 0
+        )
+    finally:
+        os.unlink(path)
+
+
+def bulk_write_rows(
+    conn,
+    symbol: str,
+    timeframe: str,
+    rows: list[list[float]],
+    batch_size: Optional[int] = None,
+    method: str = "insert",
+    on_duplicate: str = "update",
+    commit: bool = True,
+) -> dict:
+    """Write candle rows in large batches and report throughput.
+
+    method="insert" sends multi-row INSERT statements of `batch_size` rows
+    (KLINE_BULK_BATCH, default 1000). on_duplicate is "update" (upsert) or
+    "ignore". method="load_data" streams each batch through
+    LOAD DATA LOCAL INFILE, which needs a connection opened with
+    mysql_connect(cfg, local_infile=True). Duplicates are then replaced, or
+    skipped with on_duplicate="ignore". With commit=True every batch is
+    committed; otherwise the caller owns the transaction.
+    """
+    if method not in WRITE_METHODS:
+        raise ValueError(f"unknown write method: {method}")
     if not rows:
-        return 0
+        return {"method": method, "rows": 0, "batches": 0, "affected": 0, "seconds": 0.0, "rows_per_sec": 0.0}
+
+    default_batch = "50000" if method == "load_data" else "1000"
+    size = max(1, int(batch_size or os.getenv("KLINE_BULK_BATCH", default_batch)))
+    started = pytime.perf_counter()
+    ts, prices, confirmed, shanghai = _kline_columns(rows)
+
+    if method == "insert":
+        sym_lit = conn.escape(symbol)
+        tf_lit = conn.escape(timeframe)
+        verb = "INSERT IGNORE" if on_duplicate == "ignore" else "INSERT"
+        prefix = f"{verb} INTO okx_kline ({', '.join(KLINE_WRITE_COLUMNS)}) VALUES "
+        suffix = ""
+        if on_duplicate != "ignore":
+            suffix = (
+                " ON DUPLICATE KEY UPDATE open_price = VALUES(open_price), high_price = VALUES(high_price), "
+                "low_price = VALUES(low_price), close_price = VALUES(close_price), volume = VALUES(volume), "
+                "confirmed = VALUES(confirmed), updated_at = VALUES(updated_at)"
+            )
+        items = [
+            f"({sym_lit},{tf_lit},{t},'{dt}',{_sql_float(o)},{_sql_float(h)},{_sql_float(l)},"
+            f"{_sql_float(c)},{_sql_float(v)},{cf},{_SHANGHAI_NOW_SQL},{_SHANGHAI_NOW_SQL})"
+            for t, dt, (o, h, l, c, v), cf in zip(ts, shanghai, prices, confirmed)
+        ]
+    else:
+        items = [
+            "\t".join(
+                [symbol, timeframe, str(t), dt, *(_tsv_float(x) for x in (o, h, l, c, v)), str(cf)]
+            )
+            + "\n"
+            for t, dt, (o, h, l, c, v), cf in zip(ts, shanghai, prices, confirmed)
+        ]
 
-    sql = """
-    INSERT INTO okx_kline (
-        symbol, timeframe, open_time_ms, open_time_shanghai,
-        open_price, high_price, low_price, close_price, volume,
-        created_at, updated_at
-    ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-    ON DUPLICATE KEY UPDATE
-        open_price = VALUES(open_price),
-        high_price = VALUES(high_price),
-        low_price = VALUES(low_price),
-        close_price = VALUES(close_price),
-        volume = VALUES(volume),
-        updated_at = VALUES(updated_at)
+    affected = 0
+    batches = 0
+    with conn.cursor() as cur:
+        for lo in range(0, len(items), size):
+            chunk = items[lo : lo + size]
+            if method == "insert":
+                affected += _bulk_insert_batch(cur, prefix, suffix, chunk)
+            else:
+                affected += _load_data_batch(cur, chunk, on_duplicate)
+            batches += 1
+            if commit:
+                conn.commit()
+
+    seconds = pytime.perf_counter() - started
+    return {
+        "method": method,
+        "rows": len(rows),
+        "batches": batches,
+        "affected": affected,
+        "seconds": seconds,
+        "rows_per_sec": (len(rows) / seconds) if seconds > 0 else 0.0,
+    }
+
+
+UPSERT_COUNT_KEYS = ("inserted", "updated", "unchanged", "affected")
+
+
+def _same_value(stored, incoming: float) -> bool:
+    if stored is None:
+        return not math.isfinite(incoming)
+    return float(stored) == incoming
+
+
+def _existing_candles(conn, symbol: str, timeframe: str, ts_list: list[int]) -> dict[int, tuple]:
+    with conn.cursor() as cur:
+        cur.execute(
+            "SELECT open_time_ms, open_price, high_price, low_price, close_price, volume, confirmed "
+            "FROM okx_kline WHERE symbol=%s AND timeframe=%s AND open_time_ms IN %s",
+            (symbol, timeframe, tuple(ts_list)),
+        )
+        found = cur.fetchall() or []
+    return {
+        int(r["open_time_ms"]): (
+            r["open_price"],
+            r["high_price"],
+            r["low_price"],
+            r["close_price"],
+            r["volume"],
+            int(r["confirmed"]),
+        )
+        for r in found
+    }
+
+
+def upsert_rows(
+    conn,
+    symbol: str,
+    timeframe: str,
+    rows: list[list[float]],
+    commit: bool = True,
+    chunk_size: Optional[int] = None,
+) -> dict:
+    """Write only candles that are new or whose OHLCV/confirm flag changed.
+
+    Each chunk of `chunk_size` rows (KLINE_BULK_BATCH, default 1000) is checked
+    against the stored values with one indexed read, so re-syncing an already
+    stored window issues reads but no writes and leaves updated_at untouched.
+    Returns counts of inserted, updated and unchanged candles plus the
+    driver-reported affected rows.
     """
+    counts = dict.fromkeys(UPSERT_COUNT_KEYS, 0)
+    if not rows:
+        return counts
+
+    latest: dict[int, list[float]] = {}
+    for row in rows:
+        latest[int(row[0])] = row
+    ordered = [latest[ts] for ts in sorted(latest)]
+    size = max(1, int(chunk_size or os.getenv("KLINE_BULK_BATCH", "1000")))
+
+    for lo in range(0, len(ordered), size):
+        chunk = ordered[lo : lo + size]
+        stored = _existing_candles(conn, symbol, timeframe, [int(row[0]) for row in chunk])
+        pending = []
+        for row in chunk:
+            old = stored.get(int(row[0]))
+            if old is None:
+                counts["inserted"] += 1
+                pending.append(row)
+                continue
+            confirmed = int(row[6]) if len(row) > 6 else 1
+            if confirmed == old[5] and all(_same_value(s, float(v)) for s, v in zip(old[:5], row[1:6])):
+                counts["unchanged"] += 1
+            else:
+                counts["updated"] += 1
+                pending.append(row)
+        if pending:
+            written = bulk_write_rows(conn, symbol, timeframe, pending, batch_size=size, commit=False)
+            counts["affected"] += written["affected"]
+        if commit:
+            conn.commit()
+    return counts
 
-    now_shanghai = datetime.now(tz=STORAGE_TZ).replace(tzinfo=None)
-    payload = []
-    for ts_ms, o, h, l, c, v in rows:
-        # Store Shanghai local time (UTC+8) for easier inspection/querying.
-        open_time_shanghai = datetime.fromtimestamp(int(ts_ms) / 1000, tz=STORAGE_TZ).replace(tzinfo=None)
-        payload.append(
-            (
-                symbol,
-                timeframe,
-                int(ts_ms),
-                open_time_shanghai,
-                float(o),
-                float(h),
-                float(l),
-                float(c),
-                float(v),
-                now_shanghai,
-                now_shanghai,
-            )
+
+def get_sync_state(conn, symbol: str, timeframe: str) -> Optional[tuple[int, int]]:
+    with conn.cursor() as cur:
+        cur.execute(
+            "SELECT first_confirmed_ms, last_confirmed_ms FROM okx_kline_sync_state WHERE symbol=%s AND timeframe=%s",
+            (symbol, timeframe),
         )
+        row = cur.fetchone()
+    if not row:
+        return None
+    return int(row["first_confirmed_ms"]), int(row["last_confirmed_ms"])
 
+
+def save_sync_state(conn, symbol: str, timeframe: str, first_ms: int, last_ms: int) -> None:
+    sql = """
+    INSERT INTO okx_kline_sync_state (symbol, timeframe, first_confirmed_ms, last_confirmed_ms)
+    VALUES (%s, %s, %s, %s)
+    ON DUPLICATE KEY UPDATE
+        first_confirmed_ms = VALUES(first_confirmed_ms),
+        last_confirmed_ms = VALUES(last_confirmed_ms)
+    """
     with conn.cursor() as cur:
-        affected = cur.executemany(sql, payload)
+        cur.execute(sql, (symbol, timeframe, int(first_ms), int(last_ms)))
     conn.commit()
-    return int(affected)
 
 
-def sync_day_kline(symbol: str, timeframe: str, day_text: str, tz_name: str) -> dict:
+def plan_missing_windows(state: Optional[tuple[int, int]], start_ms: int, end_ms: int) -> list[tuple[int, int]]:
+    """Parts of [start_ms, end_ms) outside the confirmed range [first, last]."""
+    if start_ms >= end_ms:
+        return []
+    if state is None:
+        return [(start_ms, end_ms)]
+    first_ms, last_ms = state
+    windows = []
+    if start_ms < first_ms:
+        windows.append((start_ms, min(end_ms, first_ms)))
+    if end_ms > last_ms + 1:
+        windows.append((max(start_ms, last_ms + 1), end_ms))
+    return windows
+
+
+def _confirmed_runs(
+    timeframe: str, confirmed_ms: Iterable[int], runs: Iterable[tuple[int, int]] = ()
+) -> list[tuple[int, int]]:
+    """Contiguous runs (first, last) of confirmed open times, coalesced with existing `runs`."""
+    spans = sorted([*runs, *((ts, ts) for ts in {int(ts) for ts in confirmed_ms})])
+    merged: list[tuple[int, int]] = []
+    for first_ms, last_ms in spans:
+        if merged and first_ms <= bar_close_ms(timeframe, merged[-1][1]):
+            merged[-1] = (merged[-1][0], max(merged[-1][1], last_ms))
+        else:
+            merged.append((first_ms, last_ms))
+    return merged
+
+
+def _merge_sync_state(
+    state: Optional[tuple[int, int]], timeframe: str, runs: Iterable[tuple[int, int]]
+) -> Optional[tuple[int, int]]:
+    """Extend the confirmed range with the fetched runs that touch it.
+
+    Runs come from the rows actually returned, so a window that came back
+    short or with a hole never marks unfetched bars as stored. Without a
+    previous state, the newest run becomes the range.
+    """
+    runs = _confirmed_runs(timeframe, (), runs)
+    if not runs:
+        return state
+    if state is None:
+        return runs[-1]
+    first_ms, last_ms = state
+    for run_first, run_last in runs:
+        if run_first <= bar_close_ms(timeframe, last_ms) and bar_close_ms(timeframe, run_last) >= first_ms:
+            first_ms, last_ms = min(first_ms, run_first), max(last_ms, run_last)
+    return first_ms, last_ms
+
+
+def stream_upsert(
+    conn,
+    symbol: str,
+    timeframe: str,
+    pages: Iterable[list[list[float]]],
+    batch_size: Optional[int] = None,
+    metrics: Optional[SyncMetrics] = None,
+) -> dict:
+    """Consume pages as they arrive and commit every `batch_size` rows.
+
+    Runs on the calling thread while the page producer keeps downloading, so
+    network and database time overlap and memory stays at one batch plus the
+    producer queue.
+    """
+    size = max(1, int(batch_size or os.getenv("KLINE_UPSERT_BATCH", "2000")))
+    buffer: list[list[float]] = []
+    fetched = 0
+    counts = dict.fromkeys(UPSERT_COUNT_KEYS, 0)
+    batches = 0
+    newest: Optional[int] = None
+    runs: list[tuple[int, int]] = []
+
+    def flush(chunk: list[list[float]]) -> None:
+        started = pytime.perf_counter()
+        written = upsert_rows(conn, symbol, timeframe, chunk)
+        if metrics is not None:
+            metrics.observe_upsert(len(chunk), pytime.perf_counter() - started)
+        for key, value in written.items():
+            counts[key] += value
+
+    for page in pages:
+        fetched += len(page)
+        confirmed = [int(row[0]) for row in page if (int(row[6]) if len(row) > 6 else 1) == 1]
+        if confirmed:
+            newest = max(confirmed) if newest is None else max(newest, *confirmed)
+            # Pages can arrive out of order; runs stay few because they coalesce as gaps fill in.
+            runs = _confirmed_runs(timeframe, confirmed, runs)
+        buffer.extend(page)
+        while len(buffer) >= size:
+            flush(buffer[:size])
+            del buffer[:size]
+            batches += 1
+    if buffer:
+        flush(buffer)
+        batches += 1
+    return {"fetched": fetched, **counts, "batches": batches, "newest_confirmed_ms": newest, "confirmed_runs": runs}
+
+
+def _sync_window(conn, symbol: str, timeframe: str, start_ms: int, end_ms: int, force: bool = False) -> dict:
+    metrics = SyncMetrics(parent=SYNC_METRICS)
+    state = get_sync_state(conn, symbol, timeframe)
+    windows = [(start_ms, end_ms)] if force else plan_missing_windows(state, start_ms, end_ms)
+    fetched = 0
+    counts = dict.fromkeys(UPSERT_COUNT_KEYS, 0)
+    for window in windows:
+        pages = iter_okx_ohlcv_pages(symbol, timeframe, window[0], window[1], metrics=metrics)
+        written = stream_upsert(conn, symbol, timeframe, pages, metrics=metrics)
+        for key in UPSERT_COUNT_KEYS:
+            counts[key] += written[key]
+        fetched += written["fetched"]
+        merged = _merge_sync_state(state, timeframe, written["confirmed_runs"])
+        if merged is not None and merged != state:
+            save_sync_state(conn, symbol, timeframe, merged[0], merged[1])
+            state = merged
+    return {
+        "fetched": fetched,
+        **counts,
+        "windows": [list(w) for w in windows],
+        "last_confirmed_ms": state[1] if state else None,
+        "metrics": metrics.finish(),
+    }
+
+
+def sync_day_kline(symbol: str, timeframe: str, day_text: str, tz_name: str, force: bool = False) -> dict:
     start_ms, end_ms = _day_window(day_text, tz_name)
     cfg = get_mysql_config()
     conn = mysql_connect(cfg)
     try:
-        ensure_table(conn)
-        rows = fetch_okx_ohlcv_range(symbol, timeframe, start_ms, end_ms)
-        affected = upsert_rows(conn, symbol, timeframe, rows)
+        ensure_schema(conn)
+        result = _sync_window(conn, symbol, timeframe, start_ms, end_ms, force=force)
     finally:
         conn.close()
 
@@ -396,21 +1481,21 @@ def sync_day_kline(symbol: str, timeframe: str, day_text: str, tz_name: str) ->
         "symbol": symbol,
         "timeframe": timeframe,
         "date": day_text,
-        "fetched": len(rows),
-        "affected": affected,
+        **result,
         "start_ms": start_ms,
         "end_ms": end_ms,
     }
 
 
-def sync_range_kline(symbol: str, timeframe: str, start_text: str, end_text: str, tz_name: str) -> dict:
+def sync_range_kline(
+    symbol: str, timeframe: str, start_text: str, end_text: str, tz_name: str, force: bool = False
+) -> dict:
     start_ms, end_ms = build_range_window(start_text, end_text, timeframe, tz_name)
     cfg = get_mysql_config()
     conn = mysql_connect(cfg)
     try:
-        ensure_table(conn)
-        rows = fetch_okx_ohlcv_range(symbol, timeframe, start_ms, end_ms)
-        affected = upsert_rows(conn, symbol, timeframe, rows)
+        ensure_schema(conn)
+        result = _sync_window(conn, symbol, timeframe, start_ms, end_ms, force=force)
     finally:
         conn.close()
 
@@ -419,8 +1504,220 @@ def sync_range_kline(symbol: str, timeframe: str, start_text: str, end_text: str
         "timeframe": timeframe,
         "start_date": start_text,
         "end_date": end_text,
-        "fetched": len(rows),
-        "affected": affected,
+        **result,
         "start_ms": start_ms,
         "end_ms": end_ms,
     }
+
+
+def bar_close_ms(timeframe: str, open_ms: int) -> int:
+    """Close time of the bar opening at open_ms; 1M bars end at the next Shanghai month start."""
+    if timeframe == "1M":
+        opened = datetime.fromtimestamp(int(open_ms) / 1000, tz=STORAGE_TZ)
+        year, month = (opened.year + 1, 1) if opened.month == 12 else (opened.year, opened.month + 1)
+        return int(datetime(year, month, 1, tzinfo=STORAGE_TZ).timestamp() * 1000)
+    return int(open_ms) + TIMEFRAME_MS[timeframe]
+
+
+def sync_lag(conn, symbols: list[str], timeframes: list[str], now_ms: Optional[int] = None) -> list[dict]:
+    """Per-series freshness from okx_kline_sync_state in one query.
+
+    lag_ms is the time since the newest confirmed candle closed, so a series
+    that is fully current sits between 0 and one bar plus the sync delay.
+    """
+    now_ms = int(pytime.time() * 1000) if now_ms is None else int(now_ms)
+    with conn.cursor() as cur:
+        cur.execute("SELECT symbol, timeframe, first_confirmed_ms, last_confirmed_ms, updated_at FROM okx_kline_sync_state")
+        states = {(r["symbol"], r["timeframe"]): r for r in (cur.fetchall() or [])}
+    report = []
+    for symbol in symbols:
+        for timeframe in timeframes:
+            row = states.get((symbol, timeframe))
+            item = {"symbol": symbol, "timeframe": timeframe, "last_confirmed_ms": None, "lag_ms": None, "lag_bars": None}
+            if row is not None:
+                last_ms = int(row["last_confirmed_ms"])
+                lag_ms = max(0, now_ms - bar_close_ms(timeframe, last_ms))
+                item.update(
+                    {
+                        "first_confirmed_ms": int(row["first_confirmed_ms"]),
+                        "last_confirmed_ms": last_ms,
+                        "lag_ms": lag_ms,
+                        "lag_bars": lag_ms // TIMEFRAME_MS[timeframe],
+                        "state_updated_at": str(row["updated_at"]) if row.get("updated_at") is not None else None,
+                    }
+                )
+            report.append(item)
+    return report
+
+
+def expected_bar_count(timeframe: str, start_ms: int, end_ms: int, now_ms: Optional[int] = None) -> Optional[int]:
+    """Bars whose open falls in [start_ms, min(end_ms, now)); None for calendar (1M) bars."""
+    if timeframe == "1M" or timeframe not in TIMEFRAME_MS:
+        return None
+    tf_ms = TIMEFRAME_MS[timeframe]
+    now_ms = int(pytime.time() * 1000) if now_ms is None else int(now_ms)
+    upper = min(int(end_ms), now_ms)
+    if upper <= start_ms:
+        return 0
+    return (upper - int(start_ms) + tf_ms - 1) // tf_ms
+
+
+def scan_gaps(conn, symbol: str, timeframe: str, start_ms: int, end_ms: int) -> dict:
+    """Find missing candles in a window without pulling the rows.
+
+    Interior holes come from a LAG() window over the (symbol, timeframe,
+    open_time_ms) index; only rows adjacent to a hole are returned. Rows with
+    NULL prices count as missing. Gaps are [from_ms, to_ms) of missing opens.
+    """
+    tf = normalize_timeframe(timeframe)
+    if not tf:
+        raise ValueError("invalid timeframe")
+    if tf == "1M":
+        raise ValueError("gap scan does not support 1M candles")
+    tf_ms = TIMEFRAME_MS[tf]
+    now_ms = int(pytime.time() * 1000)
+    upper = min(int(end_ms), now_ms)
+
+    where = (
+        "symbol=%s AND timeframe=%s AND open_time_ms >= %s AND open_time_ms < %s "
+        "AND open_price IS NOT NULL AND close_price IS NOT NULL"
+    )
+    params = (symbol, tf, int(start_ms), int(upper))
+    with conn.cursor() as cur:
+        cur.execute(
+            f"SELECT COUNT(*) AS n, MIN(open_time_ms) AS first_ms, MAX(open_time_ms) AS last_ms FROM okx_kline WHERE {where}",
+            params,
+        )
+        summary = cur.fetchone() or {}
+        cur.execute(
+            f"""
+            SELECT prev_ms, open_time_ms FROM (
+                SELECT open_time_ms, LAG(open_time_ms) OVER (ORDER BY open_time_ms) AS prev_ms
+                FROM okx_kline
+                WHERE {where}
+            ) t
+            WHERE prev_ms IS NOT NULL AND open_time_ms - prev_ms > %s
+            ORDER BY open_time_ms
+            """,
+            (*params, tf_ms),
+        )
+        holes = cur.fetchall() or []
+
+    count = int(summary.get("n") or 0)
+    gaps: list[dict] = []
+
+    def add_gap(from_ms: int, to_ms: int) -> None:
+        if to_ms > from_ms:
+            gaps.append({"from_ms": from_ms, "to_ms": to_ms, "missing": (to_ms - from_ms + tf_ms - 1) // tf_ms})
+
+    if count == 0:
+        add_gap(int(start_ms), upper)
+    else:
+        first_ms = int(summary["first_ms"])
+        last_ms = int(summary["last_ms"])
+        if first_ms - int(start_ms) >= tf_ms:
+            add_gap(int(start_ms), first_ms)
+        for row in holes:
+            add_gap(int(row["prev_ms"]) + tf_ms, int(row["open_time_ms"]))
+        if upper - (last_ms + tf_ms) > 0:
+            add_gap(last_ms + tf_ms, upper)
+
+    expected = expected_bar_count(tf, start_ms, end_ms, now_ms) or 0
+    return {
+        "symbol": symbol,
+        "timeframe": tf,
+        "start_ms": int(start_ms),
+        "end_ms": int(end_ms),
+        "candles": count,
+        "expected": expected,
+        "coverage_pct": (min(count, expected) / expected * 100.0) if expected else 100.0,
+        "missing": sum(g["missing"] for g in gaps),
+        "gaps": gaps,
+    }
+
+
+def repair_gaps(conn, symbol: str, timeframe: str, start_ms: int, end_ms: int) -> dict:
+    """Re-fetch only the missing intervals from OKX, then rescan for coverage."""
+    metrics = SyncMetrics(parent=SYNC_METRICS)
+    before = scan_gaps(conn, symbol, timeframe, start_ms, end_ms)
+    fetched = 0
+    counts = dict.fromkeys(UPSERT_COUNT_KEYS, 0)
+    for gap in before["gaps"]:
+        rows = fetch_okx_ohlcv_range(symbol, before["timeframe"], gap["from_ms"], gap["to_ms"], metrics=metrics)
+        started = pytime.perf_counter()
+        written = upsert_rows(conn, symbol, before["timeframe"], rows)
+        metrics.observe_upsert(len(rows), pytime.perf_counter() - started)
+        for key, value in written.items():
+            counts[key] += value
+        fetched += len(rows)
+    after = scan_gaps(conn, symbol, timeframe, start_ms, end_ms) if before["gaps"] else before
+    return {
+        **after,
+        "coverage_before_pct": before["coverage_pct"],
+        "gaps_before": len(before["gaps"]),
+        "fetched": fetched,
+        **counts,
+        "metrics": metrics.finish(),
+    }
+
+
+def gap_report(
+    symbols: list[str], timeframes: list[str], start_ms: int, end_ms: int, repair: bool = False
+) -> list[dict]:
+    """Coverage (and optionally repair) for every symbol x timeframe over one window."""
+    conn = mysql_connect(get_mysql_config())
+    try:
+        ensure_schema(conn)
+        report = []
+        for symbol in symbols:
+            for timeframe in timeframes:
+                if repair:
+                    report.append(repair_gaps(conn, symbol, timeframe, start_ms, end_ms))
+                else:
+                    report.append(scan_gaps(conn, symbol, timeframe, start_ms, end_ms))
+        return report
+    finally:
+        conn.close()
+
+
+def sync_to_now(symbol: str, timeframe: str, lookback_bars: Optional[int] = None, conn=None) -> dict:
+    """Bring one series up to the current (possibly still forming) candle.
+
+    Starts right after the newest confirmed candle, so a series that is
+    already current costs one request. Without a watermark it resumes from the
+    newest stored candle, or `lookback_bars` (KLINE_SYNC_LOOKBACK_BARS) back.
+    """
+    tf = normalize_timeframe(timeframe)
+    if not tf:
+        raise ValueError("invalid timeframe")
+    own_conn = conn is None
+    if own_conn:
+        conn = mysql_connect(get_mysql_config())
+    try:
+        if own_conn:
+            ensure_schema(conn)
+        tf_ms = TIMEFRAME_MS[tf]
+        now_ms = int(pytime.time() * 1000)
+        end_ms = now_ms + tf_ms
+        state = get_sync_state(conn, symbol, tf)
+        if state is None:
+            with conn.cursor() as cur:
+                cur.execute(
+                    "SELECT MAX(open_time_ms) AS ts FROM okx_kline WHERE symbol=%s AND timeframe=%s",
+                    (symbol, tf),
+                )
+                newest = (cur.fetchone() or {}).get("ts")
+            if newest is not None:
+                start_ms = int(newest)
+            else:
+                bars = int(lookback_bars or os.getenv("KLINE_SYNC_LOOKBACK_BARS", "1000"))
+                start_ms = now_ms - bars * tf_ms
+            # Seed the range so the window below is treated as contiguous with it.
+            state = (start_ms, start_ms - 1)
+            save_sync_state(conn, symbol, tf, state[0], state[1])
+        result = _sync_window(conn, symbol, tf, state[1] + 1, end_ms)
+    finally:
+        if own_conn:
+            conn.close()
+
+    return {"symbol": symbol, "timeframe": tf, **result, "end_ms": end_ms}
@@ -0,0 +1,276 @@
+import argparse
+import json
+import os
+import signal
+import threading
+import time as pytime
+from typing import Callable, Optional
+
+import websocket
+
+from instrument_catalog import resolve_symbols
+from kline_features import features_enabled, refresh_features, update_features
+from kline_sync_service import (
+    KLINE_SYMBOLS,
+    TIMEFRAME_MS,
+    _ccxt_symbol_to_inst_id,
+    _confirmed_runs,
+    _merge_sync_state,
+    bar_close_ms,
+    ensure_schema,
+    fetch_okx_ohlcv_range,
+    get_mysql_config,
+    get_sync_state,
+    mysql_connect,
+    normalize_timeframe,
+    parse_okx_candle,
+    save_sync_state,
+    upsert_rows,
+)
+from kline_sync_daemon import ALL_TIMEFRAMES
+
+# Candle channels live on the "business" endpoint; point OKX_WS_URL at a local stand-in for tests.
+OKX_WS_URL = os.getenv("OKX_WS_URL", "wss://ws.okx.com:8443/ws/v5/business")
+
+
+class KlineWsIngestor:
+    """Stream confirmed candles from OKX candle channels into okx_kline.
+
+    Confirmed candles are buffered and written through upsert_rows every
+    `flush_seconds` (KLINE_WS_FLUSH_SECONDS) or `batch_size` rows
+    (KLINE_WS_BATCH), and the okx_kline_sync_state watermark advances while
+    the stream stays contiguous. After every (re)connect, and whenever a
+    candle arrives out of sequence, the missing bars are backfilled through
+    fetch_okx_ohlcv_range.
+    """
+
+    def __init__(
+        self,
+        symbols: Optional[list[str]] = None,
+        timeframes: Optional[list[str]] = None,
+        url: Optional[str] = None,
+        flush_seconds: Optional[float] = None,
+        batch_size: Optional[int] = None,
+        ping_seconds: float = 25.0,
+        on_flush: Optional[Callable[[str, str, dict], None]] = None,
+    ) -> None:
+        self.symbols = list(symbols or KLINE_SYMBOLS)
+        self.timeframes = list(timeframes or ALL_TIMEFRAMES)
+        self.url = url or OKX_WS_URL
+        self.flush_seconds = float(flush_seconds or os.getenv("KLINE_WS_FLUSH_SECONDS", "1"))
+        self.batch_size = max(1, int(batch_size or os.getenv("KLINE_WS_BATCH", "500")))
+        self.ping_seconds = float(ping_seconds)
+        self.on_flush = on_flush
+
+        self._symbol_by_inst = {_ccxt_symbol_to_inst_id(s): s for s in self.symbols}
+        self._tf_by_channel = {f"candle{tf}": tf for tf in self.timeframes}
+        self._pending: dict[tuple[str, str], dict[int, list[float]]] = {}
+        self._state: dict[tuple[str, str], Optional[tuple[int, int]]] = {}
+        self._needs_backfill: set[tuple[str, str]] = set()
+        self._stop = threading.Event()
+        self.stats = {
+            "connects": 0,
+            "reconnects": 0,
+            "messages": 0,
+            "candles": 0,
+            "flushes": 0,
+            "inserted": 0,
+            "updated": 0,
+            "unchanged": 0,
+            "backfilled": 0,
+        }
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    # -- connection loop -----------------------------------------------------
+
+    def run_forever(self) -> None:
+        conn = mysql_connect(get_mysql_config())
+        ensure_schema(conn)
+        delay = 1.0
+        try:
+            while not self._stop.is_set():
+                ws = None
+                try:
+                    conn.ping(reconnect=True)
+                    ws = websocket.create_connection(self.url, timeout=min(self.flush_seconds, self.ping_seconds))
+                    self._subscribe(ws)
+                    self.stats["connects"] += 1
+                    # Subscribe first, then backfill: pushes that arrive meanwhile wait in the socket.
+                    self._needs_backfill.update((s, tf) for s in self.symbols for tf in self.timeframes)
+                    self._backfill_pending(conn)
+                    delay = 1.0
+                    self._receive(ws, conn)
+                except Exception as exc:
+                    if self._stop.is_set():
+                        break
+                    self.stats["reconnects"] += 1
+                    print(f"[kline-ws] 连接中断: {exc}，{delay:.0f}s 后重连")
+                    self._stop.wait(delay)
+                    delay = min(60.0, delay * 2)
+                finally:
+                    if ws is not None:
+                        try:
+                            ws.close()
+                        except Exception:
+                            pass
+                    try:
+                        self._flush(conn)
+                    except Exception as exc:
+                        print(f"[kline-ws] 写入缓冲失败: {exc}")
+        finally:
+            conn.close()
+
+    def _subscribe(self, ws) -> None:
+        args = [
+            {"channel": channel, "instId": inst_id}
+            for channel in self._tf_by_channel
+            for inst_id in self._symbol_by_inst
+        ]
+        ws.send(json.dumps({"op": "subscribe", "args": args}))
+
+    def _receive(self, ws, conn) -> None:
+        last_flush = pytime.monotonic()
+        last_ping = last_flush
+        last_seen = last_flush
+        while not self._stop.is_set():
+            try:
+                message = ws.recv()
+                last_seen = pytime.monotonic()
+            except websocket.WebSocketTimeoutException:
+                message = None
+            if message:
+                self._handle(message)
+
+            now = pytime.monotonic()
+            if now - last_seen > 2 * self.ping_seconds:
+                raise ConnectionError("no data or pong received, reconnecting")
+            if now - last_ping >= self.ping_seconds:
+                # OKX drops connections that stay silent for 30s.
+                ws.send("ping")
+                last_ping = now
+            buffered = sum(len(rows) for rows in self._pending.values())
+            if buffered >= self.batch_size or (buffered and now - last_flush >= self.flush_seconds):
+                self._flush(conn)
+                last_flush = now
+            if self._needs_backfill:
+                self._backfill_pending(conn)
+
+    def _handle(self, message: str) -> None:
+        if message == "pong":
+            return
+        self.stats["messages"] += 1
+        payload = json.loads(message)
+        if payload.get("event") == "error":
+            raise RuntimeError(f"OKX WebSocket error {payload.get('code')}: {payload.get('msg')}")
+        arg = payload.get("arg") or {}
+        timeframe = self._tf_by_channel.get(arg.get("channel"))
+        symbol = self._symbol_by_inst.get(arg.get("instId"))
+        if not timeframe or not symbol or not payload.get("data"):
+            return
+        for raw in payload["data"]:
+            row = parse_okx_candle(raw)
+            if row[6] != 1:
+                continue
+            self._pending.setdefault((symbol, timeframe), {})[row[0]] = row
+            self.stats["candles"] += 1
+
+    # -- storage -------------------------------------------------------------
+
+    def _flush(self, conn) -> None:
+        pending, self._pending = self._pending, {}
+        for (symbol, timeframe), rows_by_ts in pending.items():
+            rows = [rows_by_ts[ts] for ts in sorted(rows_by_ts)]
+            counts = upsert_rows(conn, symbol, timeframe, rows)
+            for key in ("inserted", "updated", "unchanged"):
+                self.stats[key] += counts[key]
+            self.stats["flushes"] += 1
+            self._advance_state(conn, symbol, timeframe, rows)
+            # After a missed push the features wait for _backfill, so they never step over the gap.
+            if features_enabled() and (symbol, timeframe) not in self._needs_backfill:
+                update_features(conn, symbol, timeframe)
+            if self.on_flush is not None and (counts["inserted"] or counts["updated"]):
+                self.on_flush(symbol, timeframe, counts)
+
+    def _advance_state(self, conn, symbol: str, timeframe: str, rows: list[list[float]]) -> None:
+        key = (symbol, timeframe)
+        state = self._state.get(key)
+        before = state
+        for row in rows:
+            ts_ms = int(row[0])
+            if state is None:
+                state = (ts_ms, ts_ms)
+            elif ts_ms <= state[1]:
+                continue
+            elif ts_ms == bar_close_ms(timeframe, state[1]):
+                state = (state[0], ts_ms)
+            else:
+                # A confirmed bar was skipped (missed push): fill it from REST before moving on.
+                self._needs_backfill.add(key)
+                break
+        if state != before:
+            save_sync_state(conn, symbol, timeframe, state[0], state[1])
+            self._state[key] = state
+
+    def _backfill_pending(self, conn) -> None:
+        keys, self._needs_backfill = sorted(self._needs_backfill), set()
+        for symbol, timeframe in keys:
+            self._backfill(conn, symbol, timeframe)
+
+    def _backfill(self, conn, symbol: str, timeframe: str) -> None:
+        state = get_sync_state(conn, symbol, timeframe)
+        now_ms = int(pytime.time() * 1000)
+        if state is None:
+            bars = int(os.getenv("KLINE_SYNC_LOOKBACK_BARS", "1000"))
+            start_ms = now_ms - bars * TIMEFRAME_MS[timeframe]
+        else:
+            start_ms = state[1] + 1
+        rows = fetch_okx_ohlcv_range(symbol, timeframe, start_ms, now_ms) if start_ms < now_ms else []
+        confirmed = [row for row in rows if int(row[6]) == 1]
+        if confirmed:
+            upsert_rows(conn, symbol, timeframe, confirmed)
+            self.stats["backfilled"] += len(confirmed)
+        merged = _merge_sync_state(state, timeframe, _confirmed_runs(timeframe, (row[0] for row in confirmed)))
+        if merged is not None and merged != state:
+            save_sync_state(conn, symbol, timeframe, merged[0], merged[1])
+        self._state[(symbol, timeframe)] = merged
+        if features_enabled():
+            refresh_features(conn, symbol, timeframe, changed_from_ms=confirmed[0][0] if confirmed else None)
+
+
+def main(argv=None) -> None:
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="OKX WebSocket candle ingestion into okx_kline")
+    parser.add_argument("--symbols", nargs="*", default=None, help="Default: KLINE_SYMBOLS")
+    parser.add_argument("--timeframes", nargs="*", default=None, help="Default: all day and range timeframes")
+    parser.add_argument("--url", default=None, help="Default: OKX_WS_URL")
+    args = parser.parse_args(argv)
+
+    timeframes = None
+    if args.timeframes:
+        timeframes = [normalize_timeframe(tf) for tf in args.timeframes]
+        if not all(timeframes):
+            parser.error("invalid timeframe")
+
+    try:
+        symbols = resolve_symbols(args.symbols)
+    except ValueError as exc:
+        parser.error(str(exc))
+    ingestor = KlineWsIngestor(symbols=symbols, timeframes=timeframes, url=args.url)
+
+    def handle_stop(signum, frame):
+        print(f"[kline-ws] 收到信号 {signum}，正在停止...")
+        ingestor.stop()
+
+    signal.signal(signal.SIGTERM, handle_stop)
+    signal.signal(signal.SIGINT, handle_stop)
+    print(f"[kline-ws] 连接 {ingestor.url}: {len(ingestor.symbols)} symbols x {len(ingestor.timeframes)} timeframes")
+    ingestor.run_forever()
+    print(f"[kline-ws] 已停止: {json.dumps(ingestor.stats, ensure_ascii=False)}")
+
+
+if __name__ == "__main__":
+    main()
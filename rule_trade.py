@@ -9,7 +9,8 @@ from dotenv import load_dotenv
 
 import common
 import settings
-from backtest_service import Candle, STRATEGIES
+from backtest_service import Candle, STRATEGIES, build_timeframe_view, load_strategy_features
+from kline_sync_service import normalize_timeframe
 
 
 def _parse_timeframe_minutes(tf: str) -> int:
@@ -52,6 +53,21 @@ def _fetch_candles(exchange, symbol: str, timeframe: str, limit: int) -> list[Ca
     return candles
 
 
+def _ccxt_timeframe(tf: str) -> str:
+    # ccxt uses lower-case hour/day units; "1M" (month) keeps its case.
+    return tf if tf == "1M" else tf.lower()
+
+
+def _fetch_frames(exchange, symbol: str, base_candles: list[Candle], base_timeframe: str, meta: dict) -> dict:
+    timeframes = meta.get("timeframes") or {}
+    limit = max(120, int(meta.get("timeframe_warmup", 0)) + 10)
+    frames = {}
+    for role, tf in timeframes.items():
+        candles = _fetch_candles(exchange, symbol, _ccxt_timeframe(tf), limit=limit)
+        frames[role] = build_timeframe_view(base_candles, base_timeframe, candles, tf)
+    return frames
+
+
 def _get_proxies() -> dict:
     proxy = (
         os.getenv("HTTPS_PROXY")
@@ -157,6 +173,7 @@ def run(strategy_id: str, symbol: str, timeframe: str, amount: float, leverage:
     print(f"交易周期: {trade_config['timeframe']}")
 
     tf_minutes = _parse_timeframe_minutes(timeframe)
+    base_tf = normalize_timeframe(timeframe) or timeframe
 
     while True:
         _wait_for_next_period(tf_minutes)
@@ -166,6 +183,7 @@ def run(strategy_id: str, symbol: str, timeframe: str, amount: float, leverage:
 
         try:
             candles = _fetch_candles(exchange, symbol, timeframe, limit=max(120, int(params.get("slow", 80)) + 10))
+            frames = _fetch_frames(exchange, symbol, candles, base_tf, meta) if meta.get("timeframes") else None
         except ccxt.NetworkError as exc:
             print(f"网络异常: {exc}")
             time.sleep(30)
@@ -192,7 +210,13 @@ def run(strategy_id: str, symbol: str, timeframe: str, amount: float, leverage:
             pos = 0
 
         idx = max(0, len(candles) - 2)
-        desired = fn(idx, candles, params, pos)
+        extra = {}
+        if frames is not None:
+            extra["frames"] = frames
+        features = load_strategy_features(symbol, candles, base_tf, strategy_id, params)
+        if features is not None:
+            extra["features"] = features
+        desired = fn(idx, candles, params, pos, **extra)
         if desired not in (-1, 0, 1):
             desired = 0
 
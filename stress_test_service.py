@@ -0,0 +1,463 @@
+import argparse
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Callable, Optional, Sequence
+
+import numpy as np
+
+from backtest_service import STRATEGIES, Candle, _clamp_leverage, _cost_rate_from_bps, _resolve_strategy, fetch_klines
+from kline_sync_service import build_range_window, normalize_timeframe
+
+STRESS_METHODS = {"bootstrap", "regime_gbm"}
+
+
+@dataclass(frozen=True)
+class HistoryStats:
+    """Per-bar shape of the historical series, in log space.
+
+    gap: log(open_t / close_{t-1}); body: log(close_t / open_t);
+    upper / lower: wick lengths above max(open, close) / below min(open, close).
+    """
+
+    start_price: float
+    gap: Any
+    body: Any
+    upper: Any
+    lower: Any
+    regime_mu: Any  # (2,) mean log return per regime (calm, volatile)
+    regime_sigma: Any  # (2,)
+    regime_stay: Any  # (2,) probability of staying in the same regime
+    sigma: float
+
+
+def history_stats(candles: Sequence[Candle], vol_window: int = 48) -> HistoryStats:
+    if len(candles) < 3:
+        raise ValueError("not enough kline data for stress test")
+    o = np.array([c.open for c in candles], dtype=np.float64)
+    h = np.array([c.high for c in candles], dtype=np.float64)
+    lo = np.array([c.low for c in candles], dtype=np.float64)
+    c = np.array([c.close for c in candles], dtype=np.float64)
+    if (o <= 0).any() or (c <= 0).any() or (lo <= 0).any():
+        raise ValueError("kline data contains non-positive prices")
+
+    gap = np.zeros(len(c))
+    gap[1:] = np.log(o[1:] / c[:-1])
+    body = np.log(c / o)
+    upper = np.log(np.maximum(h, np.maximum(o, c)) / np.maximum(o, c))
+    lower = np.log(np.minimum(o, c) / np.minimum(lo, np.minimum(o, c)))
+
+    # Two-regime split on rolling volatility of bar returns.
+    r = gap + body
+    w = max(2, min(int(vol_window), len(r) // 2))
+    cs = np.concatenate(([0.0], np.cumsum(r)))
+    cs2 = np.concatenate(([0.0], np.cumsum(r * r)))
+    mean = (cs[w:] - cs[:-w]) / w
+    var = np.maximum((cs2[w:] - cs2[:-w]) / w - mean * mean, 0.0)
+    vol = np.concatenate((np.full(w - 1, np.sqrt(var[0])), np.sqrt(var)))
+    regime = (vol > np.median(vol)).astype(np.int8)
+
+    mu = np.zeros(2)
+    sig = np.zeros(2)
+    stay = np.full(2, 0.5)
+    for k in (0, 1):
+        sel = r[regime == k]
+        if len(sel) >= 2:
+            mu[k] = sel.mean()
+            sig[k] = sel.std(ddof=1)
+        prev = regime[:-1] == k
+        if prev.any():
+            stay[k] = float((regime[1:][prev] == k).mean())
+    overall = float(r.std(ddof=1)) if len(r) > 1 else 0.0
+    sig = np.where(sig > 0, sig, overall)
+
+    return HistoryStats(
+        start_price=float(o[0]),
+        gap=gap,
+        body=body,
+        upper=upper,
+        lower=lower,
+        regime_mu=mu,
+        regime_sigma=sig,
+        regime_stay=stay,
+        sigma=overall,
+    )
+
+
+def _assemble(start_price: float, gap: Any, body: Any, upper: Any, lower: Any) -> dict[str, Any]:
+    log_close = np.log(start_price) + np.cumsum(gap + body, axis=1)
+    close = np.exp(log_close)
+    open_ = close * np.exp(-body)
+    top = np.maximum(open_, close)
+    bottom = np.minimum(open_, close)
+    return {"open": open_, "high": top * np.exp(upper), "low": bottom * np.exp(-lower), "close": close}
+
+
+def generate_paths(
+    stats: HistoryStats,
+    n_paths: int,
+    n_bars: int,
+    method: str = "bootstrap",
+    block_size: int = 48,
+    rng: Optional[np.random.Generator] = None,
+) -> dict[str, Any]:
+    """Synthetic OHLC paths as 2-D arrays shaped (n_paths, n_bars)."""
+    rng = rng or np.random.default_rng()
+    hist_len = len(stats.body)
+
+    if method == "bootstrap":
+        block = max(1, min(int(block_size), hist_len))
+        n_blocks = -(-n_bars // block)
+        starts = rng.integers(0, hist_len - block + 1, size=(n_paths, n_blocks))
+        idx = (starts[:, :, None] + np.arange(block)).reshape(n_paths, -1)[:, :n_bars]
+        gap = stats.gap[idx]
+        gap[:, 0] = 0.0
+        return _assemble(stats.start_price, gap, stats.body[idx], stats.upper[idx], stats.lower[idx])
+
+    if method == "regime_gbm":
+        regime = np.empty((n_paths, n_bars), dtype=np.int8)
+        current = (rng.random(n_paths) < 0.5).astype(np.int8)
+        switch_draws = rng.random((n_paths, n_bars))
+        for t in range(n_bars):
+            stay = switch_draws[:, t] < stats.regime_stay[current]
+            current = np.where(stay, current, 1 - current).astype(np.int8)
+            regime[:, t] = current
+        sigma = stats.regime_sigma[regime]
+        body = stats.regime_mu[regime] + sigma * rng.standard_normal((n_paths, n_bars))
+        # Wicks are resampled from history and scaled to the regime volatility.
+        wick_idx = rng.integers(0, hist_len, size=(n_paths, n_bars))
+        scale = sigma / stats.sigma if stats.sigma > 0 else np.ones_like(sigma)
+        gap = np.zeros((n_paths, n_bars))
+        return _assemble(stats.start_price, gap, body, stats.upper[wick_idx] * scale, stats.lower[wick_idx] * scale)
+
+    raise ValueError(f"unknown stress method: {method}")
+
+
+def _rolling_mean(x: Any, window: int) -> Any:
+    """Trailing mean along axis 1; NaN until the window is full (matches backtest_service._sma)."""
+    out = np.full(x.shape, np.nan)
+    if window <= 0 or window > x.shape[1]:
+        return out
+    cs = np.cumsum(x, axis=1)
+    out[:, window - 1] = cs[:, window - 1]
+    out[:, window:] = cs[:, window:] - cs[:, :-window]
+    out[:, window - 1 :] /= float(window)
+    return out
+
+
+# Vectorized kernels: prepare(paths, params) -> features, step(i, features, pos) -> desired.
+# They must mirror the scalar strategies in backtest_service bar for bar.
+
+
+def _ma_crossover_prepare(paths: dict[str, Any], params: dict[str, Any]) -> dict[str, Any]:
+    fast = int(params.get("fast", 10))
+    slow = int(params.get("slow", 30))
+    if slow <= fast:
+        slow = fast + 1
+    return {"fast": _rolling_mean(paths["close"], fast), "slow": _rolling_mean(paths["close"], slow)}
+
+
+def _ma_crossover_step(i: int, feats: dict[str, Any], pos: Any) -> Any:
+    f = feats["fast"][:, i]
+    s = feats["slow"][:, i]
+    desired = np.where(f > s, 1, np.where(f < s, -1, pos))
+    return np.where(np.isnan(f) | np.isnan(s), 0, desired)
+
+
+def _conservative_trend_prepare(paths: dict[str, Any], params: dict[str, Any]) -> dict[str, Any]:
+    fast = int(params.get("fast", 20))
+    slow = int(params.get("slow", 80))
+    if slow <= fast:
+        slow = fast + 1
+    return {
+        "close": paths["close"],
+        "fast": _rolling_mean(paths["close"], fast),
+        "slow": _rolling_mean(paths["close"], slow),
+        "trend_min": float(params.get("trend_min", 0.01)),
+    }
+
+
+def _conservative_trend_step(i: int, feats: dict[str, Any], pos: Any) -> Any:
+    f = feats["fast"][:, i]
+    s = feats["slow"][:, i]
+    close = feats["close"][:, i]
+    trend_min = feats["trend_min"]
+    valid = ~(np.isnan(f) | np.isnan(s)) & (s > 0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        trend = (f - s) / s
+    strong = valid & (trend > 0) & (trend >= trend_min)
+    enter = (pos == 0) & (close > f) & (close > s)
+    hold = (pos == 1) & ~((close < f) | (trend < trend_min * 0.5))
+    return np.where(strong & (enter | hold), 1, 0)
+
+
+VECTOR_STRATEGIES: dict[str, tuple[Callable[..., dict[str, Any]], Callable[..., Any]]] = {
+    "ma_crossover": (_ma_crossover_prepare, _ma_crossover_step),
+    "conservative_trend": (_conservative_trend_prepare, _conservative_trend_step),
+}
+
+
+def backtest_paths(
+    paths: dict[str, Any],
+    strategy_id: str,
+    params: Optional[dict[str, Any]] = None,
+    leverage: float = 1.0,
+    fee_bps: float = 5.0,
+    slippage_bps: float = 2.0,
+) -> dict[str, Any]:
+    """Run backtest() semantics over every row of the 2-D path arrays at once.
+
+    Loops over bars and vectorizes across paths, so memory stays O(paths)
+    beyond the inputs and indicator arrays.
+    """
+    if strategy_id not in VECTOR_STRATEGIES:
+        raise ValueError(f"strategy has no vectorized kernel: {strategy_id}")
+    meta, merged = _resolve_strategy(strategy_id, params)
+    prepare, step = VECTOR_STRATEGIES[strategy_id]
+    feats = prepare(paths, merged)
+
+    warmup = int(meta.get("warmup", 0))
+    lev = _clamp_leverage(leverage)
+    cost = _cost_rate_from_bps(fee_bps) + _cost_rate_from_bps(slippage_bps)
+    stop_loss_pct = float(merged.get("stop_loss_pct", 0.0) or 0.0)
+    take_profit_pct = float(merged.get("take_profit_pct", 0.0) or 0.0)
+    max_hold_bars = int(merged.get("max_hold_bars", 0) or 0)
+
+    open_ = paths["open"]
+    close = paths["close"]
+    n_paths, n_bars = close.shape
+
+    pos = np.zeros(n_paths, dtype=np.int8)
+    entry = np.zeros(n_paths)
+    entry_idx = np.zeros(n_paths, dtype=np.int64)
+    equity = np.ones(n_paths)
+    equity_at_entry = np.ones(n_paths)
+    peak = np.full(n_paths, -np.inf)
+    max_dd = np.zeros(n_paths)
+    trades = np.zeros(n_paths, dtype=np.int64)
+    wins = np.zeros(n_paths, dtype=np.int64)
+
+    for i in range(n_bars):
+        c = close[:, i]
+        held = pos != 0
+        if held.any():
+            pnl = pos[held] * (c[held] - entry[held]) / entry[held]
+            equity[held] = equity_at_entry[held] * (1.0 + lev * pnl)
+        np.maximum(peak, equity, out=peak)
+        dd = np.where(peak > 0, (peak - equity) / np.where(peak > 0, peak, 1.0), 0.0)
+        np.maximum(max_dd, dd, out=max_dd)
+
+        if i >= n_bars - 2 or i < warmup:
+            continue
+
+        desired = step(i, feats, pos)
+        next_open = open_[:, i + 1]
+
+        force = np.zeros(n_paths, dtype=bool)
+        if held.any():
+            if stop_loss_pct > 0:
+                force |= (pos == 1) & (c <= entry * (1.0 - stop_loss_pct / 100.0))
+                force |= (pos == -1) & (c >= entry * (1.0 + stop_loss_pct / 100.0))
+            if take_profit_pct > 0:
+                force |= (pos == 1) & (c >= entry * (1.0 + take_profit_pct / 100.0))
+                force |= (pos == -1) & (c <= entry * (1.0 - take_profit_pct / 100.0))
+            if max_hold_bars > 0:
+                force |= held & ((i - entry_idx) >= max_hold_bars)
+            force &= held
+        desired = np.where(force, 0, desired)
+
+        change = desired != pos
+        tradable = change & (next_open > 0)
+        closing = tradable & held
+        if closing.any():
+            gross = pos[closing] * (next_open[closing] - entry[closing]) / entry[closing]
+            net = lev * gross - 2.0 * cost * lev
+            equity[closing] *= 1.0 + net
+            trades[closing] += 1
+            wins[closing] += net > 0
+            pos[closing] = 0
+            equity_at_entry[closing] = equity[closing]
+
+        opening = tradable & (desired != 0) & ~force
+        if opening.any():
+            pos[opening] = desired[opening]
+            entry[opening] = next_open[opening]
+            entry_idx[opening] = i + 1
+            equity_at_entry[opening] = equity[opening]
+
+    return {
+        "total_return": equity - 1.0,
+        "max_drawdown": max_dd,
+        "trades": trades,
+        "win_rate": np.where(trades > 0, wins / np.maximum(trades, 1), 0.0),
+    }
+
+
+def _run_batch(task: tuple) -> dict[str, Any]:
+    stats, n_paths, n_bars, method, block_size, seed, strategy_id, params, leverage, fee_bps, slippage_bps = task
+    rng = np.random.default_rng(seed)
+    paths = generate_paths(stats, n_paths, n_bars, method=method, block_size=block_size, rng=rng)
+    return backtest_paths(paths, strategy_id, params, leverage, fee_bps, slippage_bps)
+
+
+def _distribution(values: Any, scale: float = 100.0) -> dict[str, float]:
+    v = np.asarray(values, dtype=np.float64) * scale
+    q = np.percentile(v, [5, 25, 50, 75, 95])
+    return {
+        "mean": float(v.mean()),
+        "std": float(v.std()),
+        "min": float(v.min()),
+        "p5": float(q[0]),
+        "p25": float(q[1]),
+        "p50": float(q[2]),
+        "p75": float(q[3]),
+        "p95": float(q[4]),
+        "max": float(v.max()),
+    }
+
+
+def stress_test(
+    candles: Sequence[Candle],
+    strategy_id: str,
+    params: Optional[dict[str, Any]] = None,
+    n_paths: int = 1000,
+    n_bars: Optional[int] = None,
+    method: str = "bootstrap",
+    block_size: int = 48,
+    leverage: float = 1.0,
+    fee_bps: float = 5.0,
+    slippage_bps: float = 2.0,
+    batch_size: int = 250,
+    workers: Optional[int] = None,
+    seed: Optional[int] = None,
+) -> dict[str, Any]:
+    """Evaluate a strategy over synthetic paths derived from `candles`.
+
+    Paths are generated and evaluated in batches of `batch_size`; batches run
+    in a process pool when `workers` > 1. Only per-path metrics are kept.
+    """
+    if method not in STRESS_METHODS:
+        raise ValueError(f"unknown stress method: {method}")
+    if strategy_id not in STRATEGIES:
+        raise ValueError(f"unknown strategy: {strategy_id}")
+    if strategy_id not in VECTOR_STRATEGIES:
+        raise ValueError(f"stress test not supported for strategy: {strategy_id}")
+    n_paths = max(1, int(n_paths))
+    n_bars = int(n_bars or len(candles))
+    warmup = int(STRATEGIES[strategy_id].get("warmup", 0))
+    if n_bars < max(10, warmup + 3):
+        raise ValueError("n_bars too small for strategy warmup")
+    batch_size = max(1, int(batch_size))
+
+    stats = history_stats(candles)
+    seeds = np.random.SeedSequence(seed).spawn(-(-n_paths // batch_size))
+    tasks = []
+    remaining = n_paths
+    for s in seeds:
+        size = min(batch_size, remaining)
+        remaining -= size
+        tasks.append(
+            (stats, size, n_bars, method, block_size, s, strategy_id, params, leverage, fee_bps, slippage_bps)
+        )
+
+    if workers and workers > 1 and len(tasks) > 1:
+        with ProcessPoolExecutor(max_workers=int(workers)) as pool:
+            results = list(pool.map(_run_batch, tasks))
+    else:
+        results = [_run_batch(t) for t in tasks]
+
+    total_return = np.concatenate([r["total_return"] for r in results])
+    max_dd = np.concatenate([r["max_drawdown"] for r in results])
+    trades = np.concatenate([r["trades"] for r in results])
+    win_rate = np.concatenate([r["win_rate"] for r in results])
+
+    _, merged = _resolve_strategy(strategy_id, params)
+    return {
+        "strategy": {"id": strategy_id, "name": STRATEGIES[strategy_id]["name"], "params": merged},
+        "method": method,
+        "paths": int(n_paths),
+        "bars": int(n_bars),
+        "history_candles": len(candles),
+        "leverage": float(_clamp_leverage(leverage)),
+        "fee_bps": float(fee_bps),
+        "slippage_bps": float(slippage_bps),
+        "total_return_pct": _distribution(total_return),
+        "max_drawdown_pct": _distribution(max_dd),
+        "trades": _distribution(trades, scale=1.0),
+        "win_rate_pct": _distribution(win_rate),
+        "loss_probability_pct": float((total_return < 0).mean() * 100.0),
+    }
+
+
+def stress_test_from_dates(
+    symbol: str,
+    timeframe: str,
+    start_date: str,
+    end_date: str,
+    tz_name: str,
+    strategy_id: str,
+    **kwargs: Any,
+) -> dict[str, Any]:
+    tf = normalize_timeframe(timeframe)
+    if not tf:
+        raise ValueError("invalid timeframe")
+    start_ms, end_ms = build_range_window(start_date, end_date, tf, tz_name)
+    candles = fetch_klines(symbol=symbol, timeframe=tf, start_ms=start_ms, end_ms=end_ms)
+    result = stress_test(candles, strategy_id, **kwargs)
+    result["symbol"] = symbol
+    result["timeframe"] = tf
+    result["start_date"] = start_date
+    result["end_date"] = end_date
+    result["tz"] = tz_name
+    return result
+
+
+def main(argv=None) -> None:
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Synthetic price-path stress test for backtest strategies")
+    parser.add_argument("--symbol", required=True, help="Symbol, e.g. DOGE/USDT:USDT")
+    parser.add_argument("--timeframe", default="15m")
+    parser.add_argument("--start-date", required=True, help="YYYY-MM-DD")
+    parser.add_argument("--end-date", required=True, help="YYYY-MM-DD")
+    parser.add_argument("--tz", default="Asia/Shanghai")
+    parser.add_argument("--strategy-id", default="conservative_trend")
+    parser.add_argument("--params", default=None, help="JSON object of strategy params")
+    parser.add_argument("--method", choices=sorted(STRESS_METHODS), default="bootstrap")
+    parser.add_argument("--paths", type=int, default=1000)
+    parser.add_argument("--bars", type=int, default=None, help="Bars per path (default: history length)")
+    parser.add_argument("--block-size", type=int, default=48)
+    parser.add_argument("--batch-size", type=int, default=250)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--leverage", type=float, default=1.0)
+    parser.add_argument("--fee-bps", type=float, default=5.0)
+    parser.add_argument("--slippage-bps", type=float, default=2.0)
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args(argv)
+
+    result = stress_test_from_dates(
+        args.symbol,
+        args.timeframe,
+        args.start_date,
+        args.end_date,
+        args.tz,
+        args.strategy_id,
+        params=json.loads(args.params) if args.params else None,
+        n_paths=args.paths,
+        n_bars=args.bars,
+        method=args.method,
+        block_size=args.block_size,
+        leverage=args.leverage,
+        fee_bps=args.fee_bps,
+        slippage_bps=args.slippage_bps,
+        batch_size=args.batch_size,
+        workers=args.workers,
+        seed=args.seed,
+    )
+    print(json.dumps(result, indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
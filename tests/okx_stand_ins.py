@@ -0,0 +1,200 @@
+"""OKX stand-ins only the tests use; the REST one (FakeOkxServer) lives in kline_benchmark."""
+
+import base64
+import hashlib
+import json
+import socket
+import socketserver
+import struct
+import threading
+from typing import Optional
+
+# RFC 6455 handshake GUID, used to derive Sec-WebSocket-Accept.
+_WS_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+
+class FakeOkxWsServer:
+    """Local WebSocket stand-in for the OKX candle channels (/ws/v5/business).
+
+    Speaks just enough RFC 6455 for websocket-client: answers
+    `{"op": "subscribe", "args": [...]}` with one `{"event": "subscribe"}` ack
+    per arg, "ping" with "pong", and rejects other requests with an
+    `{"event": "error"}` frame. Tests push candle rows with `push()` and force
+    a reconnect with `drop_clients()`.
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0) -> None:
+        self.stats = {"connects": 0, "subscribes": 0, "pushes": 0}
+        self._clients: dict = {}
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+
+        server = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                if not server._handshake(self.rfile, self.connection):
+                    return
+                client = {"sock": self.connection, "send_lock": threading.Lock(), "subs": set()}
+                with server._changed:
+                    server._clients[self.connection] = client
+                    server.stats["connects"] += 1
+                    server._changed.notify_all()
+                try:
+                    server._serve(self.rfile, client)
+                except (OSError, ValueError):
+                    pass
+                finally:
+                    with server._changed:
+                        server._clients.pop(self.connection, None)
+                        server._changed.notify_all()
+
+        self._tcpd = socketserver.ThreadingTCPServer((host, int(port)), Handler, bind_and_activate=False)
+        self._tcpd.allow_reuse_address = True
+        self._tcpd.daemon_threads = True
+        self._tcpd.server_bind()
+        self._tcpd.server_activate()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._tcpd.server_address[:2]
+        return f"ws://{host}:{port}/ws/v5/business"
+
+    def start(self) -> "FakeOkxWsServer":
+        self._thread = threading.Thread(target=self._tcpd.serve_forever, name="fake-okx-ws", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.drop_clients()
+        self._tcpd.shutdown()
+        self._tcpd.server_close()
+
+    def __enter__(self) -> "FakeOkxWsServer":
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+    def push(self, channel: str, inst_id: str, rows: list[list[str]]) -> int:
+        """Send candle rows to every client subscribed to (channel, instId); returns how many got them."""
+        message = json.dumps({"arg": {"channel": channel, "instId": inst_id}, "data": rows})
+        with self._lock:
+            clients = [c for c in self._clients.values() if (channel, inst_id) in c["subs"]]
+        for client in clients:
+            self._send(client, message)
+        with self._lock:
+            self.stats["pushes"] += len(clients)
+        return len(clients)
+
+    def drop_clients(self) -> None:
+        """Close every connection without a close frame, like a network drop."""
+        with self._lock:
+            socks = list(self._clients)
+        for sock in socks:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def wait_for_subscription(self, channel: str, inst_id: str, connects: int = 1, timeout: float = 10.0) -> bool:
+        """Block until the `connects`-th connection has subscribed to (channel, instId)."""
+        def ready():
+            return self.stats["connects"] >= connects and any(
+                (channel, inst_id) in c["subs"] for c in self._clients.values()
+            )
+
+        with self._changed:
+            return self._changed.wait_for(ready, timeout)
+
+    def _handshake(self, rfile, sock) -> bool:
+        request_line = rfile.readline()
+        headers = {}
+        while True:
+            line = rfile.readline()
+            if not line or line in (b"\r\n", b"\n"):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        key = headers.get("sec-websocket-key")
+        if not request_line.startswith(b"GET ") or not key:
+            sock.sendall(b"HTTP/1.1 400 Bad Request\r\nContent-Length: 0\r\n\r\n")
+            return False
+        accept = base64.b64encode(hashlib.sha1((key + _WS_GUID).encode()).digest()).decode()
+        sock.sendall(
+            (
+                "HTTP/1.1 101 Switching Protocols\r\n"
+                "Upgrade: websocket\r\n"
+                "Connection: Upgrade\r\n"
+                f"Sec-WebSocket-Accept: {accept}\r\n\r\n"
+            ).encode()
+        )
+        return True
+
+    def _serve(self, rfile, client: dict) -> None:
+        while True:
+            opcode, payload = self._read_frame(rfile)
+            if opcode is None or opcode == 0x8:
+                if opcode == 0x8:
+                    self._send(client, payload, opcode=0x8)
+                return
+            if opcode == 0x9:
+                self._send(client, payload, opcode=0xA)
+            elif opcode == 0x1:
+                self._on_text(client, payload.decode())
+
+    def _on_text(self, client: dict, text: str) -> None:
+        if text == "ping":
+            self._send(client, "pong")
+            return
+        try:
+            request = json.loads(text)
+        except ValueError:
+            request = {}
+        if request.get("op") != "subscribe" or not isinstance(request.get("args"), list):
+            self._send(client, json.dumps({"event": "error", "code": "60012", "msg": f"Invalid request: {text}"}))
+            return
+        for arg in request["args"]:
+            channel, inst_id = arg.get("channel"), arg.get("instId")
+            if not str(channel).startswith("candle") or not inst_id:
+                self._send(client, json.dumps({"event": "error", "code": "60018", "msg": f"Wrong URL or channel:{channel}"}))
+                continue
+            self._send(client, json.dumps({"event": "subscribe", "arg": {"channel": channel, "instId": inst_id}}))
+            with self._changed:
+                client["subs"].add((channel, inst_id))
+                self.stats["subscribes"] += 1
+                self._changed.notify_all()
+
+    @staticmethod
+    def _read_frame(rfile) -> tuple[Optional[int], bytes]:
+        head = rfile.read(2)
+        if len(head) < 2:
+            return None, b""
+        opcode = head[0] & 0x0F
+        length = head[1] & 0x7F
+        if length == 126:
+            length = struct.unpack("!H", rfile.read(2))[0]
+        elif length == 127:
+            length = struct.unpack("!Q", rfile.read(8))[0]
+        # Client frames are always masked.
+        mask = rfile.read(4) if head[1] & 0x80 else b"\0\0\0\0"
+        data = rfile.read(length)
+        if len(data) < length:
+            return None, b""
+        return opcode, bytes(b ^ mask[i % 4] for i, b in enumerate(data))
+
+    @staticmethod
+    def _send(client: dict, payload, opcode: int = 0x1) -> None:
+        data = payload.encode() if isinstance(payload, str) else payload
+        if len(data) < 126:
+            header = struct.pack("!BB", 0x80 | opcode, len(data))
+        elif len(data) < 1 << 16:
+            header = struct.pack("!BBH", 0x80 | opcode, 126, len(data))
+        else:
+            header = struct.pack("!BBQ", 0x80 | opcode, 127, len(data))
+        with client["send_lock"]:
+            try:
+                client["sock"].sendall(header + data)
+            except OSError:
+                pass
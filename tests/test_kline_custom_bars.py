@@ -0,0 +1,83 @@
+import json
+
+import numpy as np
+import pytest
+
+import kline_custom_bars
+from kline_benchmark import BENCH_LISTING_MS, BENCH_SYMBOL, FakeOkxServer, _trade
+from kline_custom_bars import BarAggregator, _parse_trades, iter_trade_slices
+from kline_sync_service import TokenBucket
+
+TRADE_INTERVAL_MS = 250
+INT_FIELDS = ("seq", "open_time_ms", "close_time_ms", "trades", "first_trade_id", "last_trade_id")
+FLOAT_FIELDS = ("open", "high", "low", "close", "volume", "quote_volume")
+
+
+def trades(count):
+    return _parse_trades([_trade(trade_id, TRADE_INTERVAL_MS) for trade_id in range(1, count + 1)])
+
+
+def expected_trade_ids(lo_ms, hi_ms):
+    # _trade: tradeId k+1 trades at BENCH_LISTING_MS + (k // 2) * interval.
+    first = -(-(lo_ms - BENCH_LISTING_MS) // TRADE_INTERVAL_MS) * 2 + 1
+    last = -(-(hi_ms - BENCH_LISTING_MS) // TRADE_INTERVAL_MS) * 2
+    return list(range(first, last + 1))
+
+
+@pytest.mark.parametrize(
+    "kind, threshold, ct_val",
+    [("tick", 7, 1.0), ("volume", 23.0, 1.0), ("volume", 2.5, 0.1), ("dollar", 5000.0, 1.0)],
+)
+def test_batches_resumed_through_state_match_one_pass(kind, threshold, ct_val):
+    history = trades(3000)
+    whole = BarAggregator(kind, threshold, ct_val)
+    expected = whole.feed(history)
+    assert len(expected) > 50
+
+    rng = np.random.default_rng(7)
+    state, parts, i = None, [], 0
+    while i < len(history):
+        # Empty and single-trade batches included; state goes through JSON like okx_custom_bar_state.
+        j = min(len(history), i + int(rng.integers(0, 60)))
+        aggregator = BarAggregator(kind, threshold, ct_val, state=state)
+        parts.append(aggregator.feed(history[i:j]))
+        state = json.loads(json.dumps(aggregator.state()))
+        i = j
+    bars = np.concatenate(parts)
+
+    assert len(bars) == len(expected)
+    for field in INT_FIELDS:
+        np.testing.assert_array_equal(bars[field], expected[field], err_msg=field)
+    for field in FLOAT_FIELDS:
+        np.testing.assert_allclose(bars[field], expected[field], rtol=1e-12, err_msg=field)
+    # Every trade lands in exactly one bar, and the unfinished bar carries the same trades.
+    np.testing.assert_array_equal(bars["first_trade_id"][1:], bars["last_trade_id"][:-1] + 1)
+    assert state["next_seq"] == whole.next_seq
+    partial = state["partial"] or {}
+    assert (partial.get("first_trade_id"), partial.get("trades")) == (
+        (whole.partial or {}).get("first_trade_id"),
+        (whole.partial or {}).get("trades"),
+    )
+
+
+def test_trade_pages_have_no_gaps_or_duplicates(monkeypatch):
+    # An odd page size splits the trade pairs sharing a millisecond across page edges.
+    monkeypatch.setattr(kline_custom_bars, "OKX_TRADES_PAGE_LIMIT", 7)
+    monkeypatch.setattr(kline_custom_bars, "HISTORY_TRADES_LIMITER", TokenBucket(rate_per_sec=1e6, capacity=1e6))
+    # Slice edges fall on trade timestamps; the window end does not.
+    lo = BENCH_LISTING_MS + 1000 * TRADE_INTERVAL_MS
+    hi = lo + 60_000 + 125
+    slice_ms = 29 * TRADE_INTERVAL_MS
+
+    with FakeOkxServer(latency_ms=0, page_size=7, rate_limit=10**6, trade_interval_ms=TRADE_INTERVAL_MS) as server:
+        monkeypatch.setenv("OKX_API_BASE", server.base_url)
+        slices = list(iter_trade_slices(BENCH_SYMBOL, lo, hi, slice_ms=slice_ms))
+
+    assert [end for end, _ in slices][-1] == hi
+    start = lo
+    for end, part in slices:
+        assert ((part["ts"] >= start) & (part["ts"] < end)).all()
+        start = end
+    ids = np.concatenate([part["trade_id"] for _, part in slices]).tolist()
+    assert ids == expected_trade_ids(lo, hi)
+    assert server.stats["requests"] > len(slices)
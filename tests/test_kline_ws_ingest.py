@@ -0,0 +1,159 @@
+import threading
+import time
+import types
+
+import pytest
+
+import kline_ws_ingest
+from kline_benchmark import BENCH_SYMBOL, FakeOkxServer, _candle
+from kline_sync_service import TIMEFRAME_MS, _ccxt_symbol_to_inst_id
+from okx_stand_ins import FakeOkxWsServer
+
+TF = "1m"
+TF_MS = TIMEFRAME_MS[TF]
+INST_ID = _ccxt_symbol_to_inst_id(BENCH_SYMBOL)
+CHANNEL = f"candle{TF}"
+
+
+class FakeStore:
+    """In-memory okx_kline / okx_kline_sync_state behind the functions kline_ws_ingest imports."""
+
+    def __init__(self):
+        self.rows: dict[int, list[float]] = {}
+        self.state: dict[tuple[str, str], tuple[int, int]] = {}
+        self.lock = threading.Lock()
+
+    def upsert_rows(self, conn, symbol, timeframe, rows):
+        counts = {"inserted": 0, "updated": 0, "unchanged": 0}
+        with self.lock:
+            for row in rows:
+                old = self.rows.get(int(row[0]))
+                key = "inserted" if old is None else ("unchanged" if old == list(row) else "updated")
+                counts[key] += 1
+                self.rows[int(row[0])] = list(row)
+        return counts
+
+    def get_sync_state(self, conn, symbol, timeframe):
+        with self.lock:
+            return self.state.get((symbol, timeframe))
+
+    def save_sync_state(self, conn, symbol, timeframe, first_ms, last_ms):
+        with self.lock:
+            self.state[(symbol, timeframe)] = (int(first_ms), int(last_ms))
+
+    def last_ms(self):
+        state = self.get_sync_state(None, BENCH_SYMBOL, TF)
+        return state[1] if state else None
+
+
+class FakeConn:
+    def ping(self, reconnect=False):
+        pass
+
+    def close(self):
+        pass
+
+
+def wait_until(predicate, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.02)
+    return predicate()
+
+
+def push(ws_server, ts_ms, confirm):
+    row = _candle(ts_ms, TF_MS, ts_ms + TF_MS)
+    row[8] = "1" if confirm else "0"
+    assert ws_server.push(CHANNEL, INST_ID, [row]) == 1
+
+
+@pytest.fixture
+def harness(monkeypatch):
+    store = FakeStore()
+    for name in ("upsert_rows", "get_sync_state", "save_sync_state"):
+        monkeypatch.setattr(kline_ws_ingest, name, getattr(store, name))
+    monkeypatch.setattr(kline_ws_ingest, "mysql_connect", lambda config: FakeConn())
+    monkeypatch.setattr(kline_ws_ingest, "get_mysql_config", lambda: {})
+    monkeypatch.setattr(kline_ws_ingest, "ensure_schema", lambda conn: None)
+    monkeypatch.setenv("KLINE_FEATURES", "0")
+    monkeypatch.setenv("KLINE_SYNC_LOOKBACK_BARS", "5")
+
+    # The ingestor's wall clock runs well behind the REST stand-in, so every
+    # bar it backfills is already confirmed and tests can move "now" forward.
+    clock = {"now_ms": (int(time.time() * 1000) // TF_MS - 100) * TF_MS + 1000}
+    monkeypatch.setattr(
+        kline_ws_ingest,
+        "pytime",
+        types.SimpleNamespace(time=lambda: clock["now_ms"] / 1000.0, monotonic=time.monotonic),
+    )
+
+    with FakeOkxServer(latency_ms=0) as rest, FakeOkxWsServer() as ws_server:
+        monkeypatch.setenv("OKX_API_BASE", rest.base_url)
+        ingestor = kline_ws_ingest.KlineWsIngestor(
+            symbols=[BENCH_SYMBOL], timeframes=[TF], url=ws_server.url, flush_seconds=0.1, ping_seconds=5.0
+        )
+        thread = threading.Thread(target=ingestor.run_forever, daemon=True)
+        thread.start()
+        try:
+            yield types.SimpleNamespace(store=store, clock=clock, ingestor=ingestor, ws=ws_server, rest=rest)
+        finally:
+            ingestor.stop()
+            thread.join(timeout=10)
+    assert not thread.is_alive()
+
+
+def test_confirmed_push_flushes_and_advances_state(harness):
+    store, ws_server, ingestor = harness.store, harness.ws, harness.ingestor
+    assert ws_server.wait_for_subscription(CHANNEL, INST_ID)
+    # The connect-time backfill pulls the lookback window over REST.
+    assert wait_until(lambda: store.last_ms() is not None)
+    last = store.last_ms()
+    assert ingestor.stats["backfilled"] >= 4
+
+    push(ws_server, last + TF_MS, confirm=True)
+    push(ws_server, last + 2 * TF_MS, confirm=False)
+    assert wait_until(lambda: store.last_ms() == last + TF_MS)
+    assert last + TF_MS in store.rows
+    # Forming candles (confirm=0) are never written.
+    time.sleep(0.3)
+    assert last + 2 * TF_MS not in store.rows
+    assert ingestor.stats["flushes"] >= 1
+    assert ingestor.stats["candles"] == 1
+
+
+def test_skipped_bar_is_backfilled_from_rest(harness):
+    store, ws_server, ingestor, clock = harness.store, harness.ws, harness.ingestor, harness.clock
+    assert ws_server.wait_for_subscription(CHANNEL, INST_ID)
+    assert wait_until(lambda: store.last_ms() is not None)
+    last = store.last_ms()
+    backfilled = ingestor.stats["backfilled"]
+
+    # Bar last+1 never arrives over the socket; last+2 does.
+    clock["now_ms"] = last + 10 * TF_MS + 1000
+    push(ws_server, last + 2 * TF_MS, confirm=True)
+    assert wait_until(lambda: (store.last_ms() or 0) >= last + 2 * TF_MS)
+    assert last + TF_MS in store.rows
+    assert ingestor.stats["backfilled"] > backfilled
+    # _advance_state stopped at the gap and left the watermark to the REST backfill.
+    first, newest = store.get_sync_state(None, BENCH_SYMBOL, TF)
+    assert all(ts in store.rows for ts in range(first, newest + 1, TF_MS))
+
+
+def test_reconnect_resubscribes_and_resumes(harness):
+    store, ws_server, ingestor, clock = harness.store, harness.ws, harness.ingestor, harness.clock
+    assert ws_server.wait_for_subscription(CHANNEL, INST_ID)
+    assert wait_until(lambda: store.last_ms() is not None)
+    last = store.last_ms()
+
+    # Bars confirmed while the socket is down come back through the reconnect backfill.
+    clock["now_ms"] = last + 3 * TF_MS + 1000
+    ws_server.drop_clients()
+    assert ws_server.wait_for_subscription(CHANNEL, INST_ID, connects=2)
+    assert wait_until(lambda: store.last_ms() == last + 3 * TF_MS)
+    assert ingestor.stats["reconnects"] == 1
+    assert ingestor.stats["connects"] == 2
+
+    push(ws_server, last + 4 * TF_MS, confirm=True)
+    assert wait_until(lambda: store.last_ms() == last + 4 * TF_MS)
@@ -3,22 +3,37 @@ import os
 import signal
 import subprocess
 import sys
+import threading
 import time
 from datetime import datetime, timezone
 from pathlib import Path
 from typing import Optional
 
-from flask import Flask, jsonify, render_template, request
+from flask import Flask, Response, jsonify, render_template, request, stream_with_context
 
 from kline_sync_service import (
     DAY_TIMEFRAMES,
+    KLINE_SYMBOLS,
     RANGE_TIMEFRAMES,
+    build_range_window,
+    ensure_schema,
+    gap_report,
+    get_http_stats,
     normalize_timeframe,
+    get_mysql_config,
+    mysql_connect,
+    render_prometheus_metrics,
     sync_day_kline,
+    sync_lag,
     sync_range_kline,
+    sync_to_now,
 )
+from instrument_catalog import get_instrument_catalog, is_supported_symbol, sync_universe
+from kline_sync_daemon import ALL_TIMEFRAMES, KlineSyncDaemon
+from kline_backfill import list_backfill_jobs, run_backfill
+from kline_batch_sync import run_batch_sync
 from backtest_service import STRATEGIES as BACKTEST_STRATEGIES
-from backtest_service import backtest_from_dates
+from backtest_service import backtest_from_dates, backtest_sensitivity_from_dates, invalidate_kline_cache, normalize_bar_type
 
 BASE_DIR = Path(__file__).resolve().parent
 STATE_FILE = BASE_DIR / "process_state.json"
@@ -55,13 +70,6 @@ DEFAULT_STRATEGIES = {
     },
 }
 
-KLINE_SYMBOLS = [
-    "BTC/USDT:USDT",
-    "ETH/USDT:USDT",
-    "DOGE/USDT:USDT",
-    "XRP/USDT:USDT",
-]
-
 MODE_ALIASES = {
     "live": "live",
     "real": "live",
@@ -76,10 +84,20 @@ SYNC_TYPE_ALIASES = {
     "single_day": "day",
     "range": "range",
     "date_range": "range",
+    "now": "now",
+    "latest": "now",
+    "incremental": "now",
 }
 
 app = Flask(__name__, template_folder=str(BASE_DIR / "templates"))
 
+# Backfill jobs started from the dashboard, keyed by (symbol, timeframe, start_ms, end_ms).
+_BACKFILL_THREADS: dict = {}
+_BACKFILL_LOCK = threading.Lock()
+
+# Optional in-process continuous sync (KLINE_SYNC_DAEMON=1); otherwise run kline_sync_daemon.py separately.
+_SYNC_DAEMON: Optional[KlineSyncDaemon] = None
+
 
 def _utc_now_iso() -> str:
     return datetime.now(timezone.utc).isoformat()
@@ -467,7 +485,7 @@ def api_kline_options():
     allowed_range_timeframes = sorted({*DAY_TIMEFRAMES, *RANGE_TIMEFRAMES})
     return jsonify(
         {
-            "symbols": KLINE_SYMBOLS,
+            "symbols": get_instrument_catalog().symbols(),
             "day_timeframes": sorted(DAY_TIMEFRAMES),
             "range_timeframes": allowed_range_timeframes,
             "default_tz": "Asia/Shanghai",
@@ -482,15 +500,19 @@ def api_kline_sync():
     sync_type = _normalize_sync_type(body.get("sync_type"))
     timeframe = normalize_timeframe(body.get("timeframe"))
     tz_name = str(body.get("tz") or "Asia/Shanghai").strip()
+    # Re-download the whole window even when the sync watermark says it is complete.
+    force = bool(body.get("force"))
 
     if not timeframe:
         return jsonify({"error": "invalid timeframe"}), 400
 
-    if symbol not in KLINE_SYMBOLS:
+    if not is_supported_symbol(symbol):
         return jsonify({"error": f"unsupported symbol: {symbol}"}), 400
 
     try:
-        if sync_type == "day":
+        if sync_type == "now":
+            result = sync_to_now(symbol=symbol, timeframe=timeframe)
+        elif sync_type == "day":
             if timeframe not in DAY_TIMEFRAMES:
                 return jsonify({"error": "day sync only supports 1m, 5m, 15m, 1H"}), 400
 
@@ -498,7 +520,7 @@ def api_kline_sync():
             if not day_text:
                 return jsonify({"error": "date is required (YYYY-MM-DD)"}), 400
 
-            result = sync_day_kline(symbol=symbol, timeframe=timeframe, day_text=day_text, tz_name=tz_name)
+            result = sync_day_kline(symbol=symbol, timeframe=timeframe, day_text=day_text, tz_name=tz_name, force=force)
         else:
             allowed_range_timeframes = {*DAY_TIMEFRAMES, *RANGE_TIMEFRAMES}
             if timeframe not in allowed_range_timeframes:
@@ -515,8 +537,10 @@ def api_kline_sync():
                 start_text=start_date,
                 end_text=end_date,
                 tz_name=tz_name,
+                force=force,
             )
 
+        invalidate_kline_cache(symbol=symbol, timeframe=timeframe)
         return jsonify({"ok": True, "message": "kline sync completed", "result": result})
     except ValueError as exc:
         return jsonify({"error": str(exc)}), 400
@@ -524,6 +548,173 @@ def api_kline_sync():
         return jsonify({"error": f"kline sync failed: {exc}"}), 500
 
 
+@app.post("/api/kline/sync/batch")
+def api_kline_sync_batch():
+    body = request.get_json(silent=True) or {}
+    symbols = body.get("symbols") or KLINE_SYMBOLS
+    timeframes = body.get("timeframes") or sorted(DAY_TIMEFRAMES)
+    tz_name = str(body.get("tz") or "Asia/Shanghai").strip()
+    ranges = body.get("ranges") or [{"start_date": body.get("start_date"), "end_date": body.get("end_date")}]
+    force = bool(body.get("force"))
+    workers = body.get("workers")
+
+    if not isinstance(symbols, list) or not isinstance(timeframes, list) or not isinstance(ranges, list):
+        return jsonify({"error": "symbols, timeframes and ranges must be lists"}), 400
+    unsupported = [s for s in symbols if not isinstance(s, str) or not is_supported_symbol(s)]
+    if unsupported:
+        return jsonify({"error": f"unsupported symbol: {', '.join(map(str, unsupported))}"}), 400
+    normalized = [normalize_timeframe(tf) for tf in timeframes]
+    allowed_range_timeframes = {*DAY_TIMEFRAMES, *RANGE_TIMEFRAMES}
+    if not all(tf in allowed_range_timeframes for tf in normalized):
+        return jsonify({"error": "batch sync supports 1m, 5m, 15m, 1H, 1D, 1M"}), 400
+    try:
+        pairs = []
+        for item in ranges:
+            start_date = str((item or {}).get("start_date") or "").strip()
+            end_date = str((item or {}).get("end_date") or "").strip()
+            if not start_date or not end_date:
+                return jsonify({"error": "every range needs start_date and end_date (YYYY-MM-DD)"}), 400
+            build_range_window(start_date, end_date, normalized[0], tz_name)
+            pairs.append((start_date, end_date))
+        workers = int(workers) if workers is not None else None
+    except (TypeError, ValueError) as exc:
+        return jsonify({"error": str(exc)}), 400
+
+    def generate():
+        try:
+            for event in run_batch_sync(symbols, normalized, pairs, tz_name, force=force, workers=workers):
+                if event["event"] == "done":
+                    for symbol in symbols:
+                        for tf in normalized:
+                            invalidate_kline_cache(symbol=symbol, timeframe=tf)
+                yield json.dumps(event, ensure_ascii=False) + "\n"
+        except Exception as exc:
+            yield json.dumps({"event": "error", "error": f"batch sync failed: {exc}"}, ensure_ascii=False) + "\n"
+
+    # One JSON object per line (NDJSON) as chunks finish.
+    return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+
+
+@app.post("/api/kline/gaps")
+def api_kline_gaps():
+    body = request.get_json(silent=True) or {}
+    symbols = body.get("symbols") or KLINE_SYMBOLS
+    timeframes = body.get("timeframes") or sorted(DAY_TIMEFRAMES)
+    tz_name = str(body.get("tz") or "Asia/Shanghai").strip()
+    start_date = str(body.get("start_date") or "").strip()
+    end_date = str(body.get("end_date") or "").strip()
+    repair = bool(body.get("repair"))
+
+    if not isinstance(symbols, list) or not isinstance(timeframes, list):
+        return jsonify({"error": "symbols and timeframes must be lists"}), 400
+    unsupported = [s for s in symbols if not isinstance(s, str) or not is_supported_symbol(s)]
+    if unsupported:
+        return jsonify({"error": f"unsupported symbol: {', '.join(map(str, unsupported))}"}), 400
+    normalized = [normalize_timeframe(tf) for tf in timeframes]
+    if not all(normalized) or "1M" in normalized:
+        return jsonify({"error": "gap scan supports 1m, 5m, 15m, 1H, 1D"}), 400
+    if not start_date or not end_date:
+        return jsonify({"error": "start_date and end_date are required (YYYY-MM-DD)"}), 400
+
+    try:
+        report = []
+        for tf in normalized:
+            start_ms, end_ms = build_range_window(start_date, end_date, tf, tz_name)
+            report.extend(gap_report(symbols, [tf], start_ms, end_ms, repair=repair))
+            if repair:
+                for symbol in symbols:
+                    invalidate_kline_cache(symbol=symbol, timeframe=tf)
+        return jsonify({"ok": True, "repair": repair, "series": report})
+    except ValueError as exc:
+        return jsonify({"error": str(exc)}), 400
+    except Exception as exc:
+        return jsonify({"error": f"gap scan failed: {exc}"}), 500
+
+
+@app.post("/api/kline/backfill")
+def api_kline_backfill():
+    body = request.get_json(silent=True) or {}
+    symbol = str(body.get("symbol") or "").strip()
+    timeframe = normalize_timeframe(body.get("timeframe"))
+    tz_name = str(body.get("tz") or "Asia/Shanghai").strip()
+    start_date = str(body.get("start_date") or "").strip()
+    end_date = str(body.get("end_date") or "").strip()
+
+    if not timeframe:
+        return jsonify({"error": "invalid timeframe"}), 400
+    if not is_supported_symbol(symbol):
+        return jsonify({"error": f"unsupported symbol: {symbol}"}), 400
+    if not start_date or not end_date:
+        return jsonify({"error": "start_date and end_date are required (YYYY-MM-DD)"}), 400
+    try:
+        start_ms, end_ms = build_range_window(start_date, end_date, timeframe, tz_name)
+    except ValueError as exc:
+        return jsonify({"error": str(exc)}), 400
+
+    key = (symbol, timeframe, start_ms, end_ms)
+
+    def worker():
+        try:
+            run_backfill(symbol, timeframe, start_ms, end_ms)
+            invalidate_kline_cache(symbol=symbol, timeframe=timeframe)
+        except Exception as exc:
+            print(f"[warn] backfill {key} failed: {exc}")
+
+    with _BACKFILL_LOCK:
+        running = _BACKFILL_THREADS.get(key)
+        if running is not None and running.is_alive():
+            return jsonify({"ok": False, "message": "backfill already running"})
+        thread = threading.Thread(target=worker, name=f"backfill-{symbol}-{timeframe}", daemon=True)
+        _BACKFILL_THREADS[key] = thread
+        thread.start()
+    return jsonify({"ok": True, "message": "backfill started", "start_ms": start_ms, "end_ms": end_ms})
+
+
+@app.get("/api/kline/backfill")
+def api_kline_backfill_jobs():
+    try:
+        return jsonify({"jobs": list_backfill_jobs(request.args.get("status"))})
+    except Exception as exc:
+        return jsonify({"error": f"cannot list backfill jobs: {exc}"}), 500
+
+
+@app.get("/api/instruments")
+def api_instruments():
+    catalog = get_instrument_catalog()
+    if request.args.get("refresh") == "1":
+        catalog.refresh(force=True)
+    symbols = catalog.symbols()
+    return jsonify({**catalog.info(), "instruments": [{"symbol": s, **(catalog.get(s) or {})} for s in symbols]})
+
+
+@app.get("/api/kline/http_stats")
+def api_kline_http_stats():
+    return jsonify(get_http_stats())
+
+
+@app.get("/metrics")
+def metrics():
+    # Process-wide sync counters for Prometheus; standalone daemons/CLIs keep their own.
+    return Response(render_prometheus_metrics(), mimetype="text/plain; version=0.0.4")
+
+
+@app.get("/api/kline/sync_status")
+def api_kline_sync_status():
+    if _SYNC_DAEMON is not None and _SYNC_DAEMON.running:
+        return jsonify({"ok": True, "source": "daemon", "series": _SYNC_DAEMON.status()})
+    # The daemon may run as its own process; lag is derived from the shared sync state table.
+    try:
+        conn = mysql_connect(get_mysql_config())
+        try:
+            ensure_schema(conn)
+            series = sync_lag(conn, sync_universe(), ALL_TIMEFRAMES)
+        finally:
+            conn.close()
+        return jsonify({"ok": True, "source": "sync_state", "series": series})
+    except Exception as exc:
+        return jsonify({"error": f"sync status failed: {exc}"}), 500
+
+
 @app.get("/api/backtest/options")
 def api_backtest_options():
     strategies = []
@@ -548,7 +739,7 @@ def api_backtest_options():
     strategies.sort(key=lambda item: item["id"])
     return jsonify(
         {
-            "symbols": KLINE_SYMBOLS,
+            "symbols": get_instrument_catalog().symbols(),
             "timeframes": sorted({*DAY_TIMEFRAMES, *RANGE_TIMEFRAMES}),
             "strategies": strategies,
             "default_tz": "Asia/Shanghai",
@@ -566,7 +757,7 @@ def api_backtest_options():
 def api_backtest_run():
     body = request.get_json(silent=True) or {}
     symbol = str(body.get("symbol") or "XRP/USDT:USDT").strip()
-    timeframe = normalize_timeframe(body.get("timeframe"))
+    timeframe = normalize_bar_type(body.get("timeframe"))
     tz_name = str(body.get("tz") or "Asia/Shanghai").strip()
     start_date = str(body.get("start_date") or "").strip()
     end_date = str(body.get("end_date") or "").strip()
@@ -595,7 +786,7 @@ def api_backtest_run():
 
     if not timeframe:
         return jsonify({"error": "invalid timeframe"}), 400
-    if symbol not in KLINE_SYMBOLS:
+    if not is_supported_symbol(symbol):
         return jsonify({"error": f"unsupported symbol: {symbol}"}), 400
     if not start_date or not end_date:
         return jsonify({"error": "start_date and end_date are required (YYYY-MM-DD)"}), 400
@@ -627,8 +818,55 @@ def api_backtest_run():
         return jsonify({"error": f"backtest failed: {exc}"}), 500
 
 
+@app.post("/api/backtest/sensitivity")
+def api_backtest_sensitivity():
+    body = request.get_json(silent=True) or {}
+    symbol = str(body.get("symbol") or "XRP/USDT:USDT").strip()
+    timeframe = normalize_bar_type(body.get("timeframe"))
+    tz_name = str(body.get("tz") or "Asia/Shanghai").strip()
+    start_date = str(body.get("start_date") or "").strip()
+    end_date = str(body.get("end_date") or "").strip()
+    strategy_id = str(body.get("strategy_id") or "ma_crossover").strip()
+    params = body.get("params") if isinstance(body.get("params"), dict) else {}
+
+    if not timeframe:
+        return jsonify({"error": "invalid timeframe"}), 400
+    if not is_supported_symbol(symbol):
+        return jsonify({"error": f"unsupported symbol: {symbol}"}), 400
+    if not start_date or not end_date:
+        return jsonify({"error": "start_date and end_date are required (YYYY-MM-DD)"}), 400
+    if strategy_id not in BACKTEST_STRATEGIES:
+        return jsonify({"error": f"unknown strategy: {strategy_id}"}), 400
+
+    try:
+        # Each of leverages / fee_bps / slippage_bps may be a number or a list of numbers.
+        result = backtest_sensitivity_from_dates(
+            symbol=symbol,
+            timeframe=timeframe,
+            start_date=start_date,
+            end_date=end_date,
+            tz_name=tz_name,
+            strategy_id=strategy_id,
+            params=params,
+            leverages=body.get("leverages", body.get("leverage")),
+            fee_bps=body.get("fee_bps"),
+            slippage_bps=body.get("slippage_bps"),
+        )
+        return jsonify({"ok": True, "result": result})
+    except ValueError as exc:
+        return jsonify({"error": str(exc)}), 400
+    except Exception as exc:
+        return jsonify({"error": f"sensitivity backtest failed: {exc}"}), 500
+
+
 if __name__ == "__main__":
     host = os.getenv("WEB_MANAGER_HOST", "127.0.0.1")
     port = int(os.getenv("WEB_MANAGER_PORT", "8080"))
     debug = os.getenv("WEB_MANAGER_DEBUG", "0") == "1"
+    # With the debug reloader only the serving child process runs the daemon.
+    if os.getenv("KLINE_SYNC_DAEMON", "0") == "1" and (not debug or os.getenv("WERKZEUG_RUN_MAIN") == "true"):
+        _SYNC_DAEMON = KlineSyncDaemon(
+            on_synced=lambda symbol, tf, result: invalidate_kline_cache(symbol=symbol, timeframe=tf)
+        )
+        _SYNC_DAEMON.start()
     app.run(host=host, port=port, debug=debug)